@@ -0,0 +1,95 @@
+'''
+Benchmark: sparse eigenvector and betweenness centrality vs networkx.
+
+Checks that the eigenvector top-k words agree with networkx's eigenvector_centrality_numpy on
+every canticle and the whole poem, and times ARPACK, the power iteration and a warm-started
+power iteration. Then times sampled betweenness against nx.betweenness_centrality, checks the
+result does not depend on the number of workers, and shows how many sources the adaptive
+stopping rule needs on each canticle (and how many of its top words are those of k=1000).
+
+Run from the repo root:
+    python -m benchmarks.bench_centrality
+'''
+
+import time
+import tracemalloc
+
+import networkx as nx
+import numpy as np
+
+from src.centrality_measures import betweenness_centrality_sparse, eigenvector_centrality_sparse, weighted_adjacency
+from src.corpus import load_corpus
+from src.create_networks import create_sparse_networks_from_corpus
+
+
+def timed(func, trace_memory=False):
+    # tracemalloc slows pure-Python code a lot, so peak memory is only measured when asked for
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] if trace_memory else 0
+    if trace_memory:
+        tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def top_k(labels, values, k):
+    return [labels[i] for i in np.argsort(-np.asarray(values), kind='stable')[:k]]
+
+
+def bench_eigenvector(networks, top_n):
+    for title, network in networks:
+        G = network.to_networkx()
+        reference, t_nx, m_nx = timed(lambda: nx.eigenvector_centrality_numpy(G, weight='weight'), trace_memory=True)
+        nodes, W = weighted_adjacency(network)
+        arpack, t_arpack, m_arpack = timed(lambda: eigenvector_centrality_sparse(W), trace_memory=True)
+        power, t_power, _ = timed(lambda: eigenvector_centrality_sparse(W, method='power', tol=1e-10))
+        # Warm start from a slightly perturbed solution, as for a similar graph
+        v0 = power * np.random.default_rng(0).uniform(0.9, 1.1, len(power))
+        _, t_warm, _ = timed(lambda: eigenvector_centrality_sparse(W, v0=v0, method='power', tol=1e-10))
+
+        expected = top_k(list(reference), list(reference.values()), top_n)
+        assert top_k(nodes, arpack, top_n) == expected, title
+        assert top_k(nodes, power, top_n) == expected, title
+        print(f'{title:<11} ({W.shape[0]} nodes): top-{top_n} match networkx | '
+              f'networkx {t_nx * 1e3:6.1f} ms, {m_nx / 2**20:5.1f} MiB | '
+              f'arpack {t_arpack * 1e3:6.1f} ms, {m_arpack / 2**20:5.1f} MiB | '
+              f'power {t_power * 1e3:6.1f} ms | warm power {t_warm * 1e3:6.1f} ms')
+
+
+def bench_adaptive_stop(networks, top_n):
+    print(f'\nAdaptive stop (batches of 50 sources, stable for 3 batches), top-{top_n} words shared with k=1000:')
+    for title, network in networks:
+        nodes, W = weighted_adjacency(network)
+        (b_all, _), t_all, _ = timed(lambda: betweenness_centrality_sparse(W, k=1000, seed=0))
+        expected = set(top_k(nodes, b_all, top_n))
+        for tol in (0.1, 0.05, 0.01):
+            (b_tol, used), t_tol, _ = timed(lambda: betweenness_centrality_sparse(W, k=1000, seed=0, tol=tol, top_n=top_n))
+            shared = len(expected & set(top_k(nodes, b_tol, top_n)))
+            print(f'  {title:<11} tol={tol}: stopped after {used:4} of 1000 sources in {t_tol:5.2f} s '
+                  f'(all 1000: {t_all:5.2f} s), {shared}/{top_n} top words shared')
+
+
+def bench_betweenness(network, k, top_n):
+    G = network.to_networkx()
+    _, t_nx, _ = timed(lambda: nx.betweenness_centrality(G, weight='weight', k=k, seed=0))
+    nodes, W = weighted_adjacency(network)
+    (b1, _), t_1, _ = timed(lambda: betweenness_centrality_sparse(W, k=k, seed=0, workers=1))
+    (b_pool, _), t_pool, _ = timed(lambda: betweenness_centrality_sparse(W, k=k, seed=0))
+    assert np.array_equal(b1, b_pool)
+    print(f'\nBetweenness, Inferno, k={k}: networkx {t_nx:6.2f} s | sparse 1 worker {t_1:6.2f} s | '
+          f'sparse pool {t_pool:6.2f} s (identical result)')
+
+
+def main(top_n=10):
+    corpus = load_corpus('divine_comedy.txt')
+    N_inferno, N_paradiso, N_purgatorio, N_whole = create_sparse_networks_from_corpus(corpus)
+    bench_eigenvector((('Inferno', N_inferno), ('Purgatorio', N_purgatorio), ('Paradiso', N_paradiso), ('Whole poem', N_whole)), top_n)
+    bench_betweenness(N_inferno, k=100, top_n=top_n)
+    bench_adaptive_stop((('Inferno', N_inferno), ('Purgatorio', N_purgatorio), ('Paradiso', N_paradiso)), top_n)
+
+
+if __name__ == '__main__':
+    main()
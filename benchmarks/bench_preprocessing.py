@@ -0,0 +1,67 @@
+'''
+Benchmark: streaming preprocessor vs preprocessing().
+
+Checks that stream_canti() yields exactly the canti of preprocessing() + split_canticle_into_canti,
+then times both and measures their peak memory (tracemalloc) on the poem and on a file made of
+several copies of it, each copy starting a new set of canticles.
+
+Run from the repo root:
+    python -m benchmarks.bench_preprocessing [--copies 20]
+'''
+
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+from src.entropy_analysis import split_canticle_into_canti
+from src.preprocessing import CANTICLES, preprocessing, stream_canti
+
+
+def legacy_canti(path):
+    canti = []
+    for canticle, text in zip(CANTICLES, preprocessing(path)[:3]):
+        canti.extend((canticle, number, canto) for number, canto in enumerate(split_canticle_into_canti(text), start=1))
+    return canti
+
+
+def measure(func):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--copies', type=int, default=20)
+    args = parser.parse_args()
+
+    assert list(stream_canti('divine_comedy.txt')) == legacy_canti('divine_comedy.txt')
+    print('stream_canti matches preprocessing() + split_canticle_into_canti')
+
+    _, t_legacy, peak_legacy = measure(lambda: legacy_canti('divine_comedy.txt'))
+    n_canti, t_stream, peak_stream = measure(lambda: sum(1 for _ in stream_canti('divine_comedy.txt')))
+    print(f'divine_comedy.txt: preprocessing {t_legacy:5.2f} s, peak {peak_legacy / 1e6:6.1f} MB | '
+          f'stream_canti {t_stream:5.2f} s, peak {peak_stream / 1e6:6.1f} MB ({n_canti} canti)')
+
+    # preprocessing() only reads the first set of canticles, so only the streaming version is run on the copies
+    with open('divine_comedy.txt', 'r', encoding='utf-8') as file:
+        text = file.read()
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'copies.txt')
+        with open(path, 'w', encoding='utf-8') as file:
+            for _ in range(args.copies):
+                file.write(text)
+        size = os.path.getsize(path)
+        n_canti, t_stream, peak_stream = measure(lambda: sum(1 for _ in stream_canti(path)))
+        print(f'{args.copies} copies ({size / 1e6:.1f} MB): stream_canti {t_stream:5.2f} s, '
+              f'peak {peak_stream / 1e6:6.1f} MB ({n_canti} canti)')
+
+
+if __name__ == '__main__':
+    main()
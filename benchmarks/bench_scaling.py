@@ -0,0 +1,156 @@
+'''
+Benchmark: how the public analysis functions scale with the size of the text.
+
+Builds corpora at 1x, 10x and 100x the size of divine_comedy.txt, both by replicating the poem
+and with the Zipf text generator (benchmarks/corpora.py), and times preprocessing,
+create_networks, top_centrality_measures_weighted (Inferno network), freq_dist and
+evaluate_canti_entropy (Inferno, figure saved to a temporary directory) on each. Each function
+gets the previous function's output, so only the function itself is timed. The median of
+--repeats runs (a single run from 100x up) is written to a JSON file.
+
+With --baseline, every (function, corpus, scale) is compared with the baseline file and the
+script exits with status 1 if one got more than --threshold slower (and by at least
+--min-seconds, to ignore noise on the fast ones). --save-baseline writes the results as the
+new baseline.
+
+Run from the repo root:
+    python -m benchmarks.bench_scaling [--scales 1 10 100] [--corpora replicated zipf] [--repeats 3]
+        [--output bench_scaling.json] [--baseline benchmarks/baseline_scaling.json] [--threshold 0.25]
+'''
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.corpora import replicate_poem, zipf_poem
+from src.centrality_measures import top_centrality_measures_weighted
+from src.create_networks import create_networks
+from src.entropy_analysis import evaluate_canti_entropy
+from src.frequency_analysis import freq_dist
+from src.preprocessing import preprocessing
+from src.rendering import configure_headless
+
+FUNCTIONS = ('preprocessing', 'create_networks', 'top_centrality_measures_weighted', 'freq_dist', 'evaluate_canti_entropy')
+
+
+def median_time(func, repeats):
+    times, result = [], None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return result, statistics.median(times)
+
+
+def bench_corpus(path, repeats, functions):
+    """
+    Yield (function, median seconds, tokens in the corpus) for one corpus file, as each function finishes.
+    """
+    # preprocessing always runs, since every other function takes its output
+    cleaned, seconds = median_time(lambda: preprocessing(path), repeats)
+    inferno_clean, purgatorio_clean, paradiso_clean, whole_clean = cleaned
+    n_tokens = len(whole_clean.split())
+    if 'preprocessing' in functions:
+        yield 'preprocessing', seconds, n_tokens
+    if 'create_networks' in functions or 'top_centrality_measures_weighted' in functions:
+        networks, seconds = median_time(
+            lambda: create_networks(inferno_clean, purgatorio_clean, paradiso_clean, whole_clean), repeats)
+        if 'create_networks' in functions:
+            yield 'create_networks', seconds, n_tokens
+        if 'top_centrality_measures_weighted' in functions:
+            _, seconds = median_time(lambda: top_centrality_measures_weighted(networks[0]), repeats)
+            yield 'top_centrality_measures_weighted', seconds, n_tokens
+        del networks
+    if 'freq_dist' in functions:
+        _, seconds = median_time(lambda: freq_dist(inferno_clean, purgatorio_clean, paradiso_clean), repeats)
+        yield 'freq_dist', seconds, n_tokens
+    if 'evaluate_canti_entropy' in functions:
+        # It prints the number of canti of each canticle, which is not part of the benchmark output
+        with contextlib.redirect_stdout(io.StringIO()):
+            _, seconds = median_time(
+                lambda: evaluate_canti_entropy(inferno_clean, purgatorio_clean, paradiso_clean, n=2, canticle='inferno'), repeats)
+        yield 'evaluate_canti_entropy', seconds, n_tokens
+
+
+def compare(results, baseline, threshold, min_seconds):
+    """
+    The results that are more than `threshold` (a fraction) and `min_seconds` slower than the baseline.
+    """
+    reference = {(row['function'], row['corpus'], row['scale']): row['seconds'] for row in baseline['results']}
+    regressions = []
+    for row in results:
+        before = reference.get((row['function'], row['corpus'], row['scale']))
+        if before is not None and row['seconds'] > before * (1 + threshold) and row['seconds'] - before > min_seconds:
+            regressions.append((row, before))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--corpora', nargs='+', default=['replicated', 'zipf'], choices=['replicated', 'zipf'])
+    parser.add_argument('--functions', nargs='+', default=list(FUNCTIONS), choices=FUNCTIONS)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0, help='seed of the Zipf text generator')
+    parser.add_argument('--output', default='bench_scaling.json')
+    parser.add_argument('--baseline', default=None, help='JSON results of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed slowdown against the baseline (0.25 = 25%%)')
+    parser.add_argument('--min-seconds', type=float, default=0.05, help='ignore slowdowns smaller than this')
+    parser.add_argument('--save-baseline', default=None, help='also write the results to this baseline file')
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        # evaluate_canti_entropy draws a figure: save it here instead of opening a window
+        configure_headless(os.path.join(directory, 'figures'))
+        for corpus in args.corpora:
+            for scale in args.scales:
+                path = os.path.join(directory, f'{corpus}_{scale}x.txt')
+                if corpus == 'replicated':
+                    replicate_poem(path, scale)
+                else:
+                    zipf_poem(path, scale=scale, seed=args.seed)
+                # The largest corpora take minutes per function, so they are timed once
+                repeats = args.repeats if scale < 100 else 1
+                for function, seconds, n_tokens in bench_corpus(path, repeats, args.functions):
+                    results.append({'function': function, 'corpus': corpus, 'scale': scale,
+                                    'n_tokens': n_tokens, 'seconds': seconds})
+                    print(f'{corpus:<11}{scale:>4}x {n_tokens:>10} tokens  {function:<34}{seconds:>9.3f} s', flush=True)
+                os.remove(path)
+
+    report = {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'repeats': args.repeats,
+        'results': results,
+    }
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+        print(f'Results written to {path}')
+
+    if args.baseline is not None:
+        with open(args.baseline, 'r', encoding='utf-8') as file:
+            baseline = json.load(file)
+        regressions = compare(results, baseline, args.threshold, args.min_seconds)
+        for row, before in regressions:
+            print(f"REGRESSION {row['function']} on {row['corpus']} {row['scale']}x: "
+                  f"{before:.3f} s -> {row['seconds']:.3f} s (+{row['seconds'] / before - 1:.0%})")
+        if regressions:
+            sys.exit(1)
+        print(f'No regression above {args.threshold:.0%} against {args.baseline}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+'''
+Benchmark: one-pass sliding-window entropy profile vs recomputing every window.
+
+Checks windows spread over the whole poem against ngram_entropy on the same tokens, then times
+the profile for several window sizes and n-gram orders in one pass against recomputing each
+window from scratch (timed on a sample of windows and scaled up to all of them).
+
+Run from the repo root:
+    python -m benchmarks.bench_sliding_entropy [--windows 250 1000 4000] [--ns 1 2 3]
+'''
+
+import argparse
+import time
+
+import numpy as np
+
+from src.corpus import load_corpus
+from src.entropy_analysis import entropy_profile_from_corpus, ngram_entropy
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--windows', type=int, nargs='+', default=[250, 1000, 4000])
+    parser.add_argument('--ns', type=int, nargs='+', default=[1, 2, 3])
+    parser.add_argument('--sample', type=int, default=200, help='windows recomputed from scratch per setting')
+    args = parser.parse_args()
+
+    corpus = load_corpus('divine_comedy.txt')
+    token_ids = np.asarray(corpus.token_ids)
+
+    start = time.perf_counter()
+    profile = entropy_profile_from_corpus(corpus, windows=args.windows, ns=args.ns)
+    t_profile = time.perf_counter() - start
+    print(f'{len(token_ids)} tokens, {len(profile)} settings in one pass: {t_profile:.2f} s')
+
+    rng = np.random.default_rng(0)
+    t_scratch = 0.0
+    for (W, n), entropies in sorted(profile.items()):
+        assert len(entropies) == len(token_ids) - W + 1
+        windows = rng.integers(0, len(entropies), size=args.sample)
+        start = time.perf_counter()
+        expected = np.array([ngram_entropy(token_ids[i:i + W], n=n) for i in windows])
+        elapsed = (time.perf_counter() - start) * len(entropies) / args.sample
+        t_scratch += elapsed
+        error = np.abs(entropies[windows] - expected).max()
+        assert error < 1e-9, (W, n, error)
+        print(f'W = {W:>5}, n = {n}: {len(entropies)} windows, max error {error:.1e}, '
+              f'from scratch ~{elapsed:7.1f} s')
+    print(f'From scratch (estimated): {t_scratch:.1f} s | one pass: {t_profile:.2f} s | '
+          f'speed-up ~{t_scratch / t_profile:.0f}x')
+
+
+if __name__ == '__main__':
+    main()
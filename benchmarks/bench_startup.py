@@ -0,0 +1,90 @@
+'''
+Benchmark: import time of the src modules.
+
+Imports each module in a fresh interpreter (several times, keeping the median), checks that
+importing it does not load nltk, networkx or matplotlib and does not touch the network, and
+fails if the median import time is above a threshold. Run it after changing imports to catch
+startup regressions on the batch nodes.
+
+Run from the repo root:
+    python -m benchmarks.bench_startup [--max-seconds 1.0] [--repeats 5]
+'''
+
+import argparse
+import statistics
+import subprocess
+import sys
+
+MODULES = (
+    'src.preprocessing',
+    'src.tokenizer',
+    'src.corpus',
+    'src.nltk_resources',
+    'src.create_networks',
+    'src.entropy_analysis',
+    'src.frequency_analysis',
+    'src.display_network',
+    'src.centrality_measures',
+    'src.rendering',
+    'src.pipeline',
+    'src.instrumentation',
+    'src.batch',
+    'src.null_models',
+    'src.temporal_network',
+    'src.frequency_sketch',
+    'main',
+)
+
+# Modules that should only be imported by the stages that need them
+DEFERRED = ('nltk', 'networkx', 'matplotlib')
+
+# Imports the module, then reports the elapsed time and which deferred modules got loaded.
+# socket.socket is replaced so any attempt to open a connection fails loudly.
+PROBE = '''
+import socket, sys, time
+class _NoNetwork(socket.socket):
+    def connect(self, *args, **kwargs):
+        raise RuntimeError('network access during import')
+socket.socket = _NoNetwork
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+loaded = [name for name in {deferred!r} if name in sys.modules]
+print(elapsed, ','.join(loaded))
+'''
+
+
+def import_time(module):
+    output = subprocess.run(
+        [sys.executable, '-c', PROBE.format(module=module, deferred=DEFERRED)],
+        capture_output=True, text=True, check=True,
+    ).stdout.split()
+    return float(output[0]), output[1].split(',') if len(output) > 1 else []
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--max-seconds', type=float, default=1.0, help='fail if a module takes longer than this to import')
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    failures = []
+    for module in MODULES:
+        times, loaded = [], []
+        for _ in range(args.repeats):
+            elapsed, loaded = import_time(module)
+            times.append(elapsed)
+        median = statistics.median(times)
+        print(f'{module:26s} {median * 1e3:8.1f} ms' + (f'  (loads {", ".join(loaded)})' if loaded else ''))
+        if median > args.max_seconds:
+            failures.append(f'{module} took {median:.2f} s to import (limit {args.max_seconds:.2f} s)')
+        if loaded:
+            failures.append(f'{module} imports {", ".join(loaded)} at module load')
+
+    for failure in failures:
+        print('FAIL:', failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
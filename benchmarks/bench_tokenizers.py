@@ -0,0 +1,46 @@
+'''
+Benchmark: tokenizer backends (src/tokenizer.py).
+
+Prints the equivalence report of every backend against the default on the cleaned canticles,
+then the throughput of each backend (MB/s and million tokens/s) on the whole cleaned poem.
+The nltk backend is skipped if its punkt data is not installed.
+
+Run from the repo root:
+    python -m benchmarks.bench_tokenizers
+'''
+
+import time
+
+from src.preprocessing import preprocessing
+from src.tokenizer import DEFAULT_TOKENIZER, TOKENIZERS, equivalence_report, print_equivalence_report, tokenize
+
+
+def throughput(text, name, repeats=5):
+    # Best of a few runs, in MB/s and million tokens/s
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        tokens = tokenize(text, name)
+        best = min(best, time.perf_counter() - start)
+    return len(text.encode('utf-8')) / best / 1e6, len(tokens) / best / 1e6, best
+
+
+def main():
+    inferno_clean, purgatorio_clean, paradiso_clean, whole_clean = preprocessing('divine_comedy.txt')
+    texts = {'Inferno': inferno_clean, 'Purgatorio': purgatorio_clean, 'Paradiso': paradiso_clean}
+
+    print(f'Equivalence against {DEFAULT_TOKENIZER!r}:')
+    print_equivalence_report(equivalence_report(texts, tuple(TOKENIZERS)), reference=DEFAULT_TOKENIZER)
+
+    print('\nThroughput on the whole poem:')
+    for name in TOKENIZERS:
+        try:
+            mb_per_s, mtokens_per_s, seconds = throughput(whole_clean, name, repeats=1 if name == 'nltk' else 5)
+        except LookupError as error:
+            print(f'  {name:6s} skipped: {error}')
+            continue
+        print(f'  {name:6s} {seconds * 1e3:9.1f} ms  {mb_per_s:7.1f} MB/s  {mtokens_per_s:6.2f} M tokens/s')
+
+
+if __name__ == '__main__':
+    main()
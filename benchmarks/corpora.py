@@ -0,0 +1,114 @@
+'''
+Corpora for the benchmarks, written in the layout of divine_comedy.txt (a header, then each
+canticle name in capitals followed by its canti, each canto starting with a heading such as
+'Inferno • Canto I'), so preprocessing(), stream_canti() and load_corpus() read them like the poem.
+
+- replicate_poem: the poem with the body of every canticle repeated `copies` times. The
+  vocabulary and the set of bigrams stay the same, only the counts grow.
+- zipf_poem: synthetic text whose words are drawn from a Zipf distribution (frequency of the
+  word of rank r proportional to r^-exponent) over a generated vocabulary, with as many canti as
+  the poem. The vocabulary grows with the text (Heaps' law), so the networks grow too.
+'''
+
+import re
+
+import numpy as np
+
+from src.preprocessing import CANTICLES
+
+POEM_PATH = 'divine_comedy.txt'
+
+# Tokens and vocabulary of the poem after preprocessing, and its canti per canticle
+POEM_TOKENS = 97171
+POEM_VOCABULARY = 13565
+POEM_CANTI = {'inferno': 34, 'purgatorio': 33, 'paradiso': 33}
+
+SYLLABLES = (
+    'a', 'e', 'i', 'o', 'u', 'ba', 'be', 'bi', 'bo', 'ca', 'che', 'chi', 'co', 'da', 'de', 'di', 'do', 'du',
+    'fa', 'fe', 'fi', 'fo', 'ga', 'ghe', 'gi', 'go', 'la', 'le', 'li', 'lo', 'lu', 'ma', 'me', 'mi', 'mo',
+    'na', 'ne', 'ni', 'no', 'pa', 'pe', 'pi', 'po', 'ra', 're', 'ri', 'ro', 'sa', 'se', 'si', 'so', 'ta',
+    'te', 'ti', 'to', 'tu', 'va', 've', 'vi', 'vo', 'za', 'ze', 'zi', 'gna', 'gli', 'sco', 'str', 'nte',
+)
+
+
+def roman(number):
+    numerals = ((100, 'C'), (90, 'XC'), (50, 'L'), (40, 'XL'), (10, 'X'), (9, 'IX'), (5, 'V'), (4, 'IV'), (1, 'I'))
+    digits = []
+    for value, numeral in numerals:
+        count, number = divmod(number, value)
+        digits.append(numeral * count)
+    return ''.join(digits)
+
+
+def split_poem(path=POEM_PATH):
+    """
+    (header, {canticle: body}) of the poem; each body starts after the canticle's marker line.
+    """
+    with open(path, 'r', encoding='utf-8') as file:
+        text = file.read()
+    markers = [re.search(rf'^ *{name.upper()} *$', text, flags=re.MULTILINE) for name in CANTICLES]
+    bodies = {}
+    for i, name in enumerate(CANTICLES):
+        end = markers[i + 1].start() if i + 1 < len(CANTICLES) else len(text)
+        bodies[name] = text[markers[i].end():end]
+    return text[:markers[0].start()], bodies
+
+
+def replicate_poem(out_path, copies, path=POEM_PATH):
+    header, bodies = split_poem(path)
+    with open(out_path, 'w', encoding='utf-8') as file:
+        file.write(header)
+        for name in CANTICLES:
+            file.write(f'  {name.upper()}\n')
+            for _ in range(copies):
+                file.write(bodies[name])
+    return out_path
+
+
+def make_vocabulary(size, rng):
+    """
+    `size` distinct made-up words of two to four syllables, none of them 'canto' or a canticle
+    name (which preprocessing() would remove).
+    """
+    words, seen = [], {'canto', *CANTICLES}
+    syllables = np.array(SYLLABLES)
+    while len(words) < size:
+        lengths = rng.integers(2, 5, size=size)
+        picks = rng.integers(0, len(syllables), size=(size, 4))
+        for length, row in zip(lengths, picks):
+            word = ''.join(syllables[row[:length]])
+            if word not in seen:
+                seen.add(word)
+                words.append(word)
+                if len(words) == size:
+                    break
+    return words
+
+
+def zipf_poem(out_path, scale=1.0, exponent=1.0, vocabulary_size=None, words_per_line=8, seed=0):
+    """
+    Synthetic poem with `scale` times as many tokens as the Divine Comedy. The vocabulary has
+    POEM_VOCABULARY * sqrt(scale) words unless vocabulary_size is given.
+    """
+    rng = np.random.default_rng(seed)
+    if vocabulary_size is None:
+        vocabulary_size = int(POEM_VOCABULARY * np.sqrt(scale))
+    words = np.array(make_vocabulary(vocabulary_size, rng))
+    # Zipf's law over the ranks, with the ranks assigned to the words at random
+    p = np.arange(1, vocabulary_size + 1, dtype=float) ** -exponent
+    p /= p.sum()
+    tokens_per_canto = max(words_per_line, int(POEM_TOKENS * scale / sum(POEM_CANTI.values())))
+
+    with open(out_path, 'w', encoding='utf-8') as file:
+        file.write('  LA DIVINA COMMEDIA\n  synthetic Zipf text\n\n\n\n')
+        for name in CANTICLES:
+            file.write(f'  {name.upper()}\n\n\n\n')
+            for canto in range(1, POEM_CANTI[name] + 1):
+                file.write(f'  {name.capitalize()} • Canto {roman(canto)}\n\n\n')
+                tokens = words[rng.choice(vocabulary_size, size=tokens_per_canto, p=p)]
+                lines = [' '.join(tokens[i:i + words_per_line]) for i in range(0, len(tokens), words_per_line)]
+                # Tercets, as in the poem
+                for i in range(0, len(lines), 3):
+                    file.write('  ' + '\n  '.join(lines[i:i + 3]) + '\n\n')
+                file.write('\n\n\n')
+    return out_path
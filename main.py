@@ -1,27 +1,251 @@
-from src.preprocessing import preprocessing
-from src.create_networks import create_networks
-from src.display_network import display_network
-from src.centrality_measures import plot_evaluate_centrality_measures
-from src.frequency_analysis import plot_freq_dist
-from src.entropy_analysis import evaluate_canti_entropy
-
-def main():
-    # reads in the txt file for the Divine comedy and does preprocessing (Accessed from Alighieri, D., Doré, G. and Cary, H.F. (2023) The divine comedy by Dante Alighieri, Project Gutenberg. Available at: https://www.gutenberg.org/ebooks/8800 (Accessed: 17 September 2024). )
-    inferno_clean, purgatorio_clean, paradiso_clean , whole_clean = preprocessing()
+import argparse
+from functools import partial
+
+from src.corpus import load_corpus
+from src.create_networks import create_networks_from_corpus
+from src.display_network import compute_layout, draw_network
+from src.centrality_measures import display_subgraph, evaluate_centrality, print_top_centrality_weighted
+from src.frequency_analysis import FREQUENCY_MODES, freq_dist_from_corpus, plot_freq_dists, print_zipf_table, zipf_exponents
+from src.entropy_analysis import (entropy_profile_from_corpus, entropy_rates_from_corpus, evaluate_all_canti_entropy,
+                                   plot_block_entropies, plot_entropy_profile, plot_entropy_table, print_block_entropy_table)
+from src import instrumentation
+from src.null_models import NULL_MODELS, centrality_significance_from_corpus, print_significance_table
+from src.batch import DEFAULT_BATCH_OUTPUT, corpus_name, find_texts, run_batch
+from src.pipeline import DEFAULT_PIPELINE_CACHE_DIR, Pipeline, print_timings
+from src.preprocessing import CANTICLES
+from src.temporal_network import plot_temporal_snapshots, print_temporal_snapshots, temporal_snapshots
+from src.rendering import DEFAULT_OUTPUT_DIR, FigureRenderer, render
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Network, frequency and entropy analysis of the Divine Comedy.')
+    parser.add_argument('--text', default='divine_comedy.txt', help='source text')
+    parser.add_argument('--n', type=int, default=2, help='n-gram order of the entropy analysis')
+    parser.add_argument('--windows', type=int, nargs='+', default=[250, 1000], help='window sizes (tokens) of the entropy profile')
+    parser.add_argument('--window-ns', type=int, nargs='+', default=[1, 2], help='n-gram orders of the entropy profile')
+    parser.add_argument('--max-n', type=int, default=20, help='largest n of the block entropies')
+    parser.add_argument('--window', type=int, default=1,
+                        help='link words up to this many tokens apart (1 is the word-adjacency network)')
+    parser.add_argument('--distance-weighted', action='store_true', help='with --window, weight each co-occurrence by 1 / distance')
+    parser.add_argument('--k', type=int, default=1000, help='sampled sources for betweenness centrality')
+    parser.add_argument('--null-model', choices=NULL_MODELS, default='shuffle', help='null model of the centrality significance')
+    parser.add_argument('--null-samples', type=int, default=200, help='null networks per canticle (0 skips the significance test)')
+    parser.add_argument('--seed', type=int, default=42, help='seed of every random step')
+    parser.add_argument('--n-bootstrap', type=int, default=100, help='bootstrap resamples of the Zipf fit')
+    parser.add_argument('--frequencies', choices=FREQUENCY_MODES, default='exact',
+                        help='word counts of the Zipf fit: exact, or bounded-memory sketches (approximate)')
+    parser.add_argument('--sketch-top-k', type=int, default=2000, help='words kept by the top-k sketch with --frequencies approximate')
+    parser.add_argument('--binned', action=argparse.BooleanOptionalAction, default=True, help='log-binned Zipf plots')
+    parser.add_argument('--cache-dir', default=DEFAULT_PIPELINE_CACHE_DIR, help='where stage results are memoized')
+    parser.add_argument('--no-cache', action='store_true', help='recompute every stage and save nothing')
+    parser.add_argument('--stage-workers', type=int, default=None, help='stages run at the same time (1 runs them in order)')
+    parser.add_argument('--headless', action='store_true',
+                        help='save the figures to --out-dir instead of showing them (no window is opened)')
+    parser.add_argument('--out-dir', default=DEFAULT_OUTPUT_DIR, help='output directory for --headless')
+    parser.add_argument('--formats', nargs='+', default=['png'], help='figure formats for --headless, e.g. png svg')
+    parser.add_argument('--render-workers', type=int, default=None,
+                        help='processes drawing the figures for --headless (1 draws them in the main process)')
+    parser.add_argument('--profile', nargs='?', const=instrumentation.DEFAULT_REPORT_PATH, default=None, metavar='REPORT',
+                        help='record wall/CPU time, calls and peak memory per stage and hot function to a JSON report '
+                             f'(default {instrumentation.DEFAULT_REPORT_PATH}; also enabled by {instrumentation.PROFILE_ENV_VAR})')
+    parser.add_argument('--cprofile-dir', default=None, help='with --profile, also save a cProfile dump per stage here')
+    parser.add_argument('--analysis-workers', type=int, default=None,
+                        help='processes used inside one analysis (betweenness, Zipf bootstrap, entropy); 1 runs them in-process '
+                             '(the default, unless --stage-workers 1, which leaves them one process per CPU)')
+    parser.add_argument('--batch', default=None, metavar='DIR',
+                        help='analyse every text in DIR on a process pool and write the numbers to --batch-output (no figures)')
+    parser.add_argument('--pattern', default='*.txt', help='file pattern of the texts for --batch')
+    parser.add_argument('--batch-output', default=DEFAULT_BATCH_OUTPUT, help='results file for --batch (.csv for CSV, otherwise JSON Lines)')
+    parser.add_argument('--batch-workers', type=int, default=None, help='corpora analysed at the same time for --batch')
+    parser.add_argument('--max-tasks-per-child', type=int, default=1,
+                        help='corpora a --batch worker process analyses before it is replaced (0 keeps it)')
+    return parser.parse_args(argv)
+
+# Stage functions: each takes the results of the stages it depends on, then its parameters
+
+def networks_by_canticle(corpus, window=1, distance_weighted=False):
+    G_inferno, G_paradiso, G_purgatorio, G_whole = create_networks_from_corpus(corpus, window, distance_weighted)
+    return {'inferno': G_inferno, 'purgatorio': G_purgatorio, 'paradiso': G_paradiso, 'whole': G_whole}
+
+def whole_poem_layout(networks):
+    # Cached under .cache/layouts by compute_layout itself
+    return compute_layout(networks['whole'])
+
+def canticle_centrality(networks, canticle, k=1000, seed=42, workers=None):
+    return evaluate_centrality(networks[canticle], k=k, seed=seed, workers=workers)
+
+def zipf_analysis(corpus, n_bootstrap=100, seed=42, workers=None, mode='exact', top_k=2000):
+    freq_dists = freq_dist_from_corpus(corpus, mode, **({'top_k': top_k} if mode == 'approximate' else {}))
+    table = zipf_exponents(dict(zip(('Inferno', 'Purgatorio', 'Paradiso'), freq_dists)), n_bootstrap=n_bootstrap, seed=seed, workers=workers)
+    return freq_dists, table
+
+def build_pipeline(args):
+    '''
+    The stages of the analysis and what they depend on:
 
+        corpus -> networks -> layout
+                           -> centrality_inferno, centrality_purgatorio, centrality_paradiso
+               -> significance_inferno, significance_purgatorio, significance_paradiso
+               -> temporal
+               -> zipf
+               -> entropy
+               -> entropy_profile
+               -> block_entropy
+    '''
+    pipeline = Pipeline(cache_dir=None if args.no_cache else args.cache_dir, workers=args.stage_workers)
+    # Only passed when set, so the cache keys of a normal run stay the same (the results do not depend on it)
+    workers = {} if args.analysis_workers is None else {'workers': args.analysis_workers}
+    # reads in the txt file for the Divine comedy and does preprocessing (Accessed from Alighieri, D., Doré, G. and Cary, H.F. (2023) The divine comedy by Dante Alighieri, Project Gutenberg. Available at: https://www.gutenberg.org/ebooks/8800 (Accessed: 17 September 2024). )
+    # The cleaned text is integer-encoded once and cached under .cache/corpus, so later runs skip preprocessing and tokenisation
+    pipeline.add('corpus', load_corpus, params={'path': args.text}, files=[args.text], memoize=False)
     # Turn txt into an adjacency network
-    G_inferno, G_paradiso, G_purgatorio, G_whole = create_networks(inferno_clean, purgatorio_clean, paradiso_clean , whole_clean)
-    
-    #visualise the network (commented out as it take a while to run)
-    #display_network(G_whole)
+    pipeline.add('networks', networks_by_canticle, inputs=['corpus'],
+                 params={'window': args.window, 'distance_weighted': args.distance_weighted})
+    pipeline.add('layout', whole_poem_layout, inputs=['networks'], memoize=False)
+    # measures of centrality, one independent stage per canticle
+    for canticle in CANTICLES:
+        pipeline.add(f'centrality_{canticle}', canticle_centrality, inputs=['networks'],
+                     params={'canticle': canticle, 'k': args.k, 'seed': args.seed, **workers})
+    # z-scores and p-values of the centralities against randomised networks, one stage per canticle
+    if args.null_samples > 0:
+        for canticle in CANTICLES:
+            pipeline.add(f'significance_{canticle}', centrality_significance_from_corpus, inputs=['corpus'],
+                         params={'canticle': canticle, 'model': args.null_model, 'n_samples': args.null_samples,
+                                 'seed': args.seed, 'window': args.window, 'distance_weighted': args.distance_weighted, **workers})
+    # the network of the poem so far after every canto, built incrementally
+    pipeline.add('temporal', temporal_snapshots, inputs=['corpus'])
+    # power-law fit of the word frequency distributions
+    # (with --frequencies approximate, from mergeable bounded-memory sketches, see src/frequency_sketch.py)
+    pipeline.add('zipf', zipf_analysis, inputs=['corpus'],
+                 params={'n_bootstrap': args.n_bootstrap, 'seed': args.seed, 'mode': args.frequencies, 'top_k': args.sketch_top_k, **workers})
+    # entropy for every canto of all three canticles using shannon entropy with n-grams of n (seeded, so the table is reproducible)
+    pipeline.add('entropy', evaluate_all_canti_entropy, inputs=['corpus'], params={'n': args.n, 'seed': args.seed, **workers})
+    # sliding-window entropy across the whole poem, for every window size and n in one pass
+    pipeline.add('entropy_profile', entropy_profile_from_corpus, inputs=['corpus'],
+                 params={'windows': tuple(args.windows), 'ns': tuple(args.window_ns)})
+    # block entropies up to n = --max-n and entropy-rate estimates from one suffix array of the whole poem (n-grams stay within a canto)
+    pipeline.add('block_entropy', entropy_rates_from_corpus, inputs=['corpus'], params={'max_n': args.max_n})
+    return pipeline
+
+def corpus_summary(path, args):
+    '''
+    The numbers of the analysis of one text, for the batch mode: corpus size, top centralities per
+    canticle (with their null-model z-scores and p-values), the Zipf table, the entropy per canto
+    and the entropy rates. Runs in a batch worker.
+    '''
+    args = argparse.Namespace(**dict(vars(args), text=path))
+    pipeline = build_pipeline(args)
+    corpus = pipeline.run(['corpus'])['corpus']
+    if len(corpus.token_ids) == 0:
+        raise ValueError(f'no canticle found in {path}')
+    significance = [f'significance_{canticle}' for canticle in CANTICLES] if args.null_samples > 0 else []
+    results = pipeline.run([f'centrality_{canticle}' for canticle in CANTICLES] + significance + ['zipf', 'entropy', 'block_entropy'])
+
+    centrality = {}
+    for canticle in CANTICLES:
+        top_weighted_degree, top_betweenness, top_eigenvector, _ = results[f'centrality_{canticle}']
+        centrality[canticle] = {'weighted_degree': dict(top_weighted_degree), 'betweenness': dict(top_betweenness),
+                                'eigenvector': dict(top_eigenvector)}
+        if significance:
+            table = results[f'significance_{canticle}']
+            rows = {word: row for word, row in zip(table['word'].tolist(), table)}
+            centrality[canticle]['significance'] = {
+                word: {f'{measure}_{stat}': rows[word][f'{measure}_{stat}'] for measure in ('eigenvector', 'weighted_degree') for stat in ('z', 'p')}
+                for word, _ in top_eigenvector if word in rows
+            }
+    entropy = results['entropy']
+    _, entropy_rates = results['block_entropy']
+    return {
+        'n_tokens': len(corpus.token_ids),
+        'n_vocabulary': len(corpus.vocab),
+        'centrality': centrality,
+        'zipf': {row['corpus']: {name: row[name] for name in ('alpha', 'beta', 'beta_low', 'beta_high', 'x_min', 'p_value',
+                                                              'beta_sketch_low', 'beta_sketch_high')}
+                 for row in results['zipf'][1]},
+        'entropy': {canticle: {'H_orig': entropy['H_orig'][entropy['canticle'] == canticle],
+                               'relative': entropy['relative'][entropy['canticle'] == canticle]} for canticle in CANTICLES},
+        'entropy_rate': entropy_rates,
+    }
+
+def batch(args):
+    paths = find_texts(args.batch, args.pattern)
+    if not paths:
+        raise SystemExit(f'No {args.pattern} files in {args.batch}')
+    # Each worker runs one corpus at a time, stage by stage, without process pools of its own
+    args.stage_workers = 1
+    if args.analysis_workers is None:
+        args.analysis_workers = 1
+    statuses = run_batch(paths, partial(corpus_summary, args=args), output=args.batch_output,
+                         workers=args.batch_workers, max_tasks_per_child=args.max_tasks_per_child or None)
+    failed = [corpus_name(path) for path, status in statuses.items() if status != 'ok']
+    print(f'{len(statuses) - len(failed)} of {len(paths)} corpora analysed, results in {args.batch_output}')
+    if failed:
+        print(f"Failed: {', '.join(failed)}")
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.batch is not None:
+        batch(args)
+        return
+    if args.profile is not None:
+        instrumentation.enable(args.profile, args.cprofile_dir)
+    if instrumentation.enabled() and args.stage_workers is None:
+        # One stage at a time, so the memory peaks of the stages do not overlap
+        args.stage_workers = 1
+    if args.analysis_workers is None and args.stage_workers != 1:
+        # Stages running side by side on threads would each start a process pool of their own
+        # (stages x CPUs processes), so they run their analyses in-process unless asked otherwise
+        args.analysis_workers = 1
+    if not args.headless:
+        run(args)
+        return
+    # The figures are drawn on a process pool while the analyses carry on, and their results are saved under
+    # <out-dir>/results so they can be redrawn with src.rendering.render_saved
+    with FigureRenderer(args.out_dir, args.formats, workers=args.render_workers) as renderer:
+        run(args, renderer)
+    print(f'Saved {len(renderer.paths)} figures to {args.out_dir}')
+
+def run(args, renderer=None):
+    # Every stage is memoized under --cache-dir, so changing one parameter only recomputes the stages that depend on it
+    pipeline = build_pipeline(args)
+    results = pipeline.run()
+
+    #visualise the network (the layout is cached under .cache/layouts, so only the first run computes it)
+    layout = results['layout']
+    render(renderer, draw_network, results['networks']['whole'], layout, name='network')
+
+    #Display the measures of centrality (plotting only the eigenvector centrality); the subgraphs start from the whole-poem layout
+    for canticle in CANTICLES:
+        top_weighted_degree, top_betweenness, top_eigenvector, _ = results[f'centrality_{canticle}']
+        print_top_centrality_weighted(canticle.capitalize(), top_weighted_degree, top_betweenness, top_eigenvector)
+    for canticle in CANTICLES:
+        _, _, top_eigenvector, subgraph = results[f'centrality_{canticle}']
+        print(f"{canticle.capitalize()} - High Eigenvector Centrality Subgraph")
+        render(renderer, display_subgraph, subgraph, [node for node, _ in top_eigenvector], init_pos=layout, name=f'subgraph_{canticle}')
+    if args.null_samples > 0:
+        for canticle in CANTICLES:
+            print_significance_table(f'{canticle.capitalize()} ({args.null_samples} {args.null_model} null networks)',
+                                     results[f'significance_{canticle}'])
+
+    # growth of the network over the journey (every 10th canto is printed)
+    print_temporal_snapshots(results['temporal'], results['corpus'].vocab, step=10)
+    render(renderer, plot_temporal_snapshots, results['temporal'], name='temporal_network')
 
-    #Display the measures of centrality (plotting only the eigenvector centrality)
-    plot_evaluate_centrality_measures(G_inferno, G_purgatorio, G_paradiso)
+    #plot the frequency distribution of the words, use --no-binned to view the raw rank-frequency plots
+    freq_dists, zipf_table = results['zipf']
+    plot_freq_dists(*freq_dists, binned=args.binned, renderer=renderer, table=zipf_table)
+    print_zipf_table(zipf_table)
 
-    #plot the frequency distribution of the words, set binned = False or True depending on whether you want to view the binned results
-    plot_freq_dist(inferno_clean, purgatorio_clean, paradiso_clean, binned = True)
+    # only generates a plot for the canticles that you want ("inferno", "purgatorio" and/or "paradiso")
+    render(renderer, plot_entropy_table, results['entropy'], canticles=['inferno'], name='relative_entropy')
+    render(renderer, plot_entropy_profile, results['entropy_profile'], results['corpus'].canticle_offsets, name='entropy_profile')
+    block_entropy_table, entropy_rates = results['block_entropy']
+    print_block_entropy_table(block_entropy_table, entropy_rates)
+    render(renderer, plot_block_entropies, block_entropy_table, entropy_rates, name='block_entropy')
 
-    # plots and evaluates entropy by canti using shannon entropy with an n-grams of n and only generates a plot for the specific canticle that you want (this only takes "inferno", "paradiso", or "purgatorio")
-    evaluate_canti_entropy(inferno_clean, purgatorio_clean, paradiso_clean, n=2, canticle = 'inferno')
+    print_timings(pipeline.timings, pipeline.seconds)
+    if instrumentation.enabled():
+        instrumentation.print_report(instrumentation.report())
+        print(f'\nProfile report written to {instrumentation.write_report()}')
 
-main()
\ No newline at end of file
+if __name__ == '__main__':
+    main()
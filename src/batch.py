@@ -0,0 +1,181 @@
+import csv
+import glob
+import json
+import math
+import os
+import sys
+import time
+import traceback
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+'''
+Batch mode: the same analysis over many corpora. How we do this:
+1. Every corpus (text file) is one task on a process pool. With max_tasks_per_child=1 every corpus gets a fresh worker process, so its memory is given back before the next corpus starts and a worker never holds more than one corpus
+2. Only as many corpora as there are workers are submitted at a time; the next one is submitted as soon as one finishes
+3. The analysis runs in the worker and returns a record of plain numbers. An exception is caught in the worker and returned as an error record with its traceback, so the other corpora carry on
+4. A worker that dies (e.g. killed for using too much memory) breaks the whole pool. The corpora that were running are then run again one at a time on a new pool, which tells the corpus that killed its worker from the others; that corpus gets up to max_attempts tries before it is recorded as failed
+5. Each record is written to the results file as soon as its corpus finishes, as JSON Lines (one record per line) or CSV (one row per number: corpus, status, key, value), so a long batch can be followed while it runs and a crash loses nothing already written
+'''
+
+DEFAULT_BATCH_OUTPUT = 'batch_results.jsonl'
+
+CSV_FIELDS = ('corpus', 'status', 'key', 'value')
+
+
+def find_texts(directory, pattern='*.txt'):
+    """
+    Sorted paths of the files in directory (and its subdirectories) matching pattern.
+    """
+    return sorted(glob.glob(os.path.join(directory, '**', pattern), recursive=True))
+
+
+def corpus_name(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def to_builtin(value):
+    """
+    Convert numpy scalars and arrays (structured arrays become lists of dicts), tuples and
+    dicts to plain Python objects that json can write. NaN becomes None (null).
+    """
+    if isinstance(value, dict):
+        return {str(key): to_builtin(item) for key, item in value.items()}
+    if isinstance(value, np.ndarray):
+        if value.dtype.names is not None:
+            return [{name: to_builtin(row[name]) for name in value.dtype.names} for row in value]
+        return to_builtin(value.tolist())
+    if isinstance(value, (list, tuple)):
+        return [to_builtin(item) for item in value]
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+def _error_record(path, error, trace=None):
+    return {'corpus': corpus_name(path), 'path': path, 'status': 'error', 'error': error, 'traceback': trace}
+
+
+def _analyse_task(analyse, path):
+    """
+    Worker for run_batch: the record of one corpus, or an error record if the analysis raised.
+    """
+    start = time.perf_counter()
+    try:
+        results = to_builtin(analyse(path))
+    except Exception as error:
+        return _error_record(path, f'{type(error).__name__}: {error}', traceback.format_exc())
+    return {'corpus': corpus_name(path), 'path': path, 'status': 'ok',
+            'seconds': time.perf_counter() - start, **results}
+
+
+def flatten_record(record, prefix=''):
+    """
+    (key, value) pairs of the numbers and strings in a nested record, keys joined with dots.
+    """
+    if isinstance(record, dict):
+        items = record.items()
+    elif isinstance(record, list):
+        items = enumerate(record)
+    else:
+        yield prefix, record
+        return
+    for key, item in items:
+        yield from flatten_record(item, f'{prefix}.{key}' if prefix else str(key))
+
+
+class ResultWriter:
+    """
+    Appends batch records to a results file as they arrive: CSV if the path ends in .csv,
+    JSON Lines otherwise. Every record is flushed to disk when written.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.csv = path.lower().endswith('.csv')
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, 'w', encoding='utf-8', newline='' if self.csv else None)
+        if self.csv:
+            self._writer = csv.writer(self._file)
+            self._writer.writerow(CSV_FIELDS)
+
+    def write(self, record):
+        if self.csv:
+            for key, value in flatten_record({k: v for k, v in record.items() if k not in ('corpus', 'status')}):
+                self._writer.writerow((record['corpus'], record['status'], key, value))
+        else:
+            self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def run_batch(paths, analyse, output=DEFAULT_BATCH_OUTPUT, workers=None, max_tasks_per_child=1, max_attempts=2):
+    """
+    Run analyse(path) for every path on a process pool and stream the records to output.
+
+    analyse must be a picklable (module-level) function returning a dict of results. Returns
+    the status of every corpus as {path: 'ok' or 'error'}. max_tasks_per_child=None keeps the
+    worker processes alive between corpora.
+    """
+    workers = workers or os.cpu_count() or 1
+    # Replacing worker processes needs Python 3.11; older versions keep them for the whole batch
+    pool_options = {}
+    if max_tasks_per_child is not None and sys.version_info >= (3, 11):
+        pool_options['max_tasks_per_child'] = max_tasks_per_child
+    queue = deque(paths)
+    suspects = deque()
+    attempts = Counter()
+    statuses = {}
+
+    with ResultWriter(output) as writer:
+        def finish(record):
+            writer.write(record)
+            statuses[record['path']] = record['status']
+            seconds = f" in {record['seconds']:.1f} s" if 'seconds' in record else ''
+            print(f"[{len(statuses)}/{len(paths)}] {record['corpus']}: {record['status']}{seconds}", flush=True)
+
+        while queue or suspects:
+            # After a worker died, the corpora of the broken pool run one at a time, so only the corpus
+            # that kills its worker is retried and, after max_attempts, recorded as failed
+            alone = bool(suspects)
+            pending, n_workers = (suspects, 1) if alone else (queue, workers)
+            running, died = {}, []
+            with ProcessPoolExecutor(max_workers=n_workers, **pool_options) as pool:
+                while (pending or running) and not died:
+                    while pending and len(running) < n_workers:
+                        path = pending.popleft()
+                        running[pool.submit(_analyse_task, analyse, path)] = path
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        path = running.pop(future)
+                        try:
+                            finish(future.result())
+                        except BrokenProcessPool:
+                            died.append(path)
+                # The other corpora of a broken pool failed with it
+                died.extend(running.values())
+            if not alone:
+                suspects.extend(died)
+                continue
+            for path in died:
+                attempts[path] += 1
+                if attempts[path] < max_attempts:
+                    suspects.append(path)
+                else:
+                    finish(_error_record(path, f'worker process died ({attempts[path]} attempts)'))
+    return statuses
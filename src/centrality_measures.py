@@ -1,24 +1,200 @@
-import networkx as nx
-import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import dijkstra
+from scipy.sparse.linalg import eigsh
+
+from src.create_networks import SparseWordNetwork
+from src.display_network import compute_layout
+from src.instrumentation import instrumented
+from src.rendering import finish_figure, render
+
+# networkx and matplotlib are imported inside the functions that draw or build nx.Graph objects, so importing this module stays fast
 
 '''
 How do we calculate the centrality measures? - Note that each of these measures account for the weighting of the edges.
     1. We compute the degree centrality for all nodes in the graph by calculating the sum of all edge weights to each node and normalise this centrality by the total possible weighted edges in the graph. We then sort the nodes in descending order of centrality value.
-    2. We compute betweenness centrality by computing the number of shortests paths a node lies on between other nodes accounting for edge weights. We use a parameter k=5000 to determine how many of these paths we sample to get our results. These are then sorted in descending order of centrality value
+    2. We compute betweenness centrality by computing the number of shortests paths a node lies on between other nodes accounting for edge weights. We use a parameter k=1000 to determine how many of these paths we sample to get our results (the sample is seeded). These are then sorted in descending order of centrality value
     3. To compute the eigenvector centrality, we measure the nodes centrality based on the influence of its surrounding nodes. These are then sorted into descending order of centrality value.
+
+The graph can be a networkx graph or a SparseWordNetwork (src/create_networks.py). Weighted degree and eigenvector centrality are computed on the sparse weighted adjacency matrix directly, so the graph is never densified.
+'''
+
+def weighted_adjacency(G):
+    """
+    Node labels and the CSR weighted adjacency matrix (in the same node order) of a networkx graph or a SparseWordNetwork.
+    """
+    if isinstance(G, SparseWordNetwork):
+        W = G.weights[G.nodes][:, G.nodes].astype(float)
+        return G.vocab[G.nodes].tolist(), W
+    import networkx as nx
+    nodes = list(G)
+    return nodes, nx.to_scipy_sparse_array(G, nodelist=nodes, weight='weight', dtype=float, format='csr')
+
+
+@instrumented
+def eigenvector_centrality_sparse(W, v0=None, tol=1e-10, max_iter=1000, method='arpack'):
+    """
+    Eigenvector centrality from a symmetric sparse weighted adjacency matrix, without densifying it.
+
+    method='arpack' uses scipy's eigsh (Lanczos); method='power' runs a power iteration on (W + I)
+    until the change in the unit-norm vector drops below `tol`. v0 is an optional starting vector
+    (e.g. the result for a similar graph) to warm-start either method. The vector is normalised
+    like networkx: unit Euclidean norm with a positive sum.
+    """
+    W = sp.csr_matrix(W, dtype=float)
+    n = W.shape[0]
+    if v0 is not None:
+        # Starting vectors must not be zero or orthogonal to the leading eigenvector
+        v0 = np.abs(np.asarray(v0, dtype=float)) + 1e-12
+
+    if method == 'arpack' and n > 2:
+        _, vectors = eigsh(W, k=1, which='LA', v0=v0, tol=tol, maxiter=max_iter)
+        x = vectors[:, 0]
+    else:
+        x = np.ones(n) if v0 is None else v0
+        x = x / np.linalg.norm(x)
+        for _ in range(max_iter):
+            # Adding x (i.e. iterating on W + I) keeps the iteration from oscillating on bipartite parts
+            x_new = W @ x + x
+            x_new /= np.linalg.norm(x_new)
+            converged = np.linalg.norm(x_new - x) < tol
+            x = x_new
+            if converged:
+                break
+    return x / (np.sign(x.sum()) * np.linalg.norm(x))
+
+
 '''
+Sampled betweenness centrality (same definition as nx.betweenness_centrality(G, weight='weight', k=k), where the edge weight is the edge length):
+1. Draw the k source nodes from a seeded numpy Generator, so the sample (and the top-n list) is the same on every run
+2. Split the sources into fixed-size batches and run them on a process pool. For each source, scipy's compiled Dijkstra gives the distances, and the edges with d[u] + w(u, v) == d[v] form the shortest-path DAG
+3. Count shortest paths (sigma) forwards and accumulate dependencies (delta) backwards over the DAG one distance level at a time, using vectorised array operations instead of a Python heap
+4. Sum the batches in order (so the result does not depend on the number of workers) and rescale like networkx
+5. With tol set, stop sampling once the top-n words have been stable for `patience` batches in a row: the same members after each batch, except for swaps among near-ties (words within tol, relative, of the n-th value), and top-n values that moved by less than tol (relative). Comparing membership instead of the exact order, and over several batches, keeps near-ties from blocking the stop and one lucky agreement from triggering it
+'''
+
+_betweenness_graph = None
+
+def _set_betweenness_graph(W):
+    # Process pool initializer: each worker receives the graph once
+    global _betweenness_graph
+    _betweenness_graph = W
+
+def _betweenness_batch(sources, W=None):
+    """
+    Sum of the dependencies delta_s(v) of every node v over the given sources (Brandes' algorithm).
+    """
+    W = _betweenness_graph if W is None else W
+    n = W.shape[0]
+    row = np.repeat(np.arange(n), np.diff(W.indptr))
+    col = W.indices
+    weight = W.data
+    distances = dijkstra(W, directed=True, indices=sources)
+
+    betweenness = np.zeros(n)
+    for s, d in zip(sources, np.atleast_2d(distances)):
+        # Edges of the shortest-path DAG, grouped by the distance of their head node
+        on_path = np.isfinite(d[row]) & (d[row] + weight == d[col])
+        u, v = row[on_path], col[on_path]
+        order = np.argsort(d[v], kind='stable')
+        u, v = u[order], v[order]
+        level_starts = np.flatnonzero(np.r_[True, d[v][1:] != d[v][:-1]]) if len(v) else np.empty(0, dtype=int)
+        levels = np.split(np.arange(len(v)), level_starts[1:]) if len(v) else []
+
+        # Number of shortest paths from s, level by level (every predecessor is on a lower level)
+        sigma = np.zeros(n)
+        sigma[s] = 1.0
+        for edges in levels:
+            np.add.at(sigma, v[edges], sigma[u[edges]])
+
+        # Dependencies, from the farthest level back to the source
+        delta = np.zeros(n)
+        for edges in reversed(levels):
+            np.add.at(delta, u[edges], sigma[u[edges]] / sigma[v[edges]] * (1 + delta[v[edges]]))
+        delta[s] = 0.0
+        betweenness += delta
+    return betweenness
+
+def _top_stable(top, previous_top, estimate, tol):
+    # Same top-n members, up to swaps with words within tol of the n-th value
+    swapped = np.setxor1d(top, previous_top)
+    return bool(np.all(estimate[swapped] >= (1 - tol) * estimate[top[-1]]))
+
+def _rescale_betweenness(betweenness, sources):
+    # Normalisation used by networkx for sampled betweenness without endpoints
+    n = len(betweenness)
+    N = n - 1
+    if N < 2:
+        return betweenness
+    k = len(sources)
+    if k == n:
+        return betweenness / (N * (N - 1))
+    scale = np.full(n, 1 / (k * (N - 1)))
+    scale[sources] = 1 / ((k - 1) * (N - 1)) if k > 1 else np.nan
+    return betweenness * scale
+
+@instrumented
+def betweenness_centrality_sparse(W, k=None, seed=None, workers=None, batch_size=50, tol=None, top_n=10, patience=3):
+    """
+    Weighted betweenness centrality of a sparse adjacency matrix (weights are edge lengths),
+    estimated from k sampled sources (all nodes if k is None) on a process pool.
+
+    The sources come from np.random.default_rng(seed) and are processed in batches of
+    batch_size, summed in order, so results only depend on the seed. workers=1 runs in this
+    process. With tol set, sampling stops early once the top_n words are stable for patience
+    batches in a row (see above).
+    Returns (betweenness array, number of sources used).
+    """
+    W = sp.csr_matrix(W, dtype=float)
+    n = W.shape[0]
+    rng = np.random.default_rng(seed)
+    sources = np.arange(n) if k is None or k >= n else rng.permutation(n)[:k]
+    batches = [sources[i:i + batch_size] for i in range(0, len(sources), batch_size)]
+
+    total = np.zeros(n)
+    used = 0
+    previous = None
+    stable = 0
+    pool = None if workers == 1 else ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'), initializer=_set_betweenness_graph, initargs=(W,))
+    try:
+        results = map(lambda batch: _betweenness_batch(batch, W), batches) if pool is None else pool.map(_betweenness_batch, batches)
+        for batch, partial in zip(batches, results):
+            total += partial
+            used += len(batch)
+            if tol is not None and used < len(sources):
+                estimate = _rescale_betweenness(total, sources[:used])
+                top = np.argsort(-estimate, kind='stable')[:top_n]
+                if previous is not None and _top_stable(top, previous[0], estimate, tol):
+                    change = np.abs(estimate[top] - previous[1][top]) / np.maximum(np.abs(estimate[top]), 1e-300)
+                    stable = stable + 1 if change.max() < tol else 0
+                else:
+                    stable = 0
+                if stable >= patience:
+                    break
+                previous = (top, estimate)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+    return _rescale_betweenness(total, sources[:used]), used
+
+
+@instrumented
+def top_centrality_measures_weighted(G, top_n=10, k=1000, seed=42, workers=None, tol=None):
+    nodes, W = weighted_adjacency(G)
 
-def top_centrality_measures_weighted(G, top_n=10):
-    # Weighted Degree Centrality
-    weighted_degree_centrality = {node: sum(data['weight'] for _, _, data in G.edges(node, data=True)) for node in G.nodes()}
+    # Weighted Degree Centrality (a self-loop counts once, as in networkx's G.edges(node))
+    weighted_degree_centrality = dict(zip(nodes, np.asarray(W.sum(axis=1)).ravel().tolist()))
     top_weighted_degree = sorted(weighted_degree_centrality.items(), key=lambda x: x[1], reverse=True)[:top_n]
 
-    # Betweenness Centrality
-    betweenness_centrality = nx.betweenness_centrality(G, weight='weight', k=1000)
+    # Betweenness Centrality (k sampled sources, seeded so the ranking is reproducible)
+    betweenness, _ = betweenness_centrality_sparse(W, k=k, seed=seed, workers=workers, tol=tol, top_n=top_n)
+    betweenness_centrality = dict(zip(nodes, betweenness.tolist()))
     top_betweenness = sorted(betweenness_centrality.items(), key=lambda x: x[1], reverse=True)[:top_n]
 
     # Eigenvector Centrality
-    eigenvector_centrality = nx.eigenvector_centrality_numpy(G, weight='weight')
+    eigenvector_centrality = dict(zip(nodes, eigenvector_centrality_sparse(W).tolist()))
     top_eigenvector = sorted(eigenvector_centrality.items(), key=lambda x: x[1], reverse=True)[:top_n]
 
     return top_weighted_degree, top_betweenness, top_eigenvector
@@ -48,54 +224,130 @@ How do we do this?
     3. We then retrieve the neighbours with the top 5 weights, add these to sub-graph nodes and store their weights
     4. Graph the top nodes and the sub-graph nodes
     5. To plot these we let node size be determined by degree, central node as in blue, neighbour nodes are in red.
+
+Steps 2 and 3 use a neighbour index built once per graph (neighbours pre-sorted by weight), so each query only reads the top-k slice of each node.
 '''
 
-def create_high_centrality_subgraph(G, top_nodes, top_n_edges=5, centrality_nodes=set()):
+class NeighborIndex:
+    """
+    Precomputed neighbour index of a weighted graph for high-centrality sub-graph queries.
+
+    Each node's neighbours (self-loops excluded) are stored sorted by edge weight, highest first,
+    in flat CSR-style arrays (indptr, neighbors, weights); ties keep the graph's neighbour order,
+    as the original sort did. "Top-k neighbours of a node" is then a slice of length k, and
+    "edges among a node set" is a row/column selection of the sparse matrix, so queries for any
+    word set never rescan the graph. Build it once per graph with from_graph (networkx) or
+    from_network (SparseWordNetwork).
+    """
+
+    def __init__(self, labels, rows, cols, weights, rank):
+        self.labels = list(labels)
+        self.position = {label: i for i, label in enumerate(self.labels)}
+        n = len(self.labels)
+        keep = rows != cols
+        rows, cols, weights, rank = rows[keep], cols[keep], weights[keep], rank[keep]
+
+        order = np.lexsort((rank, -weights, rows))
+        self.neighbors = cols[order]
+        self.weights = weights[order]
+        self.indptr = np.r_[0, np.cumsum(np.bincount(rows, minlength=n))]
+        self.matrix = sp.csr_matrix((weights, (rows, cols)), shape=(n, n))
+
+    @classmethod
+    def from_graph(cls, G):
+        labels = list(G)
+        position = {label: i for i, label in enumerate(labels)}
+        rows, cols, weights, rank = [], [], [], []
+        for i, (node, neighbors) in enumerate(G.adj.items()):
+            for r, (neighbor, data) in enumerate(neighbors.items()):
+                rows.append(i)
+                cols.append(position[neighbor])
+                weights.append(data['weight'])
+                rank.append(r)
+        return cls(labels, np.array(rows, dtype=np.int64), np.array(cols, dtype=np.int64), np.array(weights), np.array(rank))
+
+    @classmethod
+    def from_network(cls, network):
+        # Map token IDs to node positions; the edge table order is networkx's neighbour order
+        position = np.full(network.n_vocab, -1, dtype=np.int64)
+        position[network.nodes] = np.arange(len(network.nodes))
+        u, v = position[network.edges['u']], position[network.edges['v']]
+        return cls(
+            network.vocab[network.nodes].tolist(),
+            np.concatenate([u, v]), np.concatenate([v, u]),
+            np.concatenate([network.edges['weight'], network.edges['weight']]),
+            np.concatenate([network.edges['first'], network.edges['first']]),
+        )
+
+    def __contains__(self, node):
+        return node in self.position
+
+    def top_neighbors(self, node, k=5):
+        """
+        The k highest-weighted neighbours of a node as (neighbour, weight) pairs.
+        """
+        i = self.position[node]
+        start = self.indptr[i]
+        stop = min(start + k, self.indptr[i + 1])
+        return [(self.labels[j], w) for j, w in zip(self.neighbors[start:stop].tolist(), self.weights[start:stop].tolist())]
+
+    def induced_edges(self, nodes):
+        """
+        Edges (u, v, weight) among a set of nodes, each listed once.
+        """
+        nodes = [node for node in nodes if node in self.position]
+        ids = np.array([self.position[node] for node in nodes], dtype=np.int64)
+        sub = sp.triu(self.matrix[ids][:, ids]).tocoo()
+        return [(nodes[i], nodes[j], w) for i, j, w in zip(sub.row.tolist(), sub.col.tolist(), sub.data.tolist())]
+
+    @instrumented
+    def high_centrality_subgraph(self, top_nodes, top_n_edges=5):
+        """
+        The top nodes, their top_n_edges highest-weighted neighbours, and every edge among all of them.
+        """
+        sub_nodes = set(top_nodes)
+        edges = []
+        for node in top_nodes:
+            if node in self.position:
+                top_neighbors = self.top_neighbors(node, top_n_edges)
+                sub_nodes.update(neighbor for neighbor, _ in top_neighbors)
+                edges.extend((node, neighbor, weight) for neighbor, weight in top_neighbors)
+        edges.extend(self.induced_edges(sub_nodes))
+
+        import networkx as nx
+        subgraph = nx.Graph()
+        subgraph.add_weighted_edges_from(edges)
+        return subgraph
+
+
+def neighbor_index(G):
+    """
+    NeighborIndex of a networkx graph or SparseWordNetwork (returned unchanged if it already is one).
+    """
+    if isinstance(G, NeighborIndex):
+        return G
+    if isinstance(G, SparseWordNetwork):
+        return NeighborIndex.from_network(G)
+    return NeighborIndex.from_graph(G)
+
+
+def create_high_centrality_subgraph(G, top_nodes, top_n_edges=5):
     """
     Create a subgraph containing the top eigenvector centrality nodes and their highest-weighted neighbors, ensuring connections between top neighbors and other top centrality nodes.
+    G can be a networkx graph, a SparseWordNetwork or a NeighborIndex; pass a NeighborIndex to run many queries on the same graph.
     """
-    sub_nodes = set(top_nodes)  # Initialize with top eigenvector centrality nodes
-    edges = []  # Store edges to build the subgraph
-
-    for node in top_nodes:
-        if node in G:
-            neighbors = list(G.neighbors(node))
-            # Collect weights for edges to neighbors
-            neighbor_weights = [
-                (neighbor, G[node][neighbor]['weight'])
-                for neighbor in neighbors if node != neighbor  # Exclude self-loops
-            ]
-            # Sort neighbors by edge weight (highest first)
-            neighbor_weights.sort(key=lambda x: x[1], reverse=True)
-            # Get top weighted neighbors
-            top_neighbors = [neighbor for neighbor, _ in neighbor_weights[:top_n_edges]]
-            sub_nodes.update(top_neighbors)  # Add neighbors to the subgraph nodes
-            # Add edges between the node and its top neighbors
-            for neighbor in top_neighbors:
-                edges.append((node, neighbor, G[node][neighbor]['weight']))
-
-    # Add edges between highly weighted neighbors or other top centrality nodes
-    for node in sub_nodes:
-        if node in G:
-            for neighbor in G.neighbors(node):
-                if neighbor in sub_nodes and node != neighbor:
-                    edges.append((node, neighbor, G[node][neighbor]['weight']))
-
-    # Build the subgraph
-    subgraph = nx.Graph()
-    for u, v, weight in edges:
-        if u != v:  # Ensure no self-loops
-            subgraph.add_edge(u, v, weight=weight)
-
-    return subgraph
-
-
-def display_subgraph(subgraph, central_nodes):
+    return neighbor_index(G).high_centrality_subgraph(top_nodes, top_n_edges=top_n_edges)
+
+
+def display_subgraph(subgraph, central_nodes, init_pos=None, name='subgraph'):
     """
     Display the subgraph highlighting central nodes and their neighbors.
+    init_pos is an optional {node: (x, y)} layout of a larger graph (e.g. from display_network) used as starting positions.
     """
+    import matplotlib.pyplot as plt
+    import networkx as nx
     plt.figure(figsize=(12, 10))
-    pos = nx.spring_layout(subgraph, k=0.5, seed=42)
+    pos = compute_layout(subgraph, init_pos=init_pos)
     degrees = dict(subgraph.degree())
     node_sizes = [degrees[node] * 400 for node in subgraph.nodes()]
     # Colors: blue for central nodes, red for neighbors
@@ -107,10 +359,23 @@ def display_subgraph(subgraph, central_nodes):
     nx.draw_networkx_labels(subgraph, pos, font_size=12, font_color='black')
     plt.axis('off')
     plt.tight_layout()
-    plt.show()
+    finish_figure(name)
+
+
+def evaluate_centrality(G, top_n=10, k=1000, seed=42, top_n_edges=5, workers=None):
+    """
+    Top centrality measures of one graph and its high eigenvector centrality subgraph, without
+    printing or plotting. Returns (top_weighted_degree, top_betweenness, top_eigenvector, subgraph).
+    """
+    top_weighted_degree, top_betweenness, top_eigenvector = top_centrality_measures_weighted(G, top_n=top_n, k=k, seed=seed, workers=workers)
+    top_eigenvector_nodes = [node for node, _ in top_eigenvector]
+    subgraph = create_high_centrality_subgraph(G, top_eigenvector_nodes, top_n_edges=top_n_edges)
+    return top_weighted_degree, top_betweenness, top_eigenvector, subgraph
 
 
-def plot_evaluate_centrality_measures(G_inferno, G_purgatorio, G_paradiso):
+def plot_evaluate_centrality_measures(G_inferno, G_purgatorio, G_paradiso, layout=None, renderer=None):
+    # layout: optional node positions of the whole poem (returned by display_network), reused to place the subgraphs
+    # renderer: optional FigureRenderer (src/rendering.py) that draws the subgraphs in the background
     # Inferno
     top_weighted_degree_inferno, top_betweenness_inferno, top_eigenvector_inferno = top_centrality_measures_weighted(G_inferno)
     # Purgatorio
@@ -125,24 +390,18 @@ def plot_evaluate_centrality_measures(G_inferno, G_purgatorio, G_paradiso):
     
     # Inferno
     top_eigenvector_nodes_inferno = [node for node, _ in top_eigenvector_inferno]
-    subgraph_inferno = create_high_centrality_subgraph(
-        G_inferno, top_eigenvector_nodes_inferno, top_n_edges=5, centrality_nodes=set(top_eigenvector_nodes_inferno[:10])
-    )
+    subgraph_inferno = create_high_centrality_subgraph(G_inferno, top_eigenvector_nodes_inferno, top_n_edges=5)
     print("Inferno - High Eigenvector Centrality Subgraph")
-    display_subgraph(subgraph_inferno, top_eigenvector_nodes_inferno)
+    render(renderer, display_subgraph, subgraph_inferno, top_eigenvector_nodes_inferno, init_pos=layout, name='subgraph_inferno')
 
     # Purgatorio
     top_eigenvector_nodes_purgatorio = [node for node, _ in top_eigenvector_purgatorio]
-    subgraph_purgatorio = create_high_centrality_subgraph(
-        G_purgatorio, top_eigenvector_nodes_purgatorio, top_n_edges=5, centrality_nodes=set(top_eigenvector_nodes_purgatorio[:10])
-    )
+    subgraph_purgatorio = create_high_centrality_subgraph(G_purgatorio, top_eigenvector_nodes_purgatorio, top_n_edges=5)
     print("Purgatorio - High Eigenvector Centrality Subgraph")
-    display_subgraph(subgraph_purgatorio, top_eigenvector_nodes_purgatorio)
+    render(renderer, display_subgraph, subgraph_purgatorio, top_eigenvector_nodes_purgatorio, init_pos=layout, name='subgraph_purgatorio')
 
     # Paradiso
     top_eigenvector_nodes_paradiso = [node for node, _ in top_eigenvector_paradiso]
-    subgraph_paradiso = create_high_centrality_subgraph(
-        G_paradiso, top_eigenvector_nodes_paradiso, top_n_edges=5, centrality_nodes=set(top_eigenvector_nodes_paradiso[:10])
-    )
+    subgraph_paradiso = create_high_centrality_subgraph(G_paradiso, top_eigenvector_nodes_paradiso, top_n_edges=5)
     print("Paradiso - High Eigenvector Centrality Subgraph")
-    display_subgraph(subgraph_paradiso, top_eigenvector_nodes_paradiso)
+    render(renderer, display_subgraph, subgraph_paradiso, top_eigenvector_nodes_paradiso, init_pos=layout, name='subgraph_paradiso')
@@ -0,0 +1,176 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from src.instrumentation import instrumented
+from src.preprocessing import CANTICLES, stream_canti
+from src.entropy_analysis import split_canticle_into_canti
+from src.tokenizer import DEFAULT_TOKENIZER, get_tokenizer, tokenizer_name
+
+'''
+Integer-encoded corpus. How we do this:
+1. Stream the cleaned canti from the text with stream_canti() (same canti as preprocessing() followed by the entropy analysis' split_canticle_into_canti)
+2. Tokenise every canto with the shared tokenizer (src/tokenizer.py) and map each word to an integer ID using a sorted vocabulary
+3. Store the whole poem as one int32 array of token IDs with offset tables marking where each canto and canticle starts
+4. Save the arrays to disk in a folder named after a hash of the source text and the tokenizer name, so later runs load them with mmap and skip preprocessing and tokenisation entirely
+'''
+
+# Bump this when the on-disk layout or the tokenisation changes so old caches are ignored
+CORPUS_FORMAT_VERSION = 1
+
+DEFAULT_CACHE_DIR = os.path.join('.cache', 'corpus')
+
+
+class Corpus:
+    """
+    The whole poem as a flat int32 array of token IDs.
+
+    vocab[i] is the word with token ID i. canto_offsets has one entry per canto plus a final
+    end offset (token positions in token_ids), and canticle_canti gives, for each canticle,
+    the index of its first canto in canto_offsets (plus a final end index).
+    """
+
+    def __init__(self, vocab, token_ids, canto_offsets, canticle_canti):
+        self.vocab = vocab
+        self.token_ids = token_ids
+        self.canto_offsets = canto_offsets
+        self.canticle_canti = canticle_canti
+        self._word_to_id = None
+
+    @property
+    def canticle_offsets(self):
+        """Token offsets of the three canticles (length 4)."""
+        return self.canto_offsets[self.canticle_canti]
+
+    @property
+    def word_to_id(self):
+        if self._word_to_id is None:
+            self._word_to_id = {word: i for i, word in enumerate(self.vocab.tolist())}
+        return self._word_to_id
+
+    def canticle(self, name):
+        """Token IDs of one canticle ('inferno', 'purgatorio' or 'paradiso')."""
+        i = CANTICLES.index(name)
+        start, end = self.canticle_offsets[i], self.canticle_offsets[i + 1]
+        return self.token_ids[start:end]
+
+    def canti(self, name):
+        """List of token ID arrays, one per canto of the given canticle."""
+        i = CANTICLES.index(name)
+        first, last = self.canticle_canti[i], self.canticle_canti[i + 1]
+        offsets = self.canto_offsets[first:last + 1]
+        return [self.token_ids[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+
+    def words(self, token_ids):
+        """Map an array of token IDs back to a list of words."""
+        return self.vocab[np.asarray(token_ids)].tolist()
+
+    @classmethod
+    def from_clean_text(cls, inferno_clean, purgatorio_clean, paradiso_clean, tokenizer=DEFAULT_TOKENIZER):
+        """
+        Build a corpus from the cleaned canticle strings returned by preprocessing().
+        """
+        tokenize = get_tokenizer(tokenizer)
+        tokens = []
+        canto_offsets = [0]
+        canticle_canti = [0]
+        for canticle_text in (inferno_clean, purgatorio_clean, paradiso_clean):
+            for canto in split_canticle_into_canti(canticle_text):
+                tokens.extend(tokenize(canto))
+                canto_offsets.append(len(tokens))
+            canticle_canti.append(len(canto_offsets) - 1)
+
+        vocab, token_ids = np.unique(np.array(tokens), return_inverse=True)
+        return cls(
+            vocab,
+            token_ids.astype(np.int32),
+            np.asarray(canto_offsets, dtype=np.int64),
+            np.asarray(canticle_canti, dtype=np.int64),
+        )
+
+    @classmethod
+    @instrumented
+    def from_canti(cls, canti, tokenizer=DEFAULT_TOKENIZER):
+        """
+        Build a corpus from (canticle, canto_number, canto_text) tuples, e.g. from stream_canti().
+        Each canto is encoded as soon as it arrives, so the cleaned text is never held in memory.
+        """
+        tokenize = get_tokenizer(tokenizer)
+        word_ids = {}
+        chunks = []
+        canto_offsets = [0]
+        canti_per_canticle = dict.fromkeys(CANTICLES, 0)
+        last = 0
+        for canticle, _, canto in canti:
+            if CANTICLES.index(canticle) < last:
+                raise ValueError(f'{canticle} canti must come before those of {CANTICLES[last]}')
+            last = CANTICLES.index(canticle)
+            ids = np.fromiter((word_ids.setdefault(word, len(word_ids)) for word in tokenize(canto)), dtype=np.int32)
+            chunks.append(ids)
+            canto_offsets.append(canto_offsets[-1] + len(ids))
+            canti_per_canticle[canticle] += 1
+
+        # Re-number the IDs so the vocabulary is sorted, as in from_clean_text
+        words = list(word_ids)
+        order = np.argsort(np.array(words)) if words else np.empty(0, dtype=np.int64)
+        rank = np.empty(len(words), dtype=np.int32)
+        rank[order] = np.arange(len(words), dtype=np.int32)
+        token_ids = rank[np.concatenate(chunks)] if chunks else np.empty(0, dtype=np.int32)
+        return cls(
+            np.array(words)[order],
+            token_ids,
+            np.asarray(canto_offsets, dtype=np.int64),
+            np.concatenate([[0], np.cumsum([canti_per_canticle[name] for name in CANTICLES])]).astype(np.int64),
+        )
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, 'vocab.npy'), self.vocab)
+        np.save(os.path.join(directory, 'token_ids.npy'), self.token_ids)
+        np.save(os.path.join(directory, 'canto_offsets.npy'), self.canto_offsets)
+        np.save(os.path.join(directory, 'canticle_canti.npy'), self.canticle_canti)
+        # Written last so a half-written cache is never picked up
+        with open(os.path.join(directory, 'corpus.json'), 'w', encoding='utf-8') as file:
+            json.dump({'version': CORPUS_FORMAT_VERSION, 'n_tokens': int(len(self.token_ids)),
+                       'n_vocab': int(len(self.vocab))}, file)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        mmap_mode = 'r' if mmap else None
+        return cls(
+            np.load(os.path.join(directory, 'vocab.npy'), mmap_mode=mmap_mode),
+            np.load(os.path.join(directory, 'token_ids.npy'), mmap_mode=mmap_mode),
+            np.load(os.path.join(directory, 'canto_offsets.npy')),
+            np.load(os.path.join(directory, 'canticle_canti.npy')),
+        )
+
+
+def file_hash(path, tokenizer=DEFAULT_TOKENIZER):
+    """
+    SHA-256 of a file's bytes (and the corpus format version and tokenizer name), used as the cache key.
+    """
+    digest = hashlib.sha256(f'corpus-v{CORPUS_FORMAT_VERSION}-{tokenizer_name(tokenizer)}'.encode())
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+@instrumented
+def load_corpus(path='divine_comedy.txt', cache_dir=DEFAULT_CACHE_DIR, tokenizer=DEFAULT_TOKENIZER):
+    """
+    Return the integer-encoded corpus for `path`, building and caching it on the first run.
+    A warm run only memory-maps the cached arrays. Pass cache_dir=None to disable caching.
+    """
+    if cache_dir is None:
+        return Corpus.from_canti(stream_canti(path), tokenizer=tokenizer)
+
+    directory = os.path.join(cache_dir, file_hash(path, tokenizer))
+    if os.path.exists(os.path.join(directory, 'corpus.json')):
+        return Corpus.load(directory)
+
+    corpus = Corpus.from_canti(stream_canti(path), tokenizer=tokenizer)
+    corpus.save(directory)
+    return Corpus.load(directory)
@@ -1,11 +1,11 @@
-import nltk
-from nltk.tokenize import word_tokenize
-from nltk.corpus import stopwords
-import networkx as nx
+import numpy as np
+import scipy.sparse as sp
 
-nltk.download('punkt')
-nltk.download('stopwords')
+from src.instrumentation import instrumented
+from src.nltk_resources import STOP_WORDS
+from src.tokenizer import DEFAULT_TOKENIZER, tokenize
 
+# networkx is imported inside the functions that build nx.Graph objects, so importing this module stays fast
 
 
 '''
@@ -17,33 +17,420 @@ How do we create the network?
 
 '''
 
+def get_stop_words():
+    # Generic nltk italian stop words plus our custom list (a frozenset shared by every call, see src/nltk_resources.py)
+    return STOP_WORDS
+
+'''
+Sparse adjacency builder. Steps 3 and 4 above, without a Python loop over the token pairs:
+1. Drop the stop-words from the token ID array with a boolean mask over the vocabulary
+2. Find every distinct directed pair (a, b) of consecutive tokens, how often it occurs and where it first occurs (np.unique on packed int64 keys)
+3. Collapse a->b and b->a into one undirected edge exactly as adding the adjacency list to an nx.Graph does: the edge keeps the weight of whichever direction was added last, i.e. the direction that first occurs later in the text
+4. Build a symmetric scipy.sparse CSR weight matrix from COO arrays (duplicates are summed)
+5. Only build a networkx graph when a caller asks for one
+'''
+
+BIGRAM_DTYPE = np.dtype([('src', 'i4'), ('dst', 'i4'), ('count', 'i8'), ('first', 'i8')])
+EDGE_DTYPE = np.dtype([('u', 'i4'), ('v', 'i4'), ('weight', 'i8'), ('first', 'i8')])
+
+
+def directed_bigrams(tokens, n_vocab):
+    """
+    Table of the distinct directed bigrams of a token ID array (BIGRAM_DTYPE): source and target
+    ID, number of occurrences and the position of the first occurrence.
+    """
+    tokens = np.asarray(tokens, dtype=np.int64)
+    keys = tokens[:-1] * n_vocab + tokens[1:]
+    keys, first, counts = np.unique(keys, return_index=True, return_counts=True)
+    table = np.empty(len(keys), dtype=BIGRAM_DTYPE)
+    table['src'], table['dst'] = np.divmod(keys, n_vocab)
+    table['count'] = counts
+    table['first'] = first
+    return table
+
+
+def collapse_bigrams(bigrams, n_vocab):
+    """
+    Undirected edge table (EDGE_DTYPE, u <= v) from a directed bigram table, with the same
+    weights nx.Graph.add_edge would give. Edges are ordered by the first occurrence of either
+    direction, which is the order networkx would have inserted them in.
+    """
+    if len(bigrams) == 0:
+        return np.empty(0, dtype=EDGE_DTYPE)
+    src, dst, first = bigrams['src'], bigrams['dst'], bigrams['first']
+    u = np.minimum(src, dst).astype(np.int64)
+    v = np.maximum(src, dst).astype(np.int64)
+    pair = u * n_vocab + v
+    # Sort by pair, then by first occurrence (one argsort on a combined key when it fits in int64)
+    first_range = int(first.max()) + 1
+    if n_vocab * n_vocab <= np.iinfo(np.int64).max // first_range:
+        order = np.argsort(pair * first_range + first)
+    else:
+        order = np.lexsort((first, pair))
+    pair = pair[order]
+    group_start = np.r_[True, pair[1:] != pair[:-1]]
+    group_end = np.r_[pair[1:] != pair[:-1], True]
+
+    edges = np.empty(np.count_nonzero(group_start), dtype=EDGE_DTYPE)
+    start_index = order[group_start]
+    edges['u'] = u[start_index]
+    edges['v'] = v[start_index]
+    # Later direction wins the weight; the earlier one fixes the insertion order
+    edges['weight'] = bigrams['count'][order[group_end]]
+    edges['first'] = first[start_index]
+    return edges[np.argsort(edges['first'])]
+
+
+def symmetric_weight_matrix(edges, n_vocab):
+    """
+    Symmetric CSR weight matrix (n_vocab x n_vocab) from an undirected edge table.
+    """
+    off_diagonal = edges['u'] != edges['v']
+    rows = np.concatenate([edges['u'], edges['v'][off_diagonal]])
+    cols = np.concatenate([edges['v'], edges['u'][off_diagonal]])
+    data = np.concatenate([edges['weight'], edges['weight'][off_diagonal]])
+    return sp.coo_matrix((data, (rows, cols)), shape=(n_vocab, n_vocab)).tocsr()
+
+
+class SparseWordNetwork:
+    """
+    Undirected word-adjacency network, stored as an edge table (`edges`, EDGE_DTYPE) indexed by
+    token ID. `weights` is the symmetric CSR weight matrix and `nodes` lists the token IDs in
+    the network in the order networkx would have added them. to_networkx() builds (and caches)
+    the nx.Graph view.
+
+    Networks built from a token stream also keep what is needed to join them to other streams
+    (see concatenate_networks): the directed bigram table, the number of tokens, the first and
+    last token, and every token seen in order of first appearance. Networks produced by
+    network_union/difference/intersection have no stream (bigrams is None).
+    """
+
+    def __init__(self, vocab, edges, nodes, bigrams=None, n_tokens=0, first_token=-1, last_token=-1, seen=None):
+        self.vocab = vocab
+        self.edges = edges
+        self.nodes = nodes
+        self.bigrams = bigrams
+        self.n_tokens = n_tokens
+        self.first_token = first_token
+        self.last_token = last_token
+        self.seen = nodes if seen is None else seen
+        self._weights = None
+        self._graph = None
+
+    @classmethod
+    def from_bigrams(cls, vocab, bigrams, n_tokens, first_token, last_token, seen):
+        # A single token makes no pair, so it does not become a node
+        nodes = seen if n_tokens >= 2 else seen[:0]
+        return cls(vocab, collapse_bigrams(bigrams, len(vocab)), nodes, bigrams, n_tokens, first_token, last_token, seen)
+
+    @property
+    def n_vocab(self):
+        return len(self.vocab)
+
+    @property
+    def weights(self):
+        if self._weights is None:
+            self._weights = symmetric_weight_matrix(self.edges, len(self.vocab))
+        return self._weights
+
+    def number_of_nodes(self):
+        return len(self.nodes)
+
+    def number_of_edges(self):
+        return len(self.edges)
+
+    @instrumented
+    def to_networkx(self):
+        if self._graph is None:
+            import networkx as nx
+            G = nx.Graph()
+            G.add_nodes_from(self.vocab[self.nodes].tolist())
+            labels = self.vocab.tolist()
+            G.add_edges_from(
+                (labels[u], labels[v], {'weight': weight})
+                for u, v, weight in zip(self.edges['u'].tolist(), self.edges['v'].tolist(), self.edges['weight'].tolist())
+            )
+            self._graph = G
+        return self._graph
+
+
+def _first_appearance(ids):
+    # Unique IDs in order of first appearance
+    unique, first_seen = np.unique(ids, return_index=True)
+    return unique[np.argsort(first_seen)].astype(np.int32)
+
+
+@instrumented
+def build_sparse_network(token_ids, vocab, stop_mask=None):
+    """
+    SparseWordNetwork of a token ID array. stop_mask is a boolean array over the vocabulary
+    (True = stop-word); stop-words are dropped before pairing consecutive tokens.
+    """
+    vocab = np.asarray(vocab)
+    tokens = np.asarray(token_ids)
+    if stop_mask is not None:
+        tokens = tokens[~stop_mask[tokens]]
+    if len(tokens) == 0:
+        return SparseWordNetwork.from_bigrams(vocab, np.empty(0, dtype=BIGRAM_DTYPE), 0, -1, -1, np.empty(0, dtype=np.int32))
+
+    # Token IDs in order of first appearance, which is the order networkx adds the nodes
+    return SparseWordNetwork.from_bigrams(
+        vocab, directed_bigrams(tokens, len(vocab)), len(tokens), int(tokens[0]), int(tokens[-1]), _first_appearance(tokens)
+    )
+
+
+'''
+Graph algebra over networks, so combined and comparison networks never go back to the text:
+1. concatenate_networks joins networks of consecutive token streams (e.g. the three canticles, or any run of canti). The bigram tables are merged (counts summed, first occurrences shifted by the length of the earlier streams) and the bridge bigram between the last token of one stream and the first token of the next is added, so the result is exactly the network of the concatenated text
+2. network_union sums the edge weights of any networks
+3. network_difference keeps the edges of one network that do not appear in the others (e.g. edges unique to Paradiso)
+4. network_intersection keeps the edges that appear in every network, with the smallest weight
+'''
+
+def _merge_bigrams(tables, n_vocab):
+    # Merge directed bigram tables: counts are summed, the earliest first occurrence is kept
+    table = np.concatenate(tables)
+    if len(table) == 0:
+        return table
+    keys = table['src'].astype(np.int64) * n_vocab + table['dst']
+    # Each table is already sorted by key, so a stable sort only has to merge the runs
+    order = np.argsort(keys, kind='stable')
+    table, keys = table[order], keys[order]
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    merged = table[starts]
+    merged['count'] = np.add.reduceat(table['count'], starts)
+    merged['first'] = np.minimum.reduceat(table['first'], starts)
+    return merged
+
+
+def concatenate_networks(networks):
+    """
+    Network of the concatenation of the token streams behind `networks` (in order), including
+    the bridge bigrams at the boundaries. Equal to building the network from the joined text.
+    """
+    networks = [network for network in networks if network.n_tokens > 0]
+    if any(network.bigrams is None for network in networks):
+        raise ValueError('concatenate_networks needs networks built from token streams')
+    if len(networks) == 0:
+        raise ValueError('concatenate_networks needs at least one non-empty network')
+    vocab = networks[0].vocab
+
+    tables = []
+    offset = 0
+    previous = None
+    for network in networks:
+        bigrams = network.bigrams.copy()
+        bigrams['first'] += offset
+        tables.append(bigrams)
+        if previous is not None:
+            bridge = np.array([(previous.last_token, network.first_token, 1, offset - 1)], dtype=BIGRAM_DTYPE)
+            tables.append(bridge)
+        offset += network.n_tokens
+        previous = network
+
+    return SparseWordNetwork.from_bigrams(
+        vocab, _merge_bigrams(tables, len(vocab)), offset, networks[0].first_token, networks[-1].last_token,
+        _first_appearance(np.concatenate([network.seen for network in networks])),
+    )
+
+
+def _edge_keys(edges, n_vocab):
+    return edges['u'].astype(np.int64) * n_vocab + edges['v']
+
+
+def _network_from_edges(vocab, edges, node_order):
+    # Keep the nodes (in the given order) that still have an edge
+    present = np.zeros(len(vocab), dtype=bool)
+    present[edges['u']] = True
+    present[edges['v']] = True
+    return SparseWordNetwork(vocab, edges, node_order[present[node_order]])
+
+
+def network_union(*networks):
+    """
+    Network with every edge of any of the networks; weights are summed.
+    """
+    vocab = networks[0].vocab
+    edges = np.concatenate([network.edges for network in networks])
+    unique, first_index, inverse = np.unique(_edge_keys(edges, len(vocab)), return_index=True, return_inverse=True)
+    merged = edges[first_index]
+    merged['weight'] = np.bincount(inverse, weights=edges['weight'], minlength=len(unique))
+    merged['first'] = np.iinfo(np.int64).max
+    np.minimum.at(merged['first'], inverse, edges['first'])
+    merged = merged[np.argsort(merged['first'], kind='stable')]
+    node_order = _first_appearance(np.concatenate([network.nodes for network in networks]))
+    return _network_from_edges(vocab, merged, node_order)
+
+
+def network_difference(network, *others):
+    """
+    Edges of `network` that appear in none of `others`, with their weights in `network`.
+    """
+    n_vocab = len(network.vocab)
+    other_keys = np.concatenate([_edge_keys(other.edges, n_vocab) for other in others]) if others else np.empty(0, dtype=np.int64)
+    keep = ~np.isin(_edge_keys(network.edges, n_vocab), other_keys)
+    return _network_from_edges(network.vocab, network.edges[keep], network.nodes)
+
+
+def network_intersection(network, *others):
+    """
+    Edges of `network` that appear in every one of `others`, with the smallest of their weights.
+    """
+    n_vocab = len(network.vocab)
+    edges = network.edges.copy()
+    keys = _edge_keys(edges, n_vocab)
+    keep = np.ones(len(edges), dtype=bool)
+    for other in others:
+        other_keys = _edge_keys(other.edges, n_vocab)
+        order = np.argsort(other_keys)
+        position = np.searchsorted(other_keys, keys, sorter=order).clip(max=max(len(other_keys) - 1, 0))
+        if len(other_keys) == 0:
+            keep[:] = False
+            break
+        match = order[position]
+        keep &= other_keys[match] == keys
+        edges['weight'] = np.where(keep, np.minimum(edges['weight'], other.edges['weight'][match]), edges['weight'])
+    return _network_from_edges(network.vocab, edges[keep], network.nodes)
+
+
+'''
+Windowed co-occurrence networks. Every pair of tokens at most `window` positions apart is linked (window=1 is the word-adjacency network above). How we do this:
+1. Drop the stop-words, as above, so the window counts the remaining tokens
+2. For a chunk of offsets d, build the shifted-pair arrays (token i, token i + d) of all those offsets at once and turn each pair into an undirected key u * n_vocab + v (u <= v). The weight of a pair is 1, or 1 / d with distance weighting
+3. Sum the weights of equal keys and keep the position of their first occurrence (one sort per chunk), then merge the chunks' tables the same way. A chunk holds about max_pairs pairs, so peak memory depends on max_pairs and the number of distinct pairs, not on the window
+4. Unlike the adjacency network, the weight of an edge is the sum over both directions, and a word co-occurring with itself gets a self-loop. window=1 uses build_sparse_network, so it gives exactly the current graph
+'''
+
+WINDOW_EDGE_DTYPE = np.dtype([('u', 'i4'), ('v', 'i4'), ('weight', 'f8'), ('first', 'i8')])
+
+
+def _reduce_pairs(keys, weights, first):
+    # Sum the weights of equal keys and keep their earliest first occurrence; returns arrays sorted by key
+    if len(keys) == 0:
+        return keys, weights, first
+    order = np.lexsort((first, keys))
+    keys, weights, first = keys[order], weights[order], first[order]
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    return keys[starts], np.add.reduceat(weights, starts), first[starts]
+
+
+def window_pairs(tokens, n_vocab, window=2, distance_weighted=False, max_pairs=1 << 22):
+    """
+    (keys, weights, first) of the undirected pairs of tokens at most `window` positions apart:
+    key u * n_vocab + v with u <= v, summed weight, and the position of the first occurrence.
+    """
+    tokens = np.asarray(tokens, dtype=np.int64)
+    n = len(tokens)
+    offsets_per_chunk = max(1, max_pairs // max(n, 1))
+    tables = []
+    for start in range(1, min(window, n - 1) + 1, offsets_per_chunk):
+        offsets = np.arange(start, min(start + offsets_per_chunk, window + 1, n))
+        # Shifted pairs of every offset in the chunk: position i (i < n - d) with position i + d
+        lengths = n - offsets
+        d = np.repeat(offsets, lengths)
+        i = np.arange(len(d)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        a, b = tokens[i], tokens[i + d]
+        keys = np.minimum(a, b) * n_vocab + np.maximum(a, b)
+        weights = 1.0 / d if distance_weighted else np.ones(len(d))
+        tables.append(_reduce_pairs(keys, weights, i))
+    if not tables:
+        return np.empty(0, dtype=np.int64), np.empty(0), np.empty(0, dtype=np.int64)
+    if len(tables) == 1:
+        return tables[0]
+    return _reduce_pairs(*(np.concatenate(parts) for parts in zip(*tables)))
+
+
+@instrumented
+def build_window_network(token_ids, vocab, window=2, stop_mask=None, distance_weighted=False, max_pairs=1 << 22):
+    """
+    SparseWordNetwork linking every pair of tokens at most `window` positions apart (after
+    dropping the stop-words). Weights count the co-occurrences, or sum 1 / distance when
+    distance_weighted. window=1 returns build_sparse_network's adjacency network.
+    """
+    if window < 1:
+        raise ValueError(f'window must be at least 1, not {window}')
+    if window == 1:
+        return build_sparse_network(token_ids, vocab, stop_mask)
+    vocab = np.asarray(vocab)
+    tokens = np.asarray(token_ids)
+    if stop_mask is not None:
+        tokens = tokens[~stop_mask[tokens]]
+
+    keys, weights, first = window_pairs(tokens, len(vocab), window, distance_weighted, max_pairs)
+    edges = np.empty(len(keys), dtype=WINDOW_EDGE_DTYPE)
+    edges['u'], edges['v'] = np.divmod(keys, len(vocab))
+    edges['weight'] = weights
+    edges['first'] = first
+    edges = edges[np.argsort(first, kind='stable')]
+    nodes = _first_appearance(tokens) if len(tokens) >= 2 else np.empty(0, dtype=np.int32)
+    return SparseWordNetwork(vocab, edges, nodes, n_tokens=len(tokens))
+
+
 # Define function to create word-adjacency network
-def create_word_adjacency_network(text):
-    tokens = word_tokenize(text)
+@instrumented
+def create_word_adjacency_network(text, tokenizer=DEFAULT_TOKENIZER, window=1, distance_weighted=False):
+    tokens = tokenize(text, tokenizer)
     # Remove stopwords
-    stop_words = set(stopwords.words('italian'))
-    # Additional Italian stopwords
-    additional_stopwords = ['altro','tanto','altri','e', 'ei','lor','giù','com','laltro','elli','te','tal','sù','or','ciò','chè', 'sé','pur','fa','cha','son','disse','vidi','ché','né','però','chio','ancor','qui','pero','qual', 'già', 'così', 'là', 'de', 'poi', 'quando', 'quel', 'sì', 'gia', 'me', 'ne', 'non', 'che', 'di', 'la', 'il', 'le', 'lo', 'gli', 'dei', 'delle', 'un', 'una', 'uno']
-    stop_words.update(additional_stopwords)
+    stop_words = get_stop_words()
     tokens = [word for word in tokens if word not in stop_words]
-    # Build adjacency list
-    adjacency = {}
-    for i in range(len(tokens) - 1):
-        pair = (tokens[i], tokens[i + 1])
-        if pair in adjacency:
-            adjacency[pair] += 1
-        else:
-            adjacency[pair] = 1
-    # Create the network
-    G = nx.Graph()
-    for (word1, word2), weight in adjacency.items():
-        G.add_edge(word1, word2, weight=weight)
-    return G
-
-def create_networks(inferno_clean, purgatorio_clean, paradiso_clean , whole_clean):
+    # Encode the tokens as IDs and build the network with the sparse builder
+    vocab = {}
+    token_ids = np.fromiter((vocab.setdefault(word, len(vocab)) for word in tokens), dtype=np.int64, count=len(tokens))
+    return build_window_network(token_ids, np.array(list(vocab), dtype=str), window, distance_weighted=distance_weighted).to_networkx()
+
+@instrumented
+def create_networks(inferno_clean, purgatorio_clean, paradiso_clean , whole_clean, tokenizer=DEFAULT_TOKENIZER, window=1, distance_weighted=False):
     # Create networks
-    G_inferno = create_word_adjacency_network(inferno_clean)
-    G_purgatorio = create_word_adjacency_network(purgatorio_clean)
-    G_paradiso = create_word_adjacency_network(paradiso_clean)
-    G_whole = create_word_adjacency_network(whole_clean)
+    G_inferno = create_word_adjacency_network(inferno_clean, tokenizer, window, distance_weighted)
+    G_purgatorio = create_word_adjacency_network(purgatorio_clean, tokenizer, window, distance_weighted)
+    G_paradiso = create_word_adjacency_network(paradiso_clean, tokenizer, window, distance_weighted)
+    G_whole = create_word_adjacency_network(whole_clean, tokenizer, window, distance_weighted)
+    return G_inferno, G_paradiso, G_purgatorio, G_whole
+
+
+'''
+Networks from the integer-encoded corpus (src/corpus.py). Same steps as above, but the stop-word filter is a boolean mask over the vocabulary, so the text is never re-tokenised.
+'''
+
+def stop_word_mask(vocab):
+    """
+    Boolean array with True for every token ID whose word is a stop word.
+    """
+    return np.isin(vocab, list(STOP_WORDS))
+
+def create_word_adjacency_network_from_ids(token_ids, vocab, stop_mask=None, window=1, distance_weighted=False):
+    if stop_mask is None:
+        stop_mask = stop_word_mask(vocab)
+    return build_window_network(token_ids, vocab, window, stop_mask, distance_weighted).to_networkx()
+
+@instrumented
+def create_sparse_networks_from_corpus(corpus, window=1, distance_weighted=False):
+    """
+    SparseWordNetwork for each canticle and the whole poem (no networkx graphs are built), linking
+    tokens up to `window` apart. For window=1 the whole-poem network is joined from the canticle
+    networks rather than rebuilt.
+    """
+    stop_mask = stop_word_mask(corpus.vocab)
+    N_inferno = build_window_network(corpus.canticle('inferno'), corpus.vocab, window, stop_mask, distance_weighted)
+    N_purgatorio = build_window_network(corpus.canticle('purgatorio'), corpus.vocab, window, stop_mask, distance_weighted)
+    N_paradiso = build_window_network(corpus.canticle('paradiso'), corpus.vocab, window, stop_mask, distance_weighted)
+    if window == 1:
+        N_whole = concatenate_networks([N_inferno, N_purgatorio, N_paradiso])
+    else:
+        N_whole = build_window_network(corpus.token_ids, corpus.vocab, window, stop_mask, distance_weighted)
+    return N_inferno, N_paradiso, N_purgatorio, N_whole
+
+def create_canto_networks(corpus, canticle, stop_mask=None):
+    """
+    One SparseWordNetwork per canto of a canticle. Any run of consecutive canti can be joined
+    with concatenate_networks, and any grouping compared with the union/difference/intersection.
+    """
+    if stop_mask is None:
+        stop_mask = stop_word_mask(corpus.vocab)
+    return [build_sparse_network(token_ids, corpus.vocab, stop_mask) for token_ids in corpus.canti(canticle)]
+
+@instrumented
+def create_networks_from_corpus(corpus, window=1, distance_weighted=False):
+    networks = create_sparse_networks_from_corpus(corpus, window, distance_weighted)
+    G_inferno, G_paradiso, G_purgatorio, G_whole = (network.to_networkx() for network in networks)
     return G_inferno, G_paradiso, G_purgatorio, G_whole
@@ -1,19 +1,252 @@
-import matplotlib.pyplot as plt
-import networkx as nx
+import hashlib
+import os
+from functools import lru_cache
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.fft import irfft2, next_fast_len, rfft2
+
+from src.create_networks import SparseWordNetwork
+from src.instrumentation import instrumented
+from src.rendering import finish_figure, render
 
 '''How do we display the network:
-1. Generate node positions using the spring layout algorithm (seed = 42)
+1. Generate node positions with a multilevel force-directed layout (seed = 42), cached on disk
 2. Calculate node sizes by the degree of each node (weighted degree) and scale node size proportionally to the degree
 3. To visualise nodes we assign a unique colour based on location, size based on degree, grey edges, no node borders, use a viridis colour scheme, and disable node labels.'''
 
 
-def display_network(G):
+DEFAULT_LAYOUT_CACHE_DIR = os.path.join('.cache', 'layouts')
+
+# Above this many nodes, repulsion is approximated on a grid instead of computed for all pairs
+EXACT_REPULSION_MAX_NODES = 500
+
+
+def _graph_arrays(G):
+    # Node labels and symmetric CSR weights (diagonal dropped) of a networkx graph or a SparseWordNetwork
+    if isinstance(G, SparseWordNetwork):
+        labels = G.vocab[G.nodes].tolist()
+        W = G.weights[G.nodes][:, G.nodes].astype(float)
+    else:
+        import networkx as nx
+        labels = list(G)
+        if not labels:
+            return labels, sp.csr_matrix((0, 0))
+        W = nx.to_scipy_sparse_array(G, nodelist=labels, weight='weight', dtype=float, format='csr')
+    W = sp.csr_matrix(W)
+    W.setdiag(0)
+    W.eliminate_zeros()
+    return labels, W
+
+
+def _coarsen(W):
+    """
+    One coarsening step. Every node points to its highest-degree neighbour if that neighbour has
+    a higher degree than itself, and the nodes pointing to the same node become one cluster.
+    Returns the cluster of every node and the number of clusters.
+    """
+    n = W.shape[0]
+    degree = np.diff(W.indptr)
+    rows = np.repeat(np.arange(n), degree)
+    # Highest-degree neighbour of each node: sort entries by (row, neighbour degree), take the last of each row
+    order = np.lexsort((degree[W.indices], rows))
+    has_neighbors = degree > 0
+    target = np.arange(n)
+    best = W.indices[order[W.indptr[1:][has_neighbors] - 1]]
+    target[has_neighbors] = np.where(degree[best] > degree[has_neighbors], best, target[has_neighbors])
+    _, cluster = np.unique(target, return_inverse=True)
+    return cluster, cluster.max() + 1
+
+
+def _repulsion_exact(pos, mass, k):
+    delta = pos[:, None, :] - pos[None, :, :]
+    distance2 = np.maximum((delta ** 2).sum(axis=-1), 1e-9)
+    return (delta * (mass[None, :] * k * k / distance2)[..., None]).sum(axis=1)
+
+
+@lru_cache(maxsize=4)
+def _repulsion_kernel(grid_size):
+    # FFT of the x and y repulsion kernels (offset / distance^2) for a grid with unit cells
+    offsets = np.arange(-(grid_size - 1), grid_size, dtype=float)
+    dx, dy = np.meshgrid(offsets, offsets, indexing='ij')
+    distance2 = dx ** 2 + dy ** 2
+    distance2[grid_size - 1, grid_size - 1] = np.inf
+    shape = (next_fast_len(3 * grid_size - 2),) * 2
+    return shape, rfft2(dx / distance2, shape), rfft2(dy / distance2, shape)
+
+
+def _repulsion_grid(pos, mass, k, grid_size=256):
+    """
+    Approximate repulsion for large graphs: the node masses are binned on a grid and convolved
+    (FFT) with the 1/distance repulsion kernel, and each node reads the force at its cell.
+    """
+    low = pos.min(axis=0)
+    cell_size = max((pos.max(axis=0) - low).max(), 1e-9) / (grid_size - 1)
+    cell = np.minimum(((pos - low) / cell_size).astype(np.int64), grid_size - 1)
+    mass_grid = np.bincount(cell[:, 0] * grid_size + cell[:, 1], weights=mass, minlength=grid_size * grid_size)
+
+    shape, kernel_x, kernel_y = _repulsion_kernel(grid_size)
+    mass_fft = rfft2(mass_grid.reshape(grid_size, grid_size), shape)
+    # The kernel scales as 1 / cell_size; the convolution centre sits at offset grid_size - 1
+    rows, cols = cell[:, 0] + grid_size - 1, cell[:, 1] + grid_size - 1
+    force_x = irfft2(mass_fft * kernel_x, shape)[rows, cols]
+    force_y = irfft2(mass_fft * kernel_y, shape)[rows, cols]
+    return (k * k / cell_size) * np.stack([force_x, force_y], axis=1)
+
+
+def _force_layout(W, pos, mass, iterations, temperature, rng):
+    """
+    Fruchterman-Reingold iterations on a sparse weighted graph (positions in the unit square).
+    """
+    n = len(pos)
+    if n == 1:
+        return pos
+    k = np.sqrt(1.0 / n)
+    W = W.tocoo()
+    rows, cols, weights = W.row, W.col, W.data
+    cooling = temperature / (iterations + 1)
+    for _ in range(iterations):
+        if n <= EXACT_REPULSION_MAX_NODES:
+            force = _repulsion_exact(pos, mass, k)
+        else:
+            force = _repulsion_grid(pos, mass, k)
+        # Attraction along the edges (each direction is stored, so every node gets its share)
+        delta = pos[rows] - pos[cols]
+        distance = np.sqrt((delta ** 2).sum(axis=1))
+        attraction = delta * (weights * distance / k)[:, None]
+        force[:, 0] -= np.bincount(rows, weights=attraction[:, 0], minlength=n)
+        force[:, 1] -= np.bincount(rows, weights=attraction[:, 1], minlength=n)
+
+        length = np.maximum(np.sqrt((force ** 2).sum(axis=1)), 1e-9)
+        pos = pos + force * (np.minimum(length, temperature) / length)[:, None]
+        temperature -= cooling
+    return pos
+
+
+@instrumented
+def multilevel_layout(W, init_pos=None, seed=42, coarse_iterations=100, refine_iterations=30, min_nodes=50):
+    """
+    Node positions (n x 2 array, centred and scaled to [-1, 1]) for a symmetric sparse weighted
+    adjacency matrix: the graph is coarsened until small, laid out, then refined level by level.
+    init_pos is an optional n x 2 array of starting positions (rows of NaN for nodes without
+    one); with it, the graph is not coarsened and only refined.
+    """
+    rng = np.random.default_rng(seed)
+    W = sp.csr_matrix(W, dtype=float)
+    n = W.shape[0]
+    if n == 0:
+        return np.empty((0, 2))
+
+    known = None if init_pos is None else ~np.isnan(np.asarray(init_pos, dtype=float)).any(axis=1)
+    if known is not None and known.any():
+        # Rescale the known positions to the unit square
+        pos = np.nan_to_num(np.asarray(init_pos, dtype=float))
+        low, high = pos[known].min(axis=0), pos[known].max(axis=0)
+        pos[known] = (pos[known] - low) / np.maximum(high - low, 1e-9)
+        # New nodes start at the weighted mean position of their placed neighbours, or at random if they have none
+        missing = ~known
+        neighbor_weight = W[missing] @ known.astype(float)
+        neighbor_mean = (W[missing] @ (pos * known[:, None])) / np.maximum(neighbor_weight, 1e-9)[:, None]
+        pos[missing] = np.where((neighbor_weight > 0)[:, None], neighbor_mean, rng.random((missing.sum(), 2)))
+        return _normalise(_force_layout(W, pos, np.ones(n), refine_iterations, 0.02, rng))
+
+    # Coarsen
+    levels = []
+    graph, mass = W, np.ones(n)
+    while graph.shape[0] > min_nodes:
+        cluster, n_clusters = _coarsen(graph)
+        if n_clusters > 0.9 * graph.shape[0]:
+            break
+        P = sp.csr_matrix((np.ones(graph.shape[0]), (np.arange(graph.shape[0]), cluster)), shape=(graph.shape[0], n_clusters))
+        levels.append((graph, mass, cluster))
+        graph = (P.T @ graph @ P).tocsr()
+        graph.setdiag(0)
+        graph.eliminate_zeros()
+        mass = np.bincount(cluster, weights=mass, minlength=n_clusters)
+
+    # Lay out the coarsest graph, then refine level by level
+    pos = _force_layout(graph, rng.random((graph.shape[0], 2)), mass, coarse_iterations, 0.1, rng)
+    for fine_graph, fine_mass, cluster in reversed(levels):
+        jitter = rng.normal(scale=np.sqrt(1.0 / fine_graph.shape[0]) * 0.1, size=(fine_graph.shape[0], 2))
+        pos = _force_layout(fine_graph, pos[cluster] + jitter, fine_mass, refine_iterations, 0.05, rng)
+    return _normalise(pos)
+
+
+def _normalise(pos):
+    pos = pos - pos.mean(axis=0)
+    scale = np.abs(pos).max()
+    return pos / scale if scale > 0 else pos
+
+
+def layout_fingerprint(labels, W, **params):
+    """
+    Hash of a graph (node labels, edges and weights) and the layout parameters.
+    """
+    W = sp.csr_matrix(W)
+    W.sort_indices()
+    digest = hashlib.sha256()
+    digest.update('\n'.join(map(str, labels)).encode('utf-8'))
+    for array in (W.indptr, W.indices, W.data):
+        digest.update(np.ascontiguousarray(array).tobytes())
+    digest.update(repr(sorted(params.items())).encode('utf-8'))
+    return digest.hexdigest()
+
+
+@instrumented
+def compute_layout(G, init_pos=None, seed=42, cache_dir=DEFAULT_LAYOUT_CACHE_DIR):
+    """
+    Multilevel layout of a networkx graph or SparseWordNetwork as a {node: (x, y)} dict.
+
+    init_pos is an optional {node: (x, y)} dict (e.g. the layout of the whole poem) used as
+    starting positions. Layouts are cached in cache_dir keyed by the graph fingerprint and the
+    starting positions; pass cache_dir=None to disable the cache.
+    """
+    labels, W = _graph_arrays(G)
+    start = None
+    if init_pos is not None:
+        start = np.array([init_pos.get(label, (np.nan, np.nan)) for label in labels], dtype=float).reshape(-1, 2)
+
+    path = None
+    if cache_dir is not None:
+        start_hash = hashlib.sha256(np.ascontiguousarray(start).tobytes()).hexdigest() if start is not None else None
+        path = os.path.join(cache_dir, layout_fingerprint(labels, W, seed=seed, init_pos=start_hash) + '.npy')
+        if os.path.exists(path):
+            return dict(zip(labels, np.load(path)))
+
+    pos = multilevel_layout(W, init_pos=start, seed=seed)
+    if path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        np.save(path, pos)
+    return dict(zip(labels, pos))
+
+
+def display_network(G, pos=None, cache_dir=DEFAULT_LAYOUT_CACHE_DIR, renderer=None, name='network'):
+    """
+    Draw a word network (networkx graph or SparseWordNetwork) and return the node positions, so
+    they can be passed on as init_pos to the layouts of subgraphs. The figure is drawn on
+    renderer if given (see src/rendering.py).
+    """
+    if isinstance(G, SparseWordNetwork):
+        G = G.to_networkx()
+
+    # Multilevel layout, computed once per graph and then loaded from the cache
+    if pos is None:
+        pos = compute_layout(G, cache_dir=cache_dir)
+
+    render(renderer, draw_network, G, pos, name=name)
+    return pos
+
+
+def draw_network(G, pos, name='network'):
+    """
+    Draw a networkx graph with the given {node: (x, y)} positions.
+    """
+    import matplotlib.pyplot as plt
+    import networkx as nx
+
     # Set figure size
     plt.figure(figsize=(14, 10))
 
-    # Generate a spring layout with limited iterations for faster computation
-    pos = nx.spring_layout(G, iterations=20, seed=42)  # Reduce iterations to speed up layout generation
-
     # Calculate node degrees to scale node sizes
     degrees = dict(G.degree(weight='weight'))
     node_sizes = [degrees[node] for node in G.nodes()]
@@ -45,8 +278,8 @@ def display_network(G):
     # Turn off axis
     plt.axis('off')
 
-    # Show plot
-    plt.show()
+    # Show or save the plot
+    finish_figure(name)
 
 # Visualize the graph
 #display_network(G_whole)
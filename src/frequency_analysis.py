@@ -2,25 +2,74 @@
 Compute the frequency distributions. We do this by:
 1. Tokenising the text
 2. Count frequency of each word and then orders them to get a rank
+3. With mode='approximate' the counts go into a bounded-memory FrequencySketch (src/frequency_sketch.py) a chunk at a time instead of a Counter
 '''
 
-from nltk.tokenize import word_tokenize
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
 import numpy as np
-import matplotlib.pyplot as plt
+from scipy.special import zeta
+
+from src.frequency_sketch import FrequencySketch
+from src.instrumentation import instrumented
+from src.rendering import finish_figure, render
+from src.tokenizer import DEFAULT_TOKENIZER, tokenize
+
+# matplotlib is imported inside the plotting functions, so computing the distributions does not load it
 
+FREQUENCY_MODES = ('exact', 'approximate')
+SKETCH_CHUNK = 1 << 14  # tokens added to the sketch at a time in approximate mode
 
-def get_word_frequencies(text):
 
-    tokens = word_tokenize(text)  # Tokenize the text
+def _check_mode(mode):
+    if mode not in FREQUENCY_MODES:
+        raise ValueError(f'mode must be one of {FREQUENCY_MODES}, not {mode!r}')
+
+
+@instrumented
+def get_word_frequencies(text, tokenizer=DEFAULT_TOKENIZER, mode='exact', **sketch_options):
+    """
+    Counter of the words of text, or with mode='approximate' a FrequencySketch
+    (sketch_options: top_k, width, depth, seed).
+    """
+    _check_mode(mode)
+    tokens = tokenize(text, tokenizer)  # Tokenize the text (see src/tokenizer.py)
+    if mode == 'approximate':
+        sketch = FrequencySketch(**sketch_options)
+        for start in range(0, len(tokens), SKETCH_CHUNK):
+            sketch.update(tokens[start:start + SKETCH_CHUNK])
+        return sketch
     freq_dist = Counter(tokens)  # Count occurrences of each word
     return freq_dist
 
 # Compute frequency distributions for each canticle
-def freq_dist(inferno_clean, purgatorio_clean, paradiso_clean):
-    freq_inferno = get_word_frequencies(inferno_clean)
-    freq_purgatorio = get_word_frequencies(purgatorio_clean)
-    freq_paradiso = get_word_frequencies(paradiso_clean)
+def freq_dist(inferno_clean, purgatorio_clean, paradiso_clean, tokenizer=DEFAULT_TOKENIZER, mode='exact', **sketch_options):
+    freq_inferno = get_word_frequencies(inferno_clean, tokenizer, mode, **sketch_options)
+    freq_purgatorio = get_word_frequencies(purgatorio_clean, tokenizer, mode, **sketch_options)
+    freq_paradiso = get_word_frequencies(paradiso_clean, tokenizer, mode, **sketch_options)
+    return freq_inferno, freq_purgatorio, freq_paradiso
+
+@instrumented
+def get_word_frequencies_from_ids(token_ids, vocab, mode='exact', **sketch_options):
+    _check_mode(mode)
+    token_ids = np.asarray(token_ids)
+    if mode == 'approximate':
+        sketch = FrequencySketch(**sketch_options)
+        for start in range(0, len(token_ids), SKETCH_CHUNK):
+            sketch.update_ids(token_ids[start:start + SKETCH_CHUNK], vocab)
+        return sketch
+    # Count token IDs in one pass, then map the non-zero counts back to words
+    counts = np.bincount(token_ids, minlength=len(vocab))
+    present = np.flatnonzero(counts)
+    return Counter(dict(zip(vocab[present].tolist(), counts[present].tolist())))
+
+# Same as freq_dist but reading the integer-encoded corpus (src/corpus.py)
+def freq_dist_from_corpus(corpus, mode='exact', **sketch_options):
+    freq_inferno = get_word_frequencies_from_ids(corpus.canticle('inferno'), corpus.vocab, mode, **sketch_options)
+    freq_purgatorio = get_word_frequencies_from_ids(corpus.canticle('purgatorio'), corpus.vocab, mode, **sketch_options)
+    freq_paradiso = get_word_frequencies_from_ids(corpus.canticle('paradiso'), corpus.vocab, mode, **sketch_options)
     return freq_inferno, freq_purgatorio, freq_paradiso
 
 '''
@@ -30,7 +79,7 @@ Plotting the frequency distribution:
 3. Determine the slop beta value to provide insight into the frequency distribution  
 '''
 
-def plot_word_frequency_rank(freq_dist, title):
+def plot_word_frequency_rank(freq_dist, title, name=None):
     """
     Plot word frequencies on a log-log scale with power-law fitting.
     """
@@ -39,6 +88,7 @@ def plot_word_frequency_rank(freq_dist, title):
     # Compute ranks
     ranks = np.arange(1, len(frequencies) + 1)
     
+    import matplotlib.pyplot as plt
     # Set font to Times New Roman
     plt.rcParams["font.family"] = "Times New Roman"
 
@@ -62,7 +112,7 @@ def plot_word_frequency_rank(freq_dist, title):
              bbox=dict(facecolor='white', edgecolor='black', boxstyle='round,pad=0.3'),
              horizontalalignment='right', verticalalignment='top')
 
-    plt.show()
+    finish_figure(name or f'zipf_{title.lower()}')
 
 
 '''Logrithmic binning for Zipf plots (to clean up noisy right tail)'''
@@ -87,35 +137,205 @@ def _log_bin_by_rank(ranks, freqs, n_bins=50, min_points_per_bin=1):
     # Log spaced bin edges in rank space
     edges = np.logspace(np.log10(ranks.min()), np.log10(ranks.max()), n_bins + 1)
 
-    binned_r = []
-    binned_f = []
+    # Bin i + 1 of digitize is [edges[i], edges[i + 1]); 0 and n_bins + 1 fall outside the edges
+    bins = np.digitize(ranks, edges)
+    counts = np.bincount(bins, minlength=n_bins + 2)[1:-1]
+    log_rank_sums = np.bincount(bins, weights=np.log(ranks), minlength=n_bins + 2)[1:-1]
+    freq_sums = np.bincount(bins, weights=freqs, minlength=n_bins + 2)[1:-1]
+
+    keep = (counts >= min_points_per_bin) & (counts > 0)
+    # geometric mean rank, mean frequency
+    binned_r = np.exp(log_rank_sums[keep] / counts[keep])
+    binned_f = freq_sums[keep] / counts[keep]
+    return binned_r, binned_f
+
+'''
+Discrete power-law fit of the word frequencies (Clauset, Shalizi & Newman 2009). How we do this:
+1. Model the frequencies x of the words in the tail as P(x) = x^-α / ζ(α, x_min) for x >= x_min, where ζ is the Hurwitz zeta function
+2. For every candidate x_min (each distinct frequency leaving at least min_tail words in the tail), find the maximum-likelihood α with a golden-section search run for all candidates at once
+3. Keep the x_min whose fitted distribution is closest to the data: the smallest Kolmogorov-Smirnov distance D between the fitted and the empirical CCDF of the tail
+4. Goodness of fit: the p-value is the fraction of synthetic data sets (power law above x_min, resampled data below it) whose own fit has a larger D than the data
+5. The rank-frequency (Zipf) exponent is β = -1/(α-1); its confidence interval comes from refitting bootstrap resamples of the word frequencies
+6. Both bootstraps run on a process pool, each resample with its own child of one numpy SeedSequence, so the results do not depend on the number of workers
+7. For a FrequencySketch the fit uses the upper frequency bounds of the words it lists (every word more frequent than its error, see src/frequency_sketch.py), and only x_min values above that error are tried: below it the sketched curve is truncated. The sketch error is reported next to β: α is refitted at the same x_min on the lower frequency bounds, and beta_sketch_low/high are the β of the two fits (NaN for exact counts), so β itself is one end of that range
+'''
 
-    for lo, hi in zip(edges[:-1], edges[1:]):
-        in_bin = (ranks >= lo) & (ranks < hi)
-        if np.count_nonzero(in_bin) < min_points_per_bin:
-            continue
+ZIPF_TABLE_DTYPE = np.dtype([
+    ('corpus', 'U32'),
+    ('n_words', 'i8'),
+    ('x_min', 'i8'),
+    ('n_tail', 'i8'),
+    ('alpha', 'f8'),
+    ('alpha_low', 'f8'),
+    ('alpha_high', 'f8'),
+    ('beta', 'f8'),
+    ('beta_low', 'f8'),
+    ('beta_high', 'f8'),
+    ('ks_distance', 'f8'),
+    ('p_value', 'f8'),
+    ('beta_sketch_low', 'f8'),
+    ('beta_sketch_high', 'f8'),
+])
+
+_GOLDEN = (np.sqrt(5) - 1) / 2
+
+
+def _mle_alpha(x_min, n_tail, sum_log_x, low=1.01, high=6.0, iterations=60):
+    """
+    Maximum-likelihood α for each candidate x_min (arrays), by golden-section search on the
+    negative log-likelihood n log ζ(α, x_min) + α ∑ log x.
+    """
+    def negative_log_likelihood(alpha):
+        return n_tail * np.log(zeta(alpha, x_min)) + alpha * sum_log_x
+
+    a = np.full(len(x_min), low)
+    b = np.full(len(x_min), high)
+    c = b - _GOLDEN * (b - a)
+    d = a + _GOLDEN * (b - a)
+    f_c, f_d = negative_log_likelihood(c), negative_log_likelihood(d)
+    for _ in range(iterations):
+        left = f_c < f_d
+        # Minimum in [a, d] where f(c) < f(d), otherwise in [c, b]
+        b = np.where(left, d, b)
+        a = np.where(left, a, c)
+        c, d = np.where(left, b - _GOLDEN * (b - a), d), np.where(left, c, a + _GOLDEN * (b - a))
+        f_c, f_d = np.where(left, negative_log_likelihood(c), f_d), np.where(left, f_c, negative_log_likelihood(d))
+    return (a + b) / 2
+
+
+def _ks_distances(x, x_min, n_tail, alpha):
+    """
+    KS distance between the empirical and the fitted CCDF of the tail, for each candidate x_min.
+    """
+    values, first = np.unique(x, return_index=True)
+    at_least = len(x) - first  # number of words with frequency >= each distinct value
+    in_tail = values[None, :] >= x_min[:, None]
+    empirical = at_least[None, :] / n_tail[:, None]
+    fitted = zeta(alpha[:, None], values[None, :]) / zeta(alpha, x_min)[:, None]
+    return np.where(in_tail, np.abs(empirical - fitted), 0.0).max(axis=1)
 
-        r_bin = ranks[in_bin]
-        f_bin = freqs[in_bin]
 
-        # geometric mean rank, mean frequency
-        r_gm = np.exp(np.mean(np.log(r_bin)))
-        f_mean = np.mean(f_bin)
+@instrumented
+def fit_power_law(frequencies, min_tail=50, above=0):
+    """
+    Discrete power-law fit of an array of word frequencies with the x_min search (over x_min > above).
+    Returns (alpha, x_min, n_tail, ks_distance).
+    """
+    x = np.sort(np.asarray(frequencies, dtype=np.int64))
+    x = x[x > 0]
+    if len(x) == 0:
+        return np.nan, 0, 0, np.nan
+
+    candidates = np.unique(x)
+    start = np.searchsorted(x, candidates)
+    n_tail = len(x) - start
+    keep = (n_tail >= min(min_tail, len(x))) & (candidates > above)
+    if not keep.any():
+        return np.nan, 0, 0, np.nan
+    candidates, start, n_tail = candidates[keep], start[keep], n_tail[keep]
+
+    # ∑ log x over each candidate's tail, from one suffix sum
+    suffix_log = np.append(np.cumsum(np.log(x)[::-1])[::-1], 0.0)
+    alpha = _mle_alpha(candidates.astype(float), n_tail, suffix_log[start])
+    distances = _ks_distances(x, candidates, n_tail, alpha)
+    best = int(np.argmin(distances))
+    return float(alpha[best]), int(candidates[best]), int(n_tail[best]), float(distances[best])
+
+
+def _sketch_beta_bounds(sketch, alpha, x_min):
+    """
+    Range of β = -1/(α-1) between the fit (on the sketch's upper frequency bounds) and its refit at x_min on the lower bounds.
+    """
+    _, lower, _ = sketch.frequency_bounds()
+    alphas = [alpha]
+    tail = lower[lower >= x_min]
+    if len(tail) > 0:
+        alphas.append(_mle_alpha(np.array([float(x_min)]), len(tail), np.log(tail).sum())[0])
+    betas = -1 / (np.asarray(alphas) - 1)
+    return float(betas.min()), float(betas.max())
 
-        binned_r.append(r_gm)
-        binned_f.append(f_mean)
 
-    return np.asarray(binned_r), np.asarray(binned_f)
+def _sample_power_law(alpha, x_min, size, rng):
+    # Discrete power-law samples by rounding the continuous inverse CDF (Clauset et al., appendix D)
+    u = rng.random(size)
+    return np.floor((x_min - 0.5) * (1 - u) ** (-1 / (alpha - 1)) + 0.5).astype(np.int64)
 
 
-def plot_word_frequency_rank_binned(freq_dist, title, n_bins=50, min_points_per_bin=2, fit_on="binned"):
+def _bootstrap_fit(task):
+    """
+    Worker for zipf_exponents: refit one resample. kind 'gof' draws a synthetic data set from the
+    fitted power law and returns its KS distance; kind 'ci' resamples the data and returns α.
+    """
+    kind, x, alpha, x_min, n_tail, min_tail, above, seed_sequence = task
+    rng = np.random.default_rng(seed_sequence)
+    if kind == 'ci':
+        return fit_power_law(rng.choice(x, size=len(x)), min_tail=min_tail, above=above)[0]
+    from_tail = rng.random(len(x)) < n_tail / len(x)
+    below = x[x < x_min]
+    synthetic = np.empty(len(x), dtype=np.int64)
+    synthetic[from_tail] = _sample_power_law(alpha, x_min, int(from_tail.sum()), rng)
+    if len(below) > 0:
+        synthetic[~from_tail] = rng.choice(below, size=int((~from_tail).sum()))
+    else:
+        synthetic[~from_tail] = _sample_power_law(alpha, x_min, int((~from_tail).sum()), rng)
+    return fit_power_law(synthetic, min_tail=min_tail, above=above)[3]
+
+
+@instrumented
+def zipf_exponents(freq_dists, n_bootstrap=100, ci=0.95, min_tail=50, seed=None, workers=None):
+    """
+    Power-law fit of several frequency distributions ({name: Counter, FrequencySketch or array of frequencies}).
+
+    Returns a structured array with ZIPF_TABLE_DTYPE, one row per distribution: x_min, α and
+    β = -1/(α-1) with `ci` bootstrap confidence intervals, the KS distance and the goodness-of-fit
+    p-value, each from n_bootstrap resamples (n_bootstrap=0 skips both), and for a FrequencySketch
+    the range of β allowed by its error. workers=1 runs the bootstraps in this process.
+    """
+    fits, tasks = [], []
+    seed_sequences = iter(np.random.SeedSequence(seed).spawn(2 * n_bootstrap * len(freq_dists)))
+    for name, freq in freq_dists.items():
+        x = np.asarray(list(freq.values()) if hasattr(freq, 'values') else freq, dtype=np.int64)
+        # A sketch's curve is only complete above its error
+        above = freq.subtracted if isinstance(freq, FrequencySketch) else 0
+        alpha, x_min, n_tail, distance = fit_power_law(x, min_tail=min_tail, above=above)
+        sketch_betas = _sketch_beta_bounds(freq, alpha, x_min) if isinstance(freq, FrequencySketch) and n_tail > 0 else (np.nan, np.nan)
+        fits.append((name, len(x), x_min, n_tail, alpha, distance, sketch_betas))
+        for kind in ('gof', 'ci'):
+            tasks.extend((kind, x, alpha, x_min, n_tail, min_tail, above, next(seed_sequences)) for _ in range(n_bootstrap))
+
+    if workers == 1 or not tasks:
+        results = [_bootstrap_fit(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            results = list(pool.map(_bootstrap_fit, tasks, chunksize=8))
+    results = np.asarray(results, dtype=float).reshape(len(fits), 2, n_bootstrap)
+
+    rows = []
+    tail = (1 - ci) / 2
+    for (name, n_words, x_min, n_tail, alpha, distance, sketch_betas), (distances, alphas) in zip(fits, results):
+        if n_bootstrap > 0:
+            p_value = float(np.mean(distances >= distance))
+            alpha_low, alpha_high = np.quantile(alphas, [tail, 1 - tail])
+        else:
+            p_value, alpha_low, alpha_high = np.nan, np.nan, np.nan
+        rows.append((
+            name, n_words, x_min, n_tail, alpha, alpha_low, alpha_high,
+            -1 / (alpha - 1), -1 / (alpha_low - 1), -1 / (alpha_high - 1), distance, p_value, *sketch_betas,
+        ))
+    return np.array(rows, dtype=ZIPF_TABLE_DTYPE)
+
+
+def plot_word_frequency_rank_binned(freq_dist, title, n_bins=50, min_points_per_bin=2, fit_on="binned", fit=None, name=None):
     """
     Zipf style rank frequency plot with optional logarithmic binning.
     fit_on: "binned" or "raw"
+    fit: optional row of zipf_exponents(); its maximum-likelihood β and confidence interval
+    are shown under the least-squares β, and the power law is drawn over its tail.
     """
     frequencies = np.array(sorted(freq_dist.values(), reverse=True), dtype=float)
     ranks = np.arange(1, len(frequencies) + 1, dtype=float)
 
+    import matplotlib.pyplot as plt
     plt.rcParams["font.family"] = "Times New Roman"
 
     # Bin for visualisation (and optionally for fitting)
@@ -161,24 +381,70 @@ def plot_word_frequency_rank_binned(freq_dist, title, n_bins=50, min_points_per_
             horizontalalignment="right", verticalalignment="top"
         )
 
+    if fit is not None and fit["n_tail"] > 0:
+        # The word of frequency f in the tail has rank n_tail P(X >= f) = n_tail ζ(α, f) / ζ(α, x_min)
+        tail_freqs = np.unique(np.round(np.geomspace(fit["x_min"], frequencies[0], 100)))
+        tail_ranks = fit["n_tail"] * zeta(fit["alpha"], tail_freqs) / zeta(fit["alpha"], fit["x_min"])
+        plt.plot(tail_ranks, tail_freqs, linewidth=2, linestyle="--", label="MLE power law")
+        plt.text(
+            0.95, 0.85,
+            f"MLE β = {fit['beta']:.2f} [{fit['beta_low']:.2f}, {fit['beta_high']:.2f}]\n"
+            f"x_min = {fit['x_min']}, p = {fit['p_value']:.2f}",
+            transform=plt.gca().transAxes,
+            fontsize=12, family="Times New Roman",
+            bbox=dict(facecolor="white", edgecolor="black", boxstyle="round,pad=0.3"),
+            horizontalalignment="right", verticalalignment="top"
+        )
+
     plt.title(f"Word frequency rank distribution in {title}", fontsize=16, fontweight="bold")
     plt.xlabel("Rank", fontsize=14, fontweight="bold")
     plt.ylabel("Frequency", fontsize=14, fontweight="bold")
     plt.grid(True, which="both", linestyle="--", linewidth=0.5, alpha=0.6)
     plt.legend()
     plt.tight_layout()
-    plt.show()
+    finish_figure(name or f"zipf_binned_{title.lower()}")
 
     return beta
 
-def plot_freq_dist(inferno_clean, purgatorio_clean, paradiso_clean, binned = True):
-    freq_inferno, freq_purgatorio, freq_paradiso = freq_dist(inferno_clean, purgatorio_clean, paradiso_clean)
+def plot_freq_dist(inferno_clean, purgatorio_clean, paradiso_clean, binned = True, tokenizer=DEFAULT_TOKENIZER, **kwargs):
+    freq_inferno, freq_purgatorio, freq_paradiso = freq_dist(inferno_clean, purgatorio_clean, paradiso_clean, tokenizer)
+    return plot_freq_dists(freq_inferno, freq_purgatorio, freq_paradiso, binned=binned, **kwargs)
 
+def plot_freq_dist_from_corpus(corpus, binned = True, **kwargs):
+    freq_inferno, freq_purgatorio, freq_paradiso = freq_dist_from_corpus(corpus)
+    return plot_freq_dists(freq_inferno, freq_purgatorio, freq_paradiso, binned=binned, **kwargs)
+
+def plot_freq_dists(freq_inferno, freq_purgatorio, freq_paradiso, binned = True, plot=True, n_bootstrap=100, seed=42, workers=None, renderer=None, table=None):
+    """
+    Fit the three canticles with zipf_exponents() and, if plot, draw their Zipf plots (on
+    renderer if given, see src/rendering.py). Returns the ZIPF_TABLE_DTYPE table; plot=False
+    only computes it, and a table computed before is only plotted.
+    """
+    if table is None:
+        table = zipf_exponents({'Inferno': freq_inferno, 'Purgatorio': freq_purgatorio, 'Paradiso': freq_paradiso},
+                               n_bootstrap=n_bootstrap, seed=seed, workers=workers)
+    if not plot:
+        return table
     if binned == True:
-        plot_word_frequency_rank_binned(freq_inferno, "Inferno")
-        plot_word_frequency_rank_binned(freq_purgatorio, "Purgatorio")
-        plot_word_frequency_rank_binned(freq_paradiso, "Paradiso")
+        render(renderer, plot_word_frequency_rank_binned, freq_inferno, "Inferno", fit=table[0], name="zipf_binned_inferno")
+        render(renderer, plot_word_frequency_rank_binned, freq_purgatorio, "Purgatorio", fit=table[1], name="zipf_binned_purgatorio")
+        render(renderer, plot_word_frequency_rank_binned, freq_paradiso, "Paradiso", fit=table[2], name="zipf_binned_paradiso")
     else:
-        plot_word_frequency_rank(freq_inferno, 'Inferno')
-        plot_word_frequency_rank(freq_purgatorio, 'Purgatorio')
-        plot_word_frequency_rank(freq_paradiso, 'Paradiso')
\ No newline at end of file
+        render(renderer, plot_word_frequency_rank, freq_inferno, 'Inferno', name='zipf_inferno')
+        render(renderer, plot_word_frequency_rank, freq_purgatorio, 'Purgatorio', name='zipf_purgatorio')
+        render(renderer, plot_word_frequency_rank, freq_paradiso, 'Paradiso', name='zipf_paradiso')
+    return table
+
+
+def print_zipf_table(table):
+    """
+    Print a zipf_exponents() table, one line per corpus (with the sketch error range of β if any).
+    """
+    sketched = bool(np.isfinite(table['beta_sketch_low']).any())
+    print(f"{'Corpus':<12}{'Words':>8}{'x_min':>7}{'Tail':>7}{'β':>8}{'CI':>18}{'KS D':>8}{'p':>7}"
+          + (f"{'Sketch β':>18}" if sketched else ''))
+    for row in table:
+        ci = f"[{row['beta_low']:.3f}, {row['beta_high']:.3f}]"
+        sketch = f"[{row['beta_sketch_low']:.3f}, {row['beta_sketch_high']:.3f}]"
+        print(f"{row['corpus']:<12}{row['n_words']:>8}{row['x_min']:>7}{row['n_tail']:>7}"
+              f"{row['beta']:>8.3f}{ci:>18}{row['ks_distance']:>8.4f}{row['p_value']:>7.2f}" + (f"{sketch:>18}" if sketched else ''))
@@ -0,0 +1,220 @@
+import hashlib
+import json
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+import numpy as np
+
+from src.instrumentation import instrumented
+from src.preprocessing import stream_canti
+from src.tokenizer import DEFAULT_TOKENIZER, get_tokenizer
+
+'''
+Bounded-memory word frequencies. How we do this:
+1. The text is counted a chunk at a time (e.g. one canto). Each chunk is counted exactly and merged into two sketches, so memory never depends on the length of the text or the size of its vocabulary
+2. Top-k sketch (Misra-Gries, which keeps the same words as Space-Saving): at most top_k words with a counter each. When a merge leaves more than top_k words, the (top_k + 1)-th largest count is subtracted from every counter and the words left at zero are dropped. The total subtracted is kept, so each counter c is a lower bound and c + subtracted an upper bound of the word's true frequency, and every word more frequent than that total is guaranteed to be kept
+3. Count-Min sketch: depth rows of width counters; each word adds its count to one counter per row, chosen by a seeded hash of the word. The smallest of its counters is an upper bound of any word's frequency, within e * N / width of it with probability 1 - exp(-depth), including the tail words the top-k sketch does not keep
+4. Both sketches merge by adding counters (then re-pruning the top-k sketch), so chunks counted by parallel workers, or by different texts, combine into one sketch. They are keyed by the words themselves, not token IDs, so sketches of different corpora can be merged, and they are saved as .npz files
+5. The rank-frequency curve is made of the kept words whose upper bound is above the subtracted total. Every word that truly occurs more often than that is among them, so the curve is complete above the subtracted total; a listed word may itself occur less often, as only its upper bound is known to be above it. Its frequencies are the upper bounds, the smaller of the Count-Min estimate and the top-k counter plus the subtracted total: for the frequent words on the curve a Count-Min row without collisions is likely, so this is usually the exact count, closer than a point between the bounds. The lower bounds (the top-k counters) are kept next to them. With fewer distinct words than top_k nothing is ever subtracted and the curve is exact
+'''
+
+# Multipliers of the Count-Min hash are drawn from this (and the sketch seed), so sketches with the same seed hash alike
+_HASH_SEED = 0x5EED
+
+
+def word_keys(words):
+    """
+    Stable 64-bit key of each word (the same in every process and run).
+    """
+    return np.array([int.from_bytes(hashlib.blake2b(word.encode('utf-8'), digest_size=8).digest(), 'little') for word in words],
+                    dtype=np.uint64)
+
+
+class CountMinSketch:
+    """
+    Count-Min sketch of word counts: `depth` rows of `width` counters (width a power of two).
+    """
+
+    def __init__(self, width=1 << 16, depth=4, seed=0, table=None):
+        if width & (width - 1):
+            raise ValueError(f'width must be a power of two, not {width}')
+        self.width, self.depth, self.seed = width, depth, seed
+        self.table = np.zeros((depth, width), dtype=np.int64) if table is None else table
+        rng = np.random.default_rng([_HASH_SEED, seed])
+        # Multiply-shift hashing: odd multipliers, the top log2(width) bits of the product
+        self._multipliers = rng.integers(0, 1 << 63, size=depth, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self._shift = np.uint64(64 - (width.bit_length() - 1))
+
+    def _columns(self, keys):
+        return (self._multipliers[:, None] * keys[None, :]) >> self._shift
+
+    def add(self, keys, counts):
+        columns = self._columns(keys).astype(np.int64)
+        for row in range(self.depth):
+            np.add.at(self.table[row], columns[row], counts)
+
+    def estimate(self, keys):
+        columns = self._columns(keys).astype(np.int64)
+        return self.table[np.arange(self.depth)[:, None], columns].min(axis=0)
+
+    def merge(self, other):
+        if (self.width, self.depth, self.seed) != (other.width, other.depth, other.seed):
+            raise ValueError('Count-Min sketches must have the same width, depth and seed to be merged')
+        self.table += other.table
+        return self
+
+
+class FrequencySketch:
+    """
+    Approximate word frequencies in bounded memory: a top-k (Misra-Gries) sketch of the most
+    frequent words and a Count-Min sketch for point queries of any word (see above).
+
+    Feed it with update(words) or update_ids(token_ids, vocab), one chunk at a time, and combine
+    sketches with merge(). Like a Counter, values() and items() give the rank-frequency curve,
+    so it can be passed to zipf_exponents and the Zipf plots.
+    """
+
+    def __init__(self, top_k=2000, width=1 << 16, depth=4, seed=0):
+        self.top_k = top_k
+        self.words = np.empty(0, dtype=str)
+        self.counts = np.empty(0, dtype=np.int64)
+        self.subtracted = 0
+        self.n_tokens = 0
+        self.count_min = CountMinSketch(width, depth, seed)
+
+    def add_counts(self, words, counts):
+        """
+        Add exact counts of distinct words (e.g. of one chunk of text).
+        """
+        words = np.asarray(words, dtype=str)
+        counts = np.asarray(counts, dtype=np.int64)
+        if len(words) == 0:
+            return self
+        self.count_min.add(word_keys(words.tolist()), counts)
+        self.n_tokens += int(counts.sum())
+        self._merge_top(words, counts, 0)
+        return self
+
+    def update(self, words):
+        """
+        Add one chunk of tokens (words).
+        """
+        words, counts = np.unique(np.asarray(list(words), dtype=str), return_counts=True)
+        return self.add_counts(words, counts)
+
+    def update_ids(self, token_ids, vocab):
+        """
+        Add one chunk of token IDs of a corpus with the given vocabulary.
+        """
+        counts = np.bincount(np.asarray(token_ids), minlength=len(vocab))
+        present = np.flatnonzero(counts)
+        return self.add_counts(np.asarray(vocab)[present], counts[present])
+
+    def _merge_top(self, words, counts, subtracted):
+        words, inverse = np.unique(np.concatenate([self.words, words]), return_inverse=True)
+        counts = np.bincount(inverse.ravel(), weights=np.concatenate([self.counts, counts]), minlength=len(words)).astype(np.int64)
+        self.subtracted += subtracted
+        if len(words) > self.top_k:
+            cut = np.partition(counts, len(counts) - self.top_k - 1)[len(counts) - self.top_k - 1]
+            counts = counts - cut
+            keep = counts > 0
+            words, counts = words[keep], counts[keep]
+            self.subtracted += int(cut)
+        self.words, self.counts = words, counts
+
+    def merge(self, other):
+        """
+        Add another sketch (same top_k, width, depth and seed) into this one and return it.
+        """
+        if self.top_k != other.top_k:
+            raise ValueError('Frequency sketches must have the same top_k to be merged')
+        self.count_min.merge(other.count_min)
+        self.n_tokens += other.n_tokens
+        self._merge_top(other.words, other.counts, other.subtracted)
+        return self
+
+    def estimate(self, words):
+        """
+        Upper-bound estimate of the frequency of any words (0 for words never seen, up to hash collisions).
+        """
+        words = list(words)
+        estimate = self.count_min.estimate(word_keys(words)) if words else np.empty(0, dtype=np.int64)
+        position = {word: i for i, word in enumerate(self.words.tolist())}
+        for i, word in enumerate(words):
+            if word in position:
+                estimate[i] = min(estimate[i], self.counts[position[word]] + self.subtracted)
+        return estimate
+
+    def frequency_bounds(self):
+        """
+        (words, lower, upper) of the rank-frequency curve: the kept words whose upper bound is
+        above `subtracted`, most frequent first. Every word not listed occurs at most `subtracted`
+        times, so the curve is complete above that count (a listed word may also occur at most
+        that often).
+        """
+        upper = np.minimum(self.count_min.estimate(word_keys(self.words.tolist())), self.counts + self.subtracted) \
+            if len(self.words) else np.empty(0, dtype=np.int64)
+        keep = upper > self.subtracted
+        words, lower, upper = self.words[keep], self.counts[keep], upper[keep]
+        order = np.lexsort((words, -upper))
+        return words[order], lower[order], upper[order]
+
+    def values(self):
+        # The curve uses the upper bounds (see above)
+        return self.frequency_bounds()[2].tolist()
+
+    def keys(self):
+        return self.frequency_bounds()[0].tolist()
+
+    def items(self):
+        words, _, upper = self.frequency_bounds()
+        return list(zip(words.tolist(), upper.tolist()))
+
+    def __len__(self):
+        return len(self.frequency_bounds()[0])
+
+    def save(self, path):
+        np.savez(path, words=self.words, counts=self.counts, table=self.count_min.table,
+                 meta=json.dumps({'top_k': self.top_k, 'width': self.count_min.width, 'depth': self.count_min.depth,
+                                  'seed': self.count_min.seed, 'subtracted': self.subtracted, 'n_tokens': self.n_tokens}))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            meta = json.loads(str(data['meta']))
+            sketch = cls(meta['top_k'], meta['width'], meta['depth'], meta['seed'])
+            sketch.words, sketch.counts = data['words'], data['counts']
+            sketch.count_min.table = data['table']
+        sketch.subtracted, sketch.n_tokens = meta['subtracted'], meta['n_tokens']
+        return sketch
+
+
+def _sketch_text(task):
+    """
+    Worker for sketch_texts: the frequency sketch of one text, counted one canto at a time.
+    """
+    path, tokenizer, options = task
+    tokenize = get_tokenizer(tokenizer)
+    sketch = FrequencySketch(**options)
+    for _, _, canto in stream_canti(path):
+        sketch.update(tokenize(canto))
+    return sketch
+
+
+@instrumented
+def sketch_texts(paths, tokenizer=DEFAULT_TOKENIZER, workers=None, **options):
+    """
+    One frequency sketch of a collection of texts: each text is sketched on a process pool
+    (workers=1 runs in this process) and the sketches are merged in order. options are
+    FrequencySketch's (top_k, width, depth, seed).
+    """
+    tasks = [(path, tokenizer, options) for path in paths]
+    if workers == 1:
+        sketches = map(_sketch_text, tasks)
+    else:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            sketches = list(pool.map(_sketch_text, tasks))
+    merged = FrequencySketch(**options)
+    for sketch in sketches:
+        merged.merge(sketch)
+    return merged
@@ -0,0 +1,186 @@
+import atexit
+import cProfile
+import functools
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+'''
+Opt-in instrumentation. How we do this:
+1. Nothing is recorded unless instrumentation is enabled, either with the DIVINE_COMEDY_PROFILE environment variable (set to 1, or to the path of the JSON report) or with enable() (main.py --profile). When it is off, an instrumented function costs one flag check per call
+2. Hot functions are wrapped with @instrumented and pipeline stages run inside stage(name). Each call records its wall time, the CPU time of the calling thread and the peak memory allocated during the call (tracemalloc, above what was allocated when the call started). Calls of the same function or stage are added up (calls, wall and CPU seconds) and the largest peak is kept
+3. Nested calls are supported: when an inner call ends, its peak is passed on to the call that contains it, since tracemalloc has a single global peak
+4. Each stage can also be run under cProfile, its statistics written to <cprofile dir>/<stage>.prof (read them with python -m pstats or snakeviz)
+5. The report (stages, functions, total wall time) is written as JSON when the program exits, or with write_report()
+
+Work done on process pools (betweenness batches, entropy rows, bootstrap fits) is not recorded in the workers; it shows up as the wall time of the call that waits for it. With stages running in parallel threads the memory peaks overlap, so run the stages one at a time (main.py does when profiling) for clean per-stage peaks.
+'''
+
+PROFILE_ENV_VAR = 'DIVINE_COMEDY_PROFILE'
+CPROFILE_DIR_ENV_VAR = 'DIVINE_COMEDY_CPROFILE_DIR'
+DEFAULT_REPORT_PATH = 'profile_report.json'
+
+_state = {
+    'enabled': False,
+    'report_path': None,
+    'cprofile_dir': None,
+    'started': None,
+    'lock': threading.Lock(),
+    'stages': {},
+    'functions': {},
+}
+_local = threading.local()
+
+
+def enabled():
+    return _state['enabled']
+
+
+def enable(report_path=DEFAULT_REPORT_PATH, cprofile_dir=None):
+    """
+    Start recording. The report is written to report_path when the program exits (None: only
+    with write_report); cprofile_dir, if given, gets one cProfile dump per stage.
+    """
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    _state.update(enabled=True, report_path=report_path, cprofile_dir=cprofile_dir, started=time.perf_counter())
+
+
+def disable():
+    _state['enabled'] = False
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def reset():
+    with _state['lock']:
+        _state['stages'].clear()
+        _state['functions'].clear()
+    _state['started'] = time.perf_counter()
+
+
+def _record(table, name, wall, cpu, peak, **extra):
+    with _state['lock']:
+        entry = table.setdefault(name, {'calls': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'peak_memory_bytes': 0})
+        entry['calls'] += 1
+        entry['wall_seconds'] += wall
+        entry['cpu_seconds'] += cpu
+        entry['peak_memory_bytes'] = max(entry['peak_memory_bytes'], peak)
+        entry.update(extra)
+
+
+@contextmanager
+def _measure(table, name, profile=False, **extra):
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    current, peak = tracemalloc.get_traced_memory()
+    if stack:
+        # The enclosing call keeps the peak reached so far, since the peak is reset below
+        stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+    tracemalloc.reset_peak()
+    frame = {'start': current, 'peak': current}
+    stack.append(frame)
+    profiler = cProfile.Profile() if profile else None
+    wall, cpu = time.perf_counter(), time.thread_time()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield extra
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        wall, cpu = time.perf_counter() - wall, time.thread_time() - cpu
+        stack.pop()
+        peak = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+        if stack:
+            stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+        if profiler is not None:
+            os.makedirs(_state['cprofile_dir'], exist_ok=True)
+            extra['cprofile'] = os.path.join(_state['cprofile_dir'], f'{name}.prof')
+            profiler.dump_stats(extra['cprofile'])
+        _record(table, name, wall, cpu, peak - frame['start'], **extra)
+
+
+@contextmanager
+def stage(name):
+    """
+    Record a pipeline stage (and run it under cProfile if a cProfile directory is set). The
+    yielded dict is stored in the stage's report entry, e.g. to note whether it was cached.
+    """
+    if not _state['enabled']:
+        yield {}
+        return
+    with _measure(_state['stages'], name, profile=_state['cprofile_dir'] is not None) as extra:
+        yield extra
+
+
+def instrumented(func):
+    """
+    Decorator recording the calls of a hot function (module.qualname in the report).
+    """
+    name = f'{func.__module__}.{func.__qualname__}'
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _state['enabled']:
+            return func(*args, **kwargs)
+        with _measure(_state['functions'], name):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def report():
+    """
+    The recorded statistics as a dict (stages and functions sorted by wall time).
+    """
+    def by_wall_time(table):
+        return dict(sorted(table.items(), key=lambda item: item[1]['wall_seconds'], reverse=True))
+
+    with _state['lock']:
+        return {
+            'argv': sys.argv,
+            'pid': os.getpid(),
+            'wall_seconds': time.perf_counter() - _state['started'] if _state['started'] is not None else 0.0,
+            'peak_memory_bytes': tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else None,
+            'stages': by_wall_time(_state['stages']),
+            'functions': by_wall_time(_state['functions']),
+        }
+
+
+def write_report(path=None):
+    path = path or _state['report_path'] or DEFAULT_REPORT_PATH
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(report(), file, indent=2)
+    return path
+
+
+def print_report(data, top_n=15):
+    """
+    Print the stages and the top_n functions of a report by wall time.
+    """
+    for title, table in (('Stage', data['stages']), ('Function', data['functions'])):
+        print(f"\n{title:<56}{'Calls':>8}{'Wall s':>10}{'CPU s':>10}{'Peak MB':>10}")
+        for name, entry in list(table.items())[:top_n]:
+            print(f"{name[-56:]:<56}{entry['calls']:>8}{entry['wall_seconds']:>10.2f}"
+                  f"{entry['cpu_seconds']:>10.2f}{entry['peak_memory_bytes'] / 2 ** 20:>10.1f}")
+
+
+@atexit.register
+def _write_report_at_exit():
+    # Only the main process writes the report; pool workers inherit the setting but not the job
+    if _state['enabled'] and _state['report_path'] is not None and multiprocessing.parent_process() is None:
+        write_report()
+
+
+if os.environ.get(PROFILE_ENV_VAR, '') not in ('', '0'):
+    _value = os.environ[PROFILE_ENV_VAR]
+    enable(DEFAULT_REPORT_PATH if _value == '1' else _value, os.environ.get(CPROFILE_DIR_ENV_VAR))
@@ -0,0 +1,66 @@
+'''
+Language resources that used to come from nltk at import time. How we do this:
+1. NLTK_ITALIAN_STOPWORDS is a snapshot of nltk.corpus.stopwords.words('italian') (the Snowball list), kept in the source so building a network needs neither nltk nor its data
+2. ADDITIONAL_STOPWORDS is our custom list of words that are frequent in the poem but carry little meaning
+3. STOP_WORDS is the union of both, a frozenset built once when this module is first imported
+4. nltk itself is only imported when word_tokenize is first called, and its data is never downloaded: if it is missing we raise an error saying how to install it
+'''
+
+from functools import lru_cache
+
+NLTK_ITALIAN_STOPWORDS = frozenset((
+    'ad', 'al', 'allo', 'ai', 'agli', 'all', 'agl', 'alla', 'alle', 'con', 'col', 'coi', 'da',
+    'dal', 'dallo', 'dai', 'dagli', 'dall', 'dagl', 'dalla', 'dalle', 'di', 'del', 'dello', 'dei',
+    'degli', 'dell', 'degl', 'della', 'delle', 'in', 'nel', 'nello', 'nei', 'negli', 'nell',
+    'negl', 'nella', 'nelle', 'su', 'sul', 'sullo', 'sui', 'sugli', 'sull', 'sugl', 'sulla',
+    'sulle', 'per', 'tra', 'contro', 'io', 'tu', 'lui', 'lei', 'noi', 'voi', 'loro', 'mio', 'mia',
+    'miei', 'mie', 'tuo', 'tua', 'tuoi', 'tue', 'suo', 'sua', 'suoi', 'sue', 'nostro', 'nostra',
+    'nostri', 'nostre', 'vostro', 'vostra', 'vostri', 'vostre', 'mi', 'ti', 'ci', 'vi', 'lo', 'la',
+    'li', 'le', 'gli', 'ne', 'il', 'un', 'uno', 'una', 'ma', 'ed', 'se', 'perché', 'anche', 'come',
+    'dov', 'dove', 'che', 'chi', 'cui', 'non', 'più', 'quale', 'quanto', 'quanti', 'quanta',
+    'quante', 'quello', 'quelli', 'quella', 'quelle', 'questo', 'questi', 'questa', 'queste', 'si',
+    'tutto', 'tutti', 'a', 'c', 'e', 'i', 'l', 'o', 'ho', 'hai', 'ha', 'abbiamo', 'avete', 'hanno',
+    'abbia', 'abbiate', 'abbiano', 'avrò', 'avrai', 'avrà', 'avremo', 'avrete', 'avranno', 'avrei',
+    'avresti', 'avrebbe', 'avremmo', 'avreste', 'avrebbero', 'avevo', 'avevi', 'aveva', 'avevamo',
+    'avevate', 'avevano', 'ebbi', 'avesti', 'ebbe', 'avemmo', 'aveste', 'ebbero', 'avessi',
+    'avesse', 'avessimo', 'avessero', 'avendo', 'avuto', 'avuta', 'avuti', 'avute', 'sono', 'sei',
+    'è', 'siamo', 'siete', 'sia', 'siate', 'siano', 'sarò', 'sarai', 'sarà', 'saremo', 'sarete',
+    'saranno', 'sarei', 'saresti', 'sarebbe', 'saremmo', 'sareste', 'sarebbero', 'ero', 'eri',
+    'era', 'eravamo', 'eravate', 'erano', 'fui', 'fosti', 'fu', 'fummo', 'foste', 'furono',
+    'fossi', 'fosse', 'fossimo', 'fossero', 'essendo', 'faccio', 'fai', 'facciamo', 'fanno',
+    'faccia', 'facciate', 'facciano', 'farò', 'farai', 'farà', 'faremo', 'farete', 'faranno',
+    'farei', 'faresti', 'farebbe', 'faremmo', 'fareste', 'farebbero', 'facevo', 'facevi', 'faceva',
+    'facevamo', 'facevate', 'facevano', 'feci', 'facesti', 'fece', 'facemmo', 'faceste', 'fecero',
+    'facessi', 'facesse', 'facessimo', 'facessero', 'facendo', 'sto', 'stai', 'sta', 'stiamo',
+    'stanno', 'stia', 'stiate', 'stiano', 'starò', 'starai', 'starà', 'staremo', 'starete',
+    'staranno', 'starei', 'staresti', 'starebbe', 'staremmo', 'stareste', 'starebbero', 'stavo',
+    'stavi', 'stava', 'stavamo', 'stavate', 'stavano', 'stetti', 'stesti', 'stette', 'stemmo',
+    'steste', 'stettero', 'stessi', 'stesse', 'stessimo', 'stessero', 'stando',
+))
+
+ADDITIONAL_STOPWORDS = (
+    'altro','tanto','altri','e', 'ei','lor','giù','com','laltro','elli','te','tal','sù','or','ciò','chè', 'sé','pur','fa','cha','son','disse','vidi','ché','né','però','chio','ancor','qui','pero','qual', 'già', 'così', 'là', 'de', 'poi', 'quando', 'quel', 'sì', 'gia', 'me', 'ne', 'non', 'che', 'di', 'la', 'il', 'le', 'lo', 'gli', 'dei', 'delle', 'un', 'una', 'uno',
+)
+
+STOP_WORDS = NLTK_ITALIAN_STOPWORDS | frozenset(ADDITIONAL_STOPWORDS)
+
+
+@lru_cache(maxsize=None)
+def _nltk():
+    import nltk
+    return nltk
+
+
+def word_tokenize(text):
+    """
+    nltk.word_tokenize, imported on first use. Raises LookupError with instructions if the
+    tokenizer data is not installed (it is never downloaded automatically).
+    """
+    nltk = _nltk()
+    try:
+        return nltk.word_tokenize(text)
+    except LookupError as error:
+        raise LookupError(
+            "nltk's 'punkt' tokenizer data is not installed. Run `python -m nltk.downloader punkt punkt_tab` "
+            "once on a machine with network access (or copy an nltk_data folder and set NLTK_DATA)."
+        ) from error
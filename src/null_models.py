@@ -0,0 +1,190 @@
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+import numpy as np
+import scipy.sparse as sp
+
+from src.centrality_measures import eigenvector_centrality_sparse
+from src.create_networks import collapse_bigrams, directed_bigrams, stop_word_mask, symmetric_weight_matrix, window_pairs
+from src.instrumentation import instrumented
+
+'''Significance of the centralities against randomised (null) networks'''
+
+NULL_MODELS = ('shuffle', 'configuration')
+
+MEASURES = ('weighted_degree', 'degree', 'eigenvector')
+
+
+def _significance_dtype(word_width):
+    return np.dtype([('word', f'U{max(word_width, 1)}')] + [
+        (f'{measure}{suffix}', 'f8') for measure in MEASURES for suffix in ('', '_z', '_p')
+    ])
+
+
+def _measures(W, v0=None):
+    """
+    Weighted degree, number of neighbours (self excluded) and eigenvector centrality of a
+    symmetric CSR weight matrix, as a (3, n) array.
+    """
+    weighted_degree = np.asarray(W.sum(axis=1)).ravel()
+    degree = np.diff(W.indptr) - (W.diagonal() != 0)
+    eigenvector = eigenvector_centrality_sparse(W, v0=v0)
+    return np.stack([weighted_degree, degree, eigenvector])
+
+
+def bigram_network(tokens, n_nodes, window=1, distance_weighted=False):
+    """
+    Weight matrix of the network of node IDs 0..n_nodes-1, with the same rules as
+    build_window_network (build_sparse_network for window=1).
+    """
+    if window == 1:
+        return symmetric_weight_matrix(collapse_bigrams(directed_bigrams(tokens, n_nodes), n_nodes), n_nodes).astype(float)
+    keys, weights, _ = window_pairs(tokens, n_nodes, window, distance_weighted)
+    u, v = np.divmod(keys, n_nodes)
+    off_diagonal = u != v
+    rows = np.concatenate([u, v[off_diagonal]])
+    cols = np.concatenate([v, u[off_diagonal]])
+    return sp.csr_matrix((np.concatenate([weights, weights[off_diagonal]]), (rows, cols)), shape=(n_nodes, n_nodes))
+
+
+def shuffled_network(tokens, n_nodes, rng, window=1, distance_weighted=False):
+    """
+    Weight matrix of the network of a random permutation of the tokens.
+    """
+    return bigram_network(rng.permutation(tokens), n_nodes, window, distance_weighted)
+
+
+def configuration_network(strength, rng):
+    """
+    Weight matrix of a weighted configuration model: stubs for the given integer weighted
+    degrees, shuffled and paired, so every weighted degree is kept exactly.
+    """
+    n = len(strength)
+    stubs = rng.permutation(np.repeat(np.arange(n), strength))
+    if len(stubs) % 2:
+        stubs = stubs[:-1]
+    u, v = stubs[0::2], stubs[1::2]
+    W = sp.coo_matrix((np.ones(len(u)), (u, v)), shape=(n, n))
+    # Both directions of every pair, so a self-pair adds 2 to the diagonal and every row keeps its sum
+    return (W + W.T).tocsr()
+
+
+_null_graph = None
+
+def _set_null_graph(graph):
+    # Process pool initializer: each worker receives the real network once
+    global _null_graph
+    _null_graph = graph
+
+
+def _null_chunk(task, graph=None):
+    """
+    Sum, sum of squares and number of values reaching the real ones, for every measure and word,
+    over a chunk of null networks each drawn from its own seed sequence.
+    """
+    model, window, distance_weighted, seed_sequences = task
+    tokens, strength, observed = _null_graph if graph is None else graph
+    n = observed.shape[1]
+    total = np.zeros_like(observed)
+    squares = np.zeros_like(observed)
+    exceed = np.zeros_like(observed)
+    for seed_sequence in seed_sequences:
+        rng = np.random.default_rng(seed_sequence)
+        W = shuffled_network(tokens, n, rng, window, distance_weighted) if model == 'shuffle' else configuration_network(strength, rng)
+        values = _measures(W, v0=observed[2])
+        total += values
+        squares += values ** 2
+        # With a relative tolerance, so a value equal to the real one (e.g. a fixed degree) counts
+        exceed += values >= observed - 1e-9 * np.abs(observed)
+    return total, squares, exceed
+
+
+@instrumented
+def centrality_significance(token_ids, vocab, stop_mask=None, model='shuffle', n_samples=200, seed=None, workers=None, chunk_size=10,
+                            window=1, distance_weighted=False):
+    """
+    z-scores and empirical p-values of the weighted degree, number of neighbours and eigenvector
+    centrality of every word in the network of token_ids, against n_samples null networks:
+    'shuffle' rebuilds the network from shuffled tokens, 'configuration' keeps every weighted
+    degree (which then gets z = NaN and p = 1). stop_mask drops the stop-words first, and
+    window/distance_weighted select the co-occurrence network as in build_window_network.
+    The configuration model needs integer weights, so it is not available with distance_weighted.
+
+    Each sample draws from its own child of np.random.SeedSequence(seed) and the samples are
+    summed in fixed chunks of chunk_size, so the table is identical for any `workers`
+    (workers=1 runs in this process). Returns a structured array with one row per word, in
+    order of first appearance: the real value of each measure, its z-score (real - null mean) /
+    null std and its p-value (1 + #null >= real) / (1 + n_samples).
+    """
+    if model not in NULL_MODELS:
+        raise ValueError(f'model must be one of {NULL_MODELS}, not {model!r}')
+    if model == 'configuration' and distance_weighted and window > 1:
+        raise ValueError('the configuration model needs integer weights, so it cannot be used with distance_weighted')
+    vocab = np.asarray(vocab)
+    tokens = np.asarray(token_ids, dtype=np.int64)
+    if stop_mask is not None:
+        tokens = tokens[~stop_mask[tokens]]
+    if len(tokens) < 2:
+        return np.empty(0, dtype=_significance_dtype(1))
+
+    # Number the words 0..n-1 in order of first appearance, like the network's nodes
+    ids, first_seen, inverse = np.unique(tokens, return_index=True, return_inverse=True)
+    order = np.argsort(first_seen)
+    position = np.empty(len(ids), dtype=np.int64)
+    position[order] = np.arange(len(ids))
+    tokens, words = position[inverse.ravel()], vocab[ids[order]]
+    n = len(words)
+
+    observed = _measures(bigram_network(tokens, n, window, distance_weighted))
+    strength = np.rint(observed[0]).astype(np.int64)
+    seed_sequences = np.random.SeedSequence(seed).spawn(n_samples)
+    tasks = [(model, window, distance_weighted, seed_sequences[i:i + chunk_size]) for i in range(0, n_samples, chunk_size)]
+    graph = (tokens, strength, observed)
+
+    total = np.zeros_like(observed)
+    squares = np.zeros_like(observed)
+    exceed = np.zeros_like(observed)
+    pool = None if workers == 1 else ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'), initializer=_set_null_graph, initargs=(graph,))
+    try:
+        results = map(lambda task: _null_chunk(task, graph), tasks) if pool is None else pool.map(_null_chunk, tasks)
+        for chunk_total, chunk_squares, chunk_exceed in results:
+            total += chunk_total
+            squares += chunk_squares
+            exceed += chunk_exceed
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    mean = total / n_samples
+    variance = np.maximum(squares / n_samples - mean ** 2, 0) * n_samples / max(n_samples - 1, 1)
+    std = np.sqrt(variance)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = np.where(std > 0, (observed - mean) / std, np.nan)
+    p = (1 + exceed) / (1 + n_samples)
+
+    table = np.empty(n, dtype=_significance_dtype(max((len(word) for word in words.tolist()), default=1)))
+    table['word'] = words
+    for i, measure in enumerate(MEASURES):
+        table[measure] = observed[i]
+        table[f'{measure}_z'] = z[i]
+        table[f'{measure}_p'] = p[i]
+    return table
+
+
+def centrality_significance_from_corpus(corpus, canticle='inferno', **kwargs):
+    """
+    centrality_significance for the network of one canticle (or 'whole' for the whole poem),
+    with the stop-words dropped as in create_networks_from_corpus.
+    """
+    token_ids = corpus.token_ids if canticle == 'whole' else corpus.canticle(canticle)
+    return centrality_significance(token_ids, corpus.vocab, stop_mask=stop_word_mask(corpus.vocab), **kwargs)
+
+
+def print_significance_table(title, table, measure='eigenvector', top_n=10):
+    """
+    Print the top_n words by one measure with their z-scores and p-values.
+    """
+    label = measure.replace('_', ' ').title()
+    print(f'\nTop {top_n} Words by {label} Centrality, with z-score and p-value against the null model - {title}')
+    for row in np.sort(table, order=measure)[::-1][:top_n]:
+        print(f"{row['word']}: {row[measure]:.3f} (z = {row[f'{measure}_z']:.2f}, p = {row[f'{measure}_p']:.3f})")
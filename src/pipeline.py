@@ -0,0 +1,215 @@
+import functools
+import glob
+import hashlib
+import inspect
+import os
+import pickle
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from src import instrumentation
+
+'''
+Stage pipeline. How we do this:
+1. Each analysis step is declared as a stage: a function, the names of the stages whose results it takes as arguments, and its parameters (e.g. n, k, seed)
+2. Every stage gets a key: a hash of its name, the source of its function, the code version (the contents of every src/*.py and of the module defining the function), its parameters, the contents of any input files and the keys of the stages it depends on. A change anywhere upstream therefore changes the key of every stage below it, and editing the code invalidates every cached result, since stages are thin wrappers around functions in other modules
+3. A stage's result is pickled to the cache directory under its key. When the key is found there the result is loaded instead of recomputed
+4. Stages run on a thread pool as soon as the stages they depend on have finished, so independent stages (the three canticles' centralities, the frequency and entropy analyses) overlap. The heavy work inside the stages already runs in numpy or on process pools, so threads are enough and no result has to be copied between processes
+5. The wall time of every stage, and whether it was computed or loaded from the cache, is kept for a timing summary
+'''
+
+# Bump this when the pickled results change format so old caches are ignored
+PIPELINE_FORMAT_VERSION = 1
+
+DEFAULT_PIPELINE_CACHE_DIR = os.path.join('.cache', 'pipeline')
+
+
+class Stage:
+    """
+    One step of a Pipeline: func(*results of inputs, **params).
+    files are paths whose contents are part of the key; memoize=False never saves the result
+    (for stages that are cheap or cache on their own, such as load_corpus).
+    """
+
+    def __init__(self, name, func, inputs=(), params=None, files=(), memoize=True):
+        self.name = name
+        self.func = func
+        self.inputs = tuple(inputs)
+        self.params = dict(params or {})
+        self.files = tuple(files)
+        self.memoize = memoize
+
+
+def _file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+@functools.lru_cache(maxsize=None)
+def _code_version(module_path=None):
+    """
+    Hash of the contents of every src/*.py, plus the module at module_path (e.g. main.py) if it is outside src.
+    Computed once per process.
+    """
+    paths = sorted(glob.glob(os.path.join(SOURCE_DIR, '*.py')))
+    if module_path is not None and os.path.dirname(module_path) != SOURCE_DIR:
+        paths.append(module_path)
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(f'{os.path.basename(path)}\n{_file_digest(path)}\n'.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _module_path(func):
+    try:
+        return os.path.abspath(inspect.getsourcefile(func))
+    except (OSError, TypeError):
+        return None
+
+
+def _function_source(func):
+    try:
+        return inspect.getsource(func)
+    except (OSError, TypeError):
+        return f'{func.__module__}.{func.__qualname__}'
+
+
+class Pipeline:
+    """
+    A DAG of stages with on-disk memoization. Add stages with add(), then run() returns
+    {stage name: result}. cache_dir=None disables the cache; workers=1 runs the stages one at
+    a time in this thread.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_PIPELINE_CACHE_DIR, workers=None):
+        self.cache_dir = cache_dir
+        self.workers = workers
+        self.stages = {}
+        self.timings = []
+        self.seconds = 0.0
+
+    def add(self, name, func, inputs=(), params=None, files=(), memoize=True):
+        if name in self.stages:
+            raise ValueError(f'stage {name!r} is already defined')
+        for dependency in inputs:
+            if dependency not in self.stages:
+                raise ValueError(f'stage {name!r} depends on {dependency!r}, which has not been added')
+        self.stages[name] = Stage(name, func, inputs, params, files, memoize)
+        return self.stages[name]
+
+    def _dependencies(self, targets):
+        # The targets and every stage they depend on, in the order they were added (a topological order)
+        needed, todo = set(), list(targets)
+        while todo:
+            name = todo.pop()
+            if name not in self.stages:
+                raise KeyError(f'unknown stage {name!r}')
+            if name not in needed:
+                needed.add(name)
+                todo.extend(self.stages[name].inputs)
+        return [name for name in self.stages if name in needed]
+
+    def keys(self, targets=None):
+        """
+        Cache key of every stage needed for targets (default: all stages).
+        """
+        keys = {}
+        for name in self._dependencies(self.stages if targets is None else targets):
+            stage = self.stages[name]
+            digest = hashlib.sha256(f'pipeline-v{PIPELINE_FORMAT_VERSION}\n{name}\n'.encode('utf-8'))
+            digest.update(_function_source(stage.func).encode('utf-8'))
+            digest.update(_code_version(_module_path(stage.func)).encode('utf-8'))
+            digest.update(repr(sorted(stage.params.items())).encode('utf-8'))
+            for path in stage.files:
+                digest.update(_file_digest(path).encode('utf-8'))
+            for dependency in stage.inputs:
+                digest.update(keys[dependency].encode('utf-8'))
+            keys[name] = digest.hexdigest()
+        return keys
+
+    def _cache_path(self, name, key):
+        return os.path.join(self.cache_dir, f'{name}-{key[:32]}.pkl')
+
+    def _run_stage(self, stage, key, inputs):
+        start = time.perf_counter()
+        path = self._cache_path(stage.name, key) if self.cache_dir is not None and stage.memoize else None
+        # Recorded by src/instrumentation.py when profiling is enabled
+        with instrumentation.stage(stage.name) as record:
+            if path is not None and os.path.exists(path):
+                with open(path, 'rb') as file:
+                    result = pickle.load(file)
+                status = 'cached'
+            else:
+                result = stage.func(*inputs, **stage.params)
+                status = 'computed'
+                if path is not None:
+                    os.makedirs(self.cache_dir, exist_ok=True)
+                    # Written to a temporary file first so a half-written result is never picked up
+                    with open(path + '.tmp', 'wb') as file:
+                        pickle.dump(result, file, protocol=pickle.HIGHEST_PROTOCOL)
+                    os.replace(path + '.tmp', path)
+            record['status'] = status
+        return result, {'stage': stage.name, 'status': status, 'seconds': time.perf_counter() - start, 'key': key}
+
+    def run(self, targets=None):
+        """
+        Run the stages needed for targets (default: all) and return {stage name: result}.
+        """
+        start = time.perf_counter()
+        keys = self.keys(targets)
+        waiting = {name: set(self.stages[name].inputs) for name in keys}
+        results = {}
+        self.timings = []
+
+        def ready():
+            names = [name for name, dependencies in waiting.items() if not dependencies]
+            for name in names:
+                del waiting[name]
+            return names
+
+        def finish(name, result, timing):
+            results[name] = result
+            self.timings.append(timing)
+            for dependencies in waiting.values():
+                dependencies.discard(name)
+
+        if self.workers == 1:
+            while waiting:
+                for name in ready():
+                    stage = self.stages[name]
+                    finish(name, *self._run_stage(stage, keys[name], [results[dependency] for dependency in stage.inputs]))
+        else:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                running = {}
+                try:
+                    while waiting or running:
+                        for name in ready():
+                            stage = self.stages[name]
+                            inputs = [results[dependency] for dependency in stage.inputs]
+                            running[pool.submit(self._run_stage, stage, keys[name], inputs)] = name
+                        done, _ = wait(running, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            finish(running.pop(future), *future.result())
+                except BaseException:
+                    pool.shutdown(cancel_futures=True)
+                    raise
+        self.seconds = time.perf_counter() - start
+        return results
+
+
+def print_timings(timings, seconds=None):
+    """
+    Print the per-stage timing summary of Pipeline.run (and its wall time, if given).
+    """
+    print(f"\n{'Stage':<24}{'Status':>10}{'Seconds':>10}")
+    for timing in timings:
+        print(f"{timing['stage']:<24}{timing['status']:>10}{timing['seconds']:>10.2f}")
+    print(f"{'Sum of stages':<24}{'':>10}{sum(timing['seconds'] for timing in timings):>10.2f}")
+    if seconds is not None:
+        print(f"{'Wall time':<24}{'':>10}{seconds:>10.2f}")
@@ -1,6 +1,20 @@
+import os
 import re
 
-def preprocessing():
+from src.instrumentation import instrumented
+
+# Canticle names in order, as used by the corpus and analysis modules
+CANTICLES = ('inferno', 'purgatorio', 'paradiso')
+
+# Cleaning steps, compiled once and shared by preprocessing() and the streaming preprocessor
+CANTO_HEADING_PATTERN = re.compile(r'\bCanto\s+[IVXLCDM]+\b', flags=re.IGNORECASE)
+BLANK_LINES_PATTERN = re.compile(r'\s*\n\s*\n\s*')
+CANTICLE_NAMES_PATTERN = re.compile(r'INFERNO|PURGATORIO|PARADISO', flags=re.IGNORECASE)
+PUNCTUATION_PATTERN = re.compile(r'[^\w\s]')
+DIGITS_PATTERN = re.compile(r'\d+')
+
+@instrumented
+def preprocessing(path='divine_comedy.txt'):
     '''
         We do the following:
 
@@ -10,7 +24,7 @@ def preprocessing():
         4. convert to lower case
     '''
     # Load the text
-    with open('divine_comedy.txt', 'r', encoding='utf-8') as file:
+    with open(path, 'r', encoding='utf-8') as file:
         text = file.read()
 
     # Define patterns to identify canticles
@@ -29,15 +43,15 @@ def preprocessing():
     # Function to clean and format the canticle text
     def preprocess_canticle(canticle_text):
         # Remove Roman numeral canto headings
-        canticle_text = re.sub(r'\bCanto\s+[IVXLCDM]+\b', '', canticle_text, flags=re.IGNORECASE)
+        canticle_text = CANTO_HEADING_PATTERN.sub('', canticle_text)
         # Replace multiple spaces or newlines with a standard three-line break between canti
-        canticle_text = re.sub(r'\s*\n\s*\n\s*', '\n\n\n', canticle_text)
+        canticle_text = BLANK_LINES_PATTERN.sub('\n\n\n', canticle_text)
         # Remove any leftover headers or irrelevant text
-        canticle_text = re.sub(r'INFERNO|PURGATORIO|PARADISO', '', canticle_text, flags=re.IGNORECASE)
+        canticle_text = CANTICLE_NAMES_PATTERN.sub('', canticle_text)
         # Strip extra whitespace at the start or end of the text
         # Remove punctuation and numbers
-        canticle_text = re.sub(r'[^\w\s]', '', canticle_text)
-        canticle_text = re.sub(r'\d+', '', canticle_text)
+        canticle_text = PUNCTUATION_PATTERN.sub('', canticle_text)
+        canticle_text = DIGITS_PATTERN.sub('', canticle_text)
         # Convert to lowercase
         canticle_text = canticle_text.lower()
         return canticle_text.strip()
@@ -48,4 +62,123 @@ def preprocessing():
 
     whole_clean = inferno_clean + ' ' + purgatorio_clean + ' ' + paradiso_clean
 
-    return inferno_clean, purgatorio_clean, paradiso_clean, whole_clean
\ No newline at end of file
+    return inferno_clean, purgatorio_clean, paradiso_clean, whole_clean
+
+
+'''
+Streaming preprocessor. Produces the same canti as preprocessing() followed by split_canticle_into_canti, but reads the input line by line and never holds more than one canto in memory. How we do this:
+1. Read the lines of one or more files in order (so a multi-volume corpus can be passed as a list of paths)
+2. Skip everything before the first canticle marker (the canticle name in capitals, e.g. INFERNO). A marker ends the current canticle and starts the next one; an optional end marker (e.g. the Project Gutenberg footer) ends the last one
+3. Group the lines of a canticle into chunks of whole paragraphs (about 64 KB each, cut at blank lines). Each chunk gets the same cleaning steps as preprocess_canticle above: remove the canto headings, collapse blank lines, remove the canticle names, punctuation and numbers, convert to lower case
+4. Append each cleaned chunk to a buffer holding the current canto, separated by the same three-line break. As soon as the buffer contains the canto separator of split_canticle_into_canti, the text before it is yielded as a finished canto and dropped from the buffer
+'''
+
+# End of the poem in Project Gutenberg files
+GUTENBERG_END_MARKER = re.compile(r'\*\*\* ?END OF (THE|THIS) PROJECT GUTENBERG')
+
+# What split_canticle_into_canti splits on: a canto heading such as 'Inferno • Canto I' is left as a single space between blank lines
+CANTO_SEPARATOR = '\n\n\n \n\n\n'
+
+CANTO_WORD_AT_END_PATTERN = re.compile(r'\bCanto\s*$', flags=re.IGNORECASE)
+
+
+def read_lines(paths):
+    """
+    Lines (without the newline) of one file or of several files in order.
+    """
+    if isinstance(paths, (str, os.PathLike)):
+        paths = [paths]
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as file:
+            for line in file:
+                yield line.rstrip('\n')
+
+
+def _canticle_lines(lines, marker_canticles, end_marker):
+    # (canticle, line) pairs; a marker line is cut at the marker, the part before it closing the current canticle
+    markers_pattern = re.compile('|'.join(re.escape(marker) for marker in marker_canticles))
+    canticle = None
+    for line in lines:
+        if end_marker is not None and end_marker.search(line):
+            return
+        match = markers_pattern.search(line)
+        while match is not None:
+            if canticle is not None:
+                yield canticle, line[:match.start()]
+            canticle, line = marker_canticles[match.group()], line[match.end():]
+            match = markers_pattern.search(line)
+        if canticle is not None:
+            yield canticle, line
+
+
+def _canticle_chunks(lines, marker_canticles, end_marker, chunk_size):
+    # (canticle, chunk) pairs, a chunk being about chunk_size characters of whole paragraphs (runs of
+    # non-blank lines) with the blank lines between them. A chunk is only cut at a blank line that does
+    # not follow the word 'Canto', since the heading pattern may match across blank lines
+    canticle, chunk, size = None, [], 0
+    for line_canticle, line in _canticle_lines(lines, marker_canticles, end_marker):
+        if chunk and line_canticle != canticle:
+            yield canticle, '\n'.join(chunk)
+            chunk, size = [], 0
+        canticle = line_canticle
+        if chunk and not line.strip() and size >= chunk_size and chunk[-1].strip() and not CANTO_WORD_AT_END_PATTERN.search(chunk[-1]):
+            yield canticle, '\n'.join(chunk)
+            chunk, size = [], 0
+        if chunk or line.strip():
+            chunk.append(line)
+            size += len(line) + 1
+    if chunk:
+        yield canticle, '\n'.join(chunk)
+
+
+def _clean_chunk(chunk, names_pattern):
+    # Same steps (and order) as preprocess_canticle; None if nothing but whitespace is left after removing the headings
+    chunk = CANTO_HEADING_PATTERN.sub('', chunk)
+    chunk = BLANK_LINES_PATTERN.sub('\n\n\n', chunk).strip()
+    if not chunk:
+        return None
+    chunk = names_pattern.sub('', chunk)
+    chunk = PUNCTUATION_PATTERN.sub('', chunk)
+    chunk = DIGITS_PATTERN.sub('', chunk)
+    return chunk.lower()
+
+
+def stream_canti(paths='divine_comedy.txt', canticles=CANTICLES, markers=None, end_marker=GUTENBERG_END_MARKER, chunk_size=1 << 16):
+    """
+    Yield (canticle, canto_number, canto_text) for every canto, reading the input lazily.
+
+    paths is a file or a list of files read in order. markers are the strings that start each
+    canticle (default: the canticle names in capitals). The text is cleaned about chunk_size
+    characters at a time. For the default arguments the canti are identical to
+    split_canticle_into_canti applied to each canticle returned by preprocessing().
+    """
+    if markers is None:
+        markers = [name.upper() for name in canticles]
+    names_pattern = re.compile('|'.join(re.escape(marker) for marker in markers), flags=re.IGNORECASE)
+
+    # buffer holds the cleaned text of the current canticle since the last canto separator
+    canticle, number, buffer = None, 0, None
+    for chunk_canticle, chunk in _canticle_chunks(read_lines(paths), dict(zip(markers, canticles)), end_marker, chunk_size):
+        if chunk_canticle != canticle:
+            if buffer is not None and buffer.strip():
+                yield canticle, number + 1, buffer.strip()
+            canticle, number, buffer = chunk_canticle, 0, None
+        cleaned = _clean_chunk(chunk, names_pattern)
+        if cleaned is None:
+            continue
+        if buffer is None:
+            buffer, start = cleaned, 0
+        else:
+            # Only a separator that overlaps the new text can be new
+            start = max(0, len(buffer) - len(CANTO_SEPARATOR) + 1)
+            buffer = buffer + '\n\n\n' + cleaned
+        position = buffer.find(CANTO_SEPARATOR, start)
+        while position >= 0:
+            text = buffer[:position].strip()
+            if text:
+                number += 1
+                yield canticle, number, text
+            buffer = buffer[position + len(CANTO_SEPARATOR):]
+            position = buffer.find(CANTO_SEPARATOR)
+    if buffer is not None and buffer.strip():
+        yield canticle, number + 1, buffer.strip()
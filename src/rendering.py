@@ -0,0 +1,138 @@
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+
+# matplotlib is only imported when a figure is drawn or saved
+
+'''
+Headless rendering. How we do this:
+1. Every plotting function ends with finish_figure(name) instead of plt.show(). By default this still calls plt.show(); once configure_headless() has been called it switches matplotlib to the non-interactive Agg backend, saves each figure as <output dir>/<name>.<format> (PNG, SVG, ...) and closes it
+2. The analyses compute their results (tables, subgraphs, layouts) and hand them to a FigureRenderer together with the plotting function. The renderer pickles each job (function and results) to <output dir>/results/<name>.pkl and draws it on a process pool, so the computation carries on while the figures are rendered
+3. render_saved() redraws the saved jobs, so figures can be restyled or exported in another format without rerunning the analyses
+'''
+
+DEFAULT_OUTPUT_DIR = 'figures'
+
+# Set by configure_headless(); output_dir None means figures are shown interactively
+_headless = {'output_dir': None, 'formats': ('png',)}
+
+
+def configure_headless(output_dir=DEFAULT_OUTPUT_DIR, formats=('png',)):
+    """
+    Save figures to output_dir in the given formats instead of showing them.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    os.makedirs(output_dir, exist_ok=True)
+    _headless['output_dir'] = output_dir
+    _headless['formats'] = tuple(formats)
+
+
+def figure_paths(name, output_dir, formats):
+    return [os.path.join(output_dir, f'{name}.{fmt}') for fmt in formats]
+
+
+def finish_figure(name):
+    """
+    Show the current figure, or in headless mode save it under `name` and close it.
+    Returns the paths of the saved files (empty when the figure is shown).
+    """
+    import matplotlib.pyplot as plt
+    if _headless['output_dir'] is None:
+        plt.show()
+        return []
+    figure = plt.gcf()
+    paths = figure_paths(name, _headless['output_dir'], _headless['formats'])
+    for path in paths:
+        figure.savefig(path, dpi=150, bbox_inches='tight')
+    plt.close(figure)
+    return paths
+
+
+def _render_job(job):
+    """
+    Worker for FigureRenderer: draw one figure and return the paths it was saved to.
+    """
+    func, args, kwargs = job
+    func(*args, **kwargs)
+    return figure_paths(kwargs['name'], _headless['output_dir'], _headless['formats'])
+
+
+class FigureRenderer:
+    """
+    Renders figures in the background and saves them to output_dir.
+
+    submit(plot_function, *results, name=...) queues one figure; close() (or leaving a with
+    block) waits for all of them and returns the saved paths. workers=1 draws each figure in
+    this process as soon as it is submitted. With save_results, the results behind every
+    figure are pickled to output_dir/results so render_saved() can redraw them later.
+    """
+
+    def __init__(self, output_dir=DEFAULT_OUTPUT_DIR, formats=('png',), workers=None, save_results=True):
+        self.output_dir = output_dir
+        self.formats = tuple(formats)
+        self.save_results = save_results
+        self.paths = []
+        self._futures = []
+        os.makedirs(output_dir, exist_ok=True)
+        if workers == 1:
+            configure_headless(output_dir, self.formats)
+            self._pool = None
+        else:
+            self._pool = ProcessPoolExecutor(max_workers=workers, initializer=configure_headless,
+                                             initargs=(output_dir, self.formats))
+
+    def submit(self, func, *args, name, **kwargs):
+        job = (func, args, dict(kwargs, name=name))
+        if self.save_results:
+            results_dir = os.path.join(self.output_dir, 'results')
+            os.makedirs(results_dir, exist_ok=True)
+            with open(os.path.join(results_dir, f'{name}.pkl'), 'wb') as file:
+                pickle.dump(job, file, protocol=pickle.HIGHEST_PROTOCOL)
+        if self._pool is None:
+            self.paths.extend(_render_job(job))
+        else:
+            self._futures.append(self._pool.submit(_render_job, job))
+
+    def close(self):
+        if self._pool is not None:
+            try:
+                for future in self._futures:
+                    self.paths.extend(future.result())
+            finally:
+                self._pool.shutdown(cancel_futures=True)
+                self._pool, self._futures = None, []
+        return self.paths
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def render(renderer, func, *args, name, **kwargs):
+    """
+    Draw a figure with func(*args, name=name, **kwargs): shown right away when renderer is
+    None, otherwise queued on the renderer.
+    """
+    if renderer is None:
+        return func(*args, name=name, **kwargs)
+    renderer.submit(func, *args, name=name, **kwargs)
+
+
+def render_saved(output_dir=DEFAULT_OUTPUT_DIR, formats=('png',), workers=None, names=None):
+    """
+    Redraw the figures whose results were saved by a FigureRenderer in output_dir (all of
+    them, or only those in names) without recomputing anything. Returns the saved paths.
+    """
+    results_dir = os.path.join(output_dir, 'results')
+    with FigureRenderer(output_dir, formats, workers=workers, save_results=False) as renderer:
+        for filename in sorted(os.listdir(results_dir)):
+            name, extension = os.path.splitext(filename)
+            if extension != '.pkl' or (names is not None and name not in names):
+                continue
+            with open(os.path.join(results_dir, filename), 'rb') as file:
+                func, args, kwargs = pickle.load(file)
+            renderer.submit(func, *args, **kwargs)
+    return renderer.paths
@@ -0,0 +1,192 @@
+import numpy as np
+import scipy.sparse as sp
+
+from src.centrality_measures import eigenvector_centrality_sparse
+from src.create_networks import BIGRAM_DTYPE, directed_bigrams, stop_word_mask
+from src.instrumentation import instrumented
+from src.preprocessing import CANTICLES
+from src.rendering import finish_figure
+
+'''Temporal word network: the network of the poem so far, after every canto'''
+
+
+def temporal_dtype(top_n=10):
+    return np.dtype([
+        ('canticle', 'U10'),
+        ('canto', 'i4'),
+        ('n_tokens', 'i8'),
+        ('n_nodes', 'i8'),
+        ('n_edges', 'i8'),
+        ('mean_degree', 'f8'),
+        ('mean_weighted_degree', 'f8'),
+        ('top_weighted_degree', 'i4', (top_n,)),
+        ('top_weighted_degree_value', 'f8', (top_n,)),
+        ('top_eigenvector', 'i4', (top_n,)),
+        ('top_eigenvector_value', 'f8', (top_n,)),
+    ])
+
+
+class TemporalNetwork:
+    """
+    Word-adjacency network of a token stream fed one canto at a time. After add(token_ids),
+    `weights` is the symmetric CSR matrix (indexed by token ID) of everything fed so far, equal
+    to build_sparse_network(...).weights of the concatenated stream.
+    """
+
+    def __init__(self, vocab, stop_mask=None):
+        self.vocab = np.asarray(vocab)
+        self.stop_mask = stop_mask
+        n_vocab = len(self.vocab)
+        self.bigrams = np.empty(0, dtype=BIGRAM_DTYPE)
+        self.keys = np.empty(0, dtype=np.int64)
+        self.weights = sp.csr_matrix((n_vocab, n_vocab))
+        self.seen = np.zeros(n_vocab, dtype=bool)
+        self.n_tokens = 0
+        self.last_token = -1
+        self.eigenvector = None
+
+    def _lookup(self, src, dst):
+        # Count and first occurrence of the directed bigrams src -> dst in the running table (0 and -1 if absent)
+        keys = src * len(self.vocab) + dst
+        if len(self.keys) == 0:
+            return np.zeros(len(keys), dtype=np.int64), np.full(len(keys), -1, dtype=np.int64)
+        index = np.searchsorted(self.keys, keys).clip(max=len(self.keys) - 1)
+        found = self.keys[index] == keys
+        return np.where(found, self.bigrams['count'][index], 0), np.where(found, self.bigrams['first'][index], -1)
+
+    def _edge_weights(self, u, v):
+        # Undirected edge weights as collapse_bigrams gives them: the count of the direction that first occurs later
+        forward_count, forward_first = self._lookup(u, v)
+        backward_count, backward_first = self._lookup(v, u)
+        return np.where((u == v) | (forward_first > backward_first), forward_count, backward_count)
+
+    def add(self, token_ids):
+        """
+        Merge one canto's bigrams into the running table and add the change of every edge it
+        touches to `weights`; the earlier canti are never recounted.
+        """
+        tokens = np.asarray(token_ids, dtype=np.int64)
+        if self.stop_mask is not None:
+            tokens = tokens[~self.stop_mask[tokens]]
+        if len(tokens) == 0:
+            return self
+        n_vocab = len(self.vocab)
+        stream = tokens if self.last_token < 0 else np.r_[self.last_token, tokens]
+        delta = directed_bigrams(stream, n_vocab)
+        # Positions in the whole stream (the bridge bigram starts at the previous canto's last token)
+        delta['first'] += self.n_tokens - (len(stream) - len(tokens))
+
+        # Undirected edges touched by the canto
+        u = np.minimum(delta['src'], delta['dst']).astype(np.int64)
+        v = np.maximum(delta['src'], delta['dst']).astype(np.int64)
+        u, v = np.divmod(np.unique(u * n_vocab + v), n_vocab)
+        before = self._edge_weights(u, v)
+        # delta is sorted by key, so the new bigrams can be inserted in order
+        delta_keys = delta['src'].astype(np.int64) * n_vocab + delta['dst']
+        index = np.searchsorted(self.keys, delta_keys)
+        found = np.zeros(len(delta), dtype=bool)
+        inside = index < len(self.keys)
+        found[inside] = self.keys[index[inside]] == delta_keys[inside]
+        self.bigrams['count'][index[found]] += delta['count'][found]
+        self.bigrams = np.insert(self.bigrams, index[~found], delta[~found])
+        self.keys = np.insert(self.keys, index[~found], delta_keys[~found])
+        change = (self._edge_weights(u, v) - before).astype(float)
+
+        off_diagonal = u != v
+        rows = np.concatenate([u, v[off_diagonal]])
+        cols = np.concatenate([v, u[off_diagonal]])
+        data = np.concatenate([change, change[off_diagonal]])
+        self.weights = (self.weights + sp.csr_matrix((data, (rows, cols)), shape=(n_vocab, n_vocab))).tocsr()
+
+        self.seen[tokens] = True
+        self.n_tokens += len(tokens)
+        self.last_token = int(tokens[-1])
+        return self
+
+    def centralities(self, tol=1e-8):
+        """
+        Weighted degree and eigenvector centrality of every token ID (0 for words not in the
+        network yet); the eigenvector's power iteration starts from the previous call's.
+        """
+        weighted_degree = np.asarray(self.weights.sum(axis=1)).ravel()
+        self.eigenvector = eigenvector_centrality_sparse(self.weights, v0=self.eigenvector, tol=tol, method='power')
+        return weighted_degree, self.eigenvector
+
+
+def _top(values, top_n):
+    # Indices and values of the top_n largest entries, largest first (padded with -1 / NaN)
+    top = np.argpartition(-values, top_n)[:top_n] if len(values) > top_n else np.arange(len(values))
+    top = top[np.lexsort((top, -values[top]))]
+    ids = np.full(top_n, -1, dtype=np.int32)
+    ids[:len(top)] = top
+    padded = np.full(top_n, np.nan)
+    padded[:len(top)] = values[top]
+    return ids, padded
+
+
+@instrumented
+def temporal_snapshots(corpus, top_n=10, stop_mask=None, tol=1e-8):
+    """
+    One snapshot of the network of the poem so far after every canto, as a structured array
+    with temporal_dtype(top_n); the top words are token IDs (corpus.words(...) maps them back).
+    """
+    if stop_mask is None:
+        stop_mask = stop_word_mask(corpus.vocab)
+    network = TemporalNetwork(corpus.vocab, stop_mask)
+    rows = []
+    for canticle in CANTICLES:
+        for canto, token_ids in enumerate(corpus.canti(canticle), start=1):
+            network.add(token_ids)
+            weighted_degree, eigenvector = network.centralities(tol=tol)
+            W = network.weights
+            n_nodes = int(network.seen.sum()) if network.n_tokens >= 2 else 0
+            degree = np.diff(W.indptr) - (W.diagonal() != 0)
+            n_edges = (W.nnz + np.count_nonzero(W.diagonal())) // 2
+            rows.append((
+                canticle, canto, network.n_tokens, n_nodes, n_edges,
+                degree.sum() / max(n_nodes, 1), weighted_degree.sum() / max(n_nodes, 1),
+                *_top(weighted_degree, top_n), *_top(eigenvector, top_n),
+            ))
+    return np.array(rows, dtype=temporal_dtype(top_n))
+
+
+def print_temporal_snapshots(table, vocab, step=1, top_n=5):
+    """
+    Print every step-th snapshot (and the last one): size of the network and its top words by
+    eigenvector centrality.
+    """
+    vocab = np.asarray(vocab)
+    print(f"\n{'Canticle':<12}{'Canto':>6}{'Tokens':>8}{'Nodes':>7}{'Edges':>8}{'Degree':>8}  Top words by eigenvector centrality")
+    for i, row in enumerate(table):
+        if i % step and i != len(table) - 1:
+            continue
+        ids = row['top_eigenvector'][:top_n]
+        words = ', '.join(vocab[ids[ids >= 0]].tolist())
+        print(f"{row['canticle']:<12}{row['canto']:>6}{row['n_tokens']:>8}{row['n_nodes']:>7}{row['n_edges']:>8}"
+              f"{row['mean_degree']:>8.2f}  {words}")
+
+
+def plot_temporal_snapshots(table, name='temporal_network'):
+    """
+    Plots the number of nodes and edges of the growing network and its mean degree against
+    the canto index, with dashed lines at the canticle boundaries.
+    """
+    import matplotlib.pyplot as plt
+    # Set font style to Times New Roman
+    plt.rcParams["font.family"] = "Times New Roman"
+    fig, size_axis = plt.subplots(figsize=(10, 6))
+    step = np.arange(1, len(table) + 1)
+    size_axis.plot(step, table['n_nodes'], label='Nodes')
+    size_axis.plot(step, table['n_edges'], label='Edges')
+    size_axis.set_xlabel('Canto (from the start of the poem)', fontsize=12)
+    size_axis.set_ylabel('Size of the network', fontsize=12)
+    degree_axis = size_axis.twinx()
+    degree_axis.plot(step, table['mean_degree'], color='black', linestyle=':', label='Mean degree')
+    degree_axis.set_ylabel('Mean degree', fontsize=12)
+    for boundary in np.flatnonzero(table['canticle'][1:] != table['canticle'][:-1]):
+        size_axis.axvline(boundary + 1.5, color='grey', linestyle='--', linewidth=0.8)
+    lines = size_axis.get_legend_handles_labels()
+    degree_lines = degree_axis.get_legend_handles_labels()
+    size_axis.legend(lines[0] + degree_lines[0], lines[1] + degree_lines[1], loc='upper left')
+    size_axis.grid(True)
+    finish_figure(name)
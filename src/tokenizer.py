@@ -0,0 +1,126 @@
+import re
+from collections import Counter
+
+from src.nltk_resources import word_tokenize
+
+'''
+Tokenizer layer shared by the network, frequency and entropy analyses. How we do this:
+1. A tokenizer is a function from a string to a list of words, registered under a name
+2. 'split' (str.split) is the default. preprocessing() has already removed punctuation and digits, so splitting on whitespace is all that is left to do, and it is the fastest option
+3. 'regex' finds runs of word characters with a compiled pattern, which also drops any punctuation left in text that did not go through preprocessing()
+4. 'nltk' is nltk.word_tokenize (punkt), kept as an option; nltk is only imported when it is used
+5. Every analysis takes a `tokenizer` argument (a name or a function) and defaults to DEFAULT_TOKENIZER, so all stages see the same tokens. The corpus cache key includes the tokenizer name
+'''
+
+WORD_PATTERN = re.compile(r'\w+')
+
+
+def split_tokenize(text):
+    return text.split()
+
+
+def regex_tokenize(text):
+    return WORD_PATTERN.findall(text)
+
+
+def nltk_tokenize(text):
+    return word_tokenize(text)
+
+
+TOKENIZERS = {
+    'split': split_tokenize,
+    'regex': regex_tokenize,
+    'nltk': nltk_tokenize,
+}
+
+DEFAULT_TOKENIZER = 'split'
+
+
+def register_tokenizer(name, func):
+    """
+    Make a tokenizer function available by name to every analysis.
+    """
+    TOKENIZERS[name] = func
+
+
+def get_tokenizer(tokenizer=DEFAULT_TOKENIZER):
+    """
+    The tokenizer function for a registered name (a function is returned unchanged).
+    """
+    if callable(tokenizer):
+        return tokenizer
+    try:
+        return TOKENIZERS[tokenizer]
+    except KeyError:
+        raise ValueError(f'Unknown tokenizer {tokenizer!r}; choose one of {sorted(TOKENIZERS)}') from None
+
+
+def tokenize(text, tokenizer=DEFAULT_TOKENIZER):
+    return get_tokenizer(tokenizer)(text)
+
+
+def tokenizer_name(tokenizer=DEFAULT_TOKENIZER):
+    """
+    Name used in cache keys: the registered name, or module.qualname for an unregistered function.
+    """
+    if not callable(tokenizer):
+        get_tokenizer(tokenizer)
+        return tokenizer
+    for name, func in TOKENIZERS.items():
+        if func is tokenizer:
+            return name
+    return f'{tokenizer.__module__}.{tokenizer.__qualname__}'
+
+
+def equivalence_report(texts, tokenizers=('split', 'regex', 'nltk'), reference=DEFAULT_TOKENIZER):
+    """
+    Compare tokenizers against a reference on a dict of {label: text}.
+
+    Returns {label: {tokenizer: result}}, where result has the token count, whether the token
+    sequence is identical to the reference, the first position where the sequences differ and the
+    tokens whose counts differ ({token: (reference count, tokenizer count)}). A tokenizer that
+    cannot run (e.g. nltk without its data) gets {'error': message} instead.
+    """
+    report = {}
+    for label, text in texts.items():
+        expected = tokenize(text, reference)
+        report[label] = {}
+        for name in tokenizers:
+            try:
+                tokens = tokenize(text, name)
+            except LookupError as error:
+                report[label][name] = {'error': str(error)}
+                continue
+            first_difference = next(
+                (i for i, (a, b) in enumerate(zip(expected, tokens)) if a != b),
+                None if len(expected) == len(tokens) else min(len(expected), len(tokens)),
+            )
+            expected_counts, counts = Counter(expected), Counter(tokens)
+            report[label][name] = {
+                'n_tokens': len(tokens),
+                'identical': first_difference is None,
+                'first_difference': first_difference,
+                'count_differences': {
+                    token: (expected_counts[token], counts[token])
+                    for token in sorted(expected_counts.keys() | counts.keys())
+                    if expected_counts[token] != counts[token]
+                },
+            }
+    return report
+
+
+def print_equivalence_report(report, reference=DEFAULT_TOKENIZER, max_tokens=20):
+    for label, results in report.items():
+        print(f'{label}:')
+        for name, result in results.items():
+            if 'error' in result:
+                print(f'  {name:6s} skipped: {result["error"]}')
+                continue
+            if result['identical']:
+                print(f'  {name:6s} {result["n_tokens"]:7d} tokens, identical to {reference}')
+                continue
+            differences = result['count_differences']
+            print(f'  {name:6s} {result["n_tokens"]:7d} tokens, first difference at token {result["first_difference"]}, '
+                  f'{len(differences)} words with different counts ({reference}, {name}):')
+            for token, (expected, actual) in list(differences.items())[:max_tokens]:
+                print(f'           {token!r}: {expected} vs {actual}')
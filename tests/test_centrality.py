@@ -0,0 +1,38 @@
+import networkx as nx
+import numpy as np
+import pytest
+
+from src.centrality_measures import betweenness_centrality_sparse, eigenvector_centrality_sparse, weighted_adjacency
+
+
+@pytest.fixture
+def graph():
+    # Small connected graph with seeded integer edge weights
+    G = nx.connected_watts_strogatz_graph(40, 4, 0.3, seed=7)
+    rng = np.random.default_rng(7)
+    for u, v in G.edges:
+        G[u][v]['weight'] = int(rng.integers(1, 10))
+    return G
+
+
+@pytest.mark.parametrize('method', ['arpack', 'power'])
+def test_eigenvector_centrality_matches_networkx(graph, method):
+    nodes, W = weighted_adjacency(graph)
+    expected = nx.eigenvector_centrality_numpy(graph, weight='weight')
+    result = eigenvector_centrality_sparse(W, method=method)
+    np.testing.assert_allclose(result, [expected[node] for node in nodes], atol=1e-8)
+
+
+def test_exact_betweenness_matches_networkx(graph):
+    nodes, W = weighted_adjacency(graph)
+    expected = nx.betweenness_centrality(graph, weight='weight')
+    result, used = betweenness_centrality_sparse(W, workers=1)
+    assert used == len(nodes)
+    np.testing.assert_allclose(result, [expected[node] for node in nodes], atol=1e-12)
+
+
+def test_betweenness_does_not_depend_on_workers(graph):
+    _, W = weighted_adjacency(graph)
+    in_process, _ = betweenness_centrality_sparse(W, k=20, seed=0, workers=1, batch_size=5)
+    pooled, _ = betweenness_centrality_sparse(W, k=20, seed=0, workers=2, batch_size=5)
+    np.testing.assert_array_equal(in_process, pooled)